@@ -1,5 +1,6 @@
 from __future__ import annotations
 
+import functools
 import json
 import os
 import re
@@ -14,8 +15,8 @@ from typing import Any
 from .codex_runner import CodexProfile, CodexRunner
 from .config import BotConfig
 from .mattermost_watch import MattermostWatcher
-from .router import Router
-from .scheduler import ParallelScheduler, SchedulableEvent
+from .router import DEBOUNCE_CALLBACK_DATA, Router
+from .scheduler import ParallelScheduler, SchedulableEvent, ScopeLanes
 from .state import BotState
 from .telegram_api import TelegramAPI, TelegramDeliveryAPI
 from .ui_labels import codex_resume_label
@@ -433,6 +434,22 @@ def _restart_queue_drained(*, scheduler: ParallelScheduler[SchedulableEvent]) ->
     )
 
 
+def _callback_is_duplicate(
+    *, scheduler: ParallelScheduler[SchedulableEvent], chat_id: int, message_thread_id: int, data: str
+) -> bool:
+    """Return True for a repeat press of a Codex-running button whose previous press is still queued or running.
+
+    The scheduler never runs two jobs of one scope at once, so a double tap would otherwise start a second run
+    right after the first one finishes.
+    """
+    if data not in DEBOUNCE_CALLBACK_DATA:
+        return False
+    try:
+        return bool(scheduler.has_callback(chat_id=chat_id, message_thread_id=message_thread_id, data=data))
+    except Exception:
+        return False
+
+
 def _atomic_write_lines(path: Path, lines: list[str]) -> None:
     path.parent.mkdir(parents=True, exist_ok=True)
     tmp = path.with_suffix(path.suffix + '.tmp')
@@ -1003,7 +1020,7 @@ def _acquire_single_instance_lock(lock_path: os.PathLike[str] | str) -> object |
 def main() -> int:
     cfg = BotConfig.from_env()
 
-    state = BotState(path=cfg.state_path)
+    state = BotState(path=cfg.state_path, history_flush_delay_seconds=0.1)
     state.load()
     # Restart is a per-process action; if the previous instance exited with restart_pending=true,
     # clear the flag now so the fresh process can accept messages again (but keep enough info to
@@ -1024,6 +1041,8 @@ def main() -> int:
         prefer_local=cfg.tg_bot_api_prefer_local,
         local_probe_seconds=cfg.tg_bot_api_probe_seconds,
         log_path=tg_api_log_path,
+        rate_limit_per_second=cfg.tg_bot_api_rate_limit_per_second,
+        rate_limit_per_chat_per_second=cfg.tg_bot_api_rate_limit_per_chat_per_second,
     )
     net_log_path = cfg.repo_root / 'logs' / 'tg-bot' / 'net.log'
     topic_log_root = cfg.repo_root / 'logs' / 'tg-bot' / 'topics'
@@ -1368,6 +1387,8 @@ def main() -> int:
         summarize=_queue_event_summary,
     )
     queue_admin_refs['scheduler'] = scheduler
+    # Immediate control-plane commands run off the poll thread: ordered per chat/topic, parallel across them.
+    control_lanes = ScopeLanes(name='tg-control')
 
     router = Router(
         api=api,
@@ -1822,6 +1843,7 @@ def main() -> int:
                     # is busy with a long Codex run (they'd sit in the queue and show a stale state).
                     #
                     # NOTE: /restart and /reset intentionally respect the queue (handled by the worker).
+                    # They run in a per-scope lane, so a slow reply in one chat doesn't stall polling for others.
                     immediate_cmds_public = {'/start', '/help', '/id', '/whoami', '/status'}
                     immediate_cmds_owner_private = {
                         '/admin',
@@ -1843,8 +1865,9 @@ def main() -> int:
                         and chat_type_s == 'private'
                         and (not workspaces.is_multi_tenant() or workspaces.is_owner_chat(chat_id))
                     ):
-                        try:
-                            router.handle_text(
+                        control_lanes.submit(
+                            functools.partial(
+                                router.handle_text,
                                 chat_id=chat_id,
                                 message_thread_id=message_thread_id,
                                 user_id=user_id,
@@ -1856,9 +1879,10 @@ def main() -> int:
                                 ack_message_id=0,
                                 tg_chat=chat_meta,
                                 tg_user=user_meta,
-                            )
-                        except Exception:
-                            pass
+                            ),
+                            chat_id=chat_id,
+                            message_thread_id=message_thread_id,
+                        )
                         continue
 
                     reply_to: dict[str, object] | None = None
@@ -2624,6 +2648,25 @@ def main() -> int:
                             except Exception:
                                 pass
                             continue
+                        if _callback_is_duplicate(
+                            scheduler=scheduler, chat_id=chat_id, message_thread_id=message_thread_id, data=data
+                        ):
+                            _log_cb(
+                                {
+                                    'kind': 'callback_drop',
+                                    'reason': 'duplicate',
+                                    'chat_id': int(chat_id),
+                                    'user_id': int(user_id),
+                                    'chat_type': str(chat_type_s),
+                                    'data': data[:80],
+                                }
+                            )
+                            state.metric_inc('callback.debounced')
+                            try:
+                                api.answer_callback_query(callback_query_id=cb_id, text='⌛ Уже выполняется…')
+                            except Exception:
+                                pass
+                            continue
                         # If the main worker is busy, acknowledge the button press with a normal message too.
                         # CallbackQuery "answer" is easy to miss and disappears quickly.
                         running_n = 0
@@ -2706,6 +2749,7 @@ def main() -> int:
                                     message_id=message_id,
                                     tg_chat=chat_meta,
                                     tg_user=user_meta,
+                                    callback_answered=True,
                                 )
                                 state.metric_inc('queue.cb.bypassed')
                             except Exception as e:
@@ -3207,6 +3251,8 @@ def main() -> int:
                                 callback_query_id=item.callback_query_id,
                                 tg_chat=(item.chat_meta if isinstance(item.chat_meta, dict) else None),
                                 tg_user=(item.user_meta if isinstance(item.user_meta, dict) else None),
+                                # Answered on the poll thread when the callback was enqueued.
+                                callback_answered=True,
                             )
                         except Exception as e:
                             _log_cb(
@@ -3451,6 +3497,10 @@ def main() -> int:
     except KeyboardInterrupt:
         stop.set()
     finally:
+        try:
+            state.close()
+        except Exception:
+            pass
         try:
             if lock_handle is not None:
                 lock_handle.close()  # type: ignore[attr-defined]
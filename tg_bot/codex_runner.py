@@ -62,8 +62,13 @@ class CodexRunner:
 
     def _log(self, line: str) -> None:
         ts = time.strftime('%Y-%m-%d %H:%M:%S')
-        self.log_path.parent.mkdir(parents=True, exist_ok=True)
-        with self.log_path.open('a', encoding='utf-8') as f:
+        # The log dir almost always exists: only create it when the append fails.
+        try:
+            f = self.log_path.open('a', encoding='utf-8')
+        except FileNotFoundError:
+            self.log_path.parent.mkdir(parents=True, exist_ok=True)
+            f = self.log_path.open('a', encoding='utf-8')
+        with f:
             f.write(f'[{ts}] {line}\n')
 
     def log_note(self, line: str) -> None:
@@ -126,6 +126,8 @@ class BotConfig:
     tg_bot_api_remote_url: str
     tg_bot_api_prefer_local: bool
     tg_bot_api_probe_seconds: int
+    tg_bot_api_rate_limit_per_second: float
+    tg_bot_api_rate_limit_per_chat_per_second: float
     tg_poll_timeout_seconds: int
     tg_max_parallel_jobs: int
     tg_allowed_user_ids: list[int]
@@ -255,6 +257,10 @@ class BotConfig:
         tg_bot_api_remote_url = (os.getenv('TG_BOT_API_REMOTE_URL') or 'https://api.telegram.org').strip()
         tg_bot_api_prefer_local = _env_bool('TG_BOT_API_PREFER_LOCAL', False)
         tg_bot_api_probe_seconds = max(60, min(3600, _env_int('TG_BOT_API_PROBE_SECONDS', 300)))
+        tg_bot_api_rate_limit_per_second = max(0.0, _env_float('TG_BOT_API_RATE_LIMIT_PER_SECOND', 25.0))
+        tg_bot_api_rate_limit_per_chat_per_second = max(
+            0.0, _env_float('TG_BOT_API_RATE_LIMIT_PER_CHAT_PER_SECOND', 1.0)
+        )
 
         tg_poll_timeout_seconds = _env_int('TG_POLL_TIMEOUT_SECONDS', 25)
         tg_max_parallel_jobs = _env_int('TG_MAX_PARALLEL_JOBS', 5)
@@ -423,6 +429,8 @@ class BotConfig:
             tg_bot_api_remote_url=tg_bot_api_remote_url,
             tg_bot_api_prefer_local=tg_bot_api_prefer_local,
             tg_bot_api_probe_seconds=tg_bot_api_probe_seconds,
+            tg_bot_api_rate_limit_per_second=tg_bot_api_rate_limit_per_second,
+            tg_bot_api_rate_limit_per_chat_per_second=tg_bot_api_rate_limit_per_chat_per_second,
             tg_poll_timeout_seconds=tg_poll_timeout_seconds,
             tg_max_parallel_jobs=tg_max_parallel_jobs,
             tg_allowed_user_ids=tg_allowed_user_ids,
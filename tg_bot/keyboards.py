@@ -1,5 +1,6 @@
 from __future__ import annotations
 
+import functools
 from typing import Any
 
 # Callback data codes (must be <= 64 bytes)
@@ -184,7 +185,9 @@ def lunch_expired(*, gentle_active: bool = False) -> dict[str, Any]:
     )
 
 
+@functools.lru_cache(maxsize=2)
 def help_menu(*, gentle_active: bool = False) -> dict[str, Any]:
+    """Main help/controls menu. Memoized per gentle flag: the markup is shared, treat it as read-only."""
     gentle_btn = _gentle_button(gentle_active)
     return inline_keyboard(
         [
@@ -196,8 +199,9 @@ def help_menu(*, gentle_active: bool = False) -> dict[str, Any]:
     )
 
 
+@functools.lru_cache(maxsize=2)
 def codex_answer_menu(*, gentle_active: bool = False) -> dict[str, Any]:
-    """Inline buttons shown under Codex answers."""
+    """Inline buttons shown under Codex answers (memoized per gentle flag; shared, read-only)."""
     gentle_btn = _gentle_button(gentle_active)
     return inline_keyboard(
         [
@@ -207,8 +211,9 @@ def codex_answer_menu(*, gentle_active: bool = False) -> dict[str, Any]:
     )
 
 
+@functools.lru_cache(maxsize=1)
 def codex_answer_menu_public() -> dict[str, Any]:
-    """Inline buttons for non-owner chats (no global state actions)."""
+    """Inline buttons for non-owner chats (no global state actions; memoized, shared, read-only)."""
     return inline_keyboard(
         [
             [('✂️ Короче', CB_CX_SHORTER), ('🧾 План 3 шага', CB_CX_PLAN3), ('🧩 След. шаг', CB_CX_NEXT)],
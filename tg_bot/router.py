@@ -1,23 +1,33 @@
 from __future__ import annotations
 
 import datetime as dt
+import functools
+import hashlib
 import html
+import inspect
+import itertools
 import json
 import os
+import queue
 import re
+import reprlib
+import secrets
 import shlex
 import shutil
 import socket
 import threading
 import time
 import zipfile
-from collections.abc import Callable
+from collections import OrderedDict, deque
+from collections.abc import Callable, Iterator
 from contextlib import contextmanager
 from dataclasses import dataclass, field
 from pathlib import Path
 from typing import TYPE_CHECKING, Any
 from uuid import uuid4
 
+from . import keyboards
+from .scheduler import ScopeLanes
 from .ui_labels import codex_resume_label
 from .workspaces import WorkspaceManager
 
@@ -126,15 +136,158 @@ def _normalize_tg_bot_ctrl(obj: dict[str, Any] | None) -> dict[str, Any] | None:
 
 
 _TG_BOT_CONTROL_TAG_LINE_RE = re.compile(r'(?:\r?\n)(?:tg_bot|tg-bot|tgctl|tg_bot_ctl)\s*$')
+# Cheap gate before parsing a streamed Codex message for a control block ("tg_bot_ctl" contains "tg_bot").
+_TG_BOT_MENTION_RE = re.compile(r'tg[-_]bot|tgctl')
+_EXIT_CODE_RE = re.compile(r'Exit\s+code:\s*(\d+)')
+_APPLY_PATCH_FILE_RE = re.compile(r'^\*\*\* (?:Update|Add|Delete) File: (.+)$', re.MULTILINE)
+_TOOL_CALL_TYPES = frozenset({'function_call', 'custom_tool_call', 'tool_call'})
+_TOOL_CALL_OUTPUT_TYPES = frozenset({'function_call_output', 'custom_tool_call_output', 'tool_call_output'})
+# Per-run call_id -> name/detail maps keep at most this many (oldest dropped first).
+_TOOL_CALL_IDS_MAX = 512
+# A node without any of these keys can be neither a tool call nor a tool output.
+_TOOL_CALL_NODE_KEYS = frozenset({'type', 'kind', 'output'})
+# item.<suffix> event type -> mark shown next to the item label in exec progress.
+_ITEM_STATUS_MARKS = {'started': '…', 'completed': '✓'}
+_ITEM_PREVIEW_KEYS = ('command', 'cmd', 'path', 'file', 'query', 'pattern')
+# Codex JSON events with no useful progress text on their own.
+_IGNORED_EVENT_TYPES = frozenset(
+    {'turn.started', 'thread.started', 'turn_context', 'event_msg', 'response_item', 'session_meta'}
+)
 
 _ULTRATHINK_RE = re.compile(r'(?i)(?<!\w)ultrathink(?!\w)')
 _FASTTHINK_RE = re.compile(r'(?i)(?<!\w)fastthink(?!\w)')
-_FORCE_WRITE_KEYWORD_RE = re.compile(r'(?i)(?<!\w)реализуй(?!\w)')
+# `Router.min_profile` floor: read < write < danger (unknown values mean no floor).
+_MIN_PROFILE_RANKS = {'read': 0, 'write': 1, 'danger': 2, 'dangerous': 2}
+_FORCE_WRITE_KEYWORD = 'реализуй'
+_FORCE_WRITE_KEYWORD_RE = re.compile(rf'(?i)(?<!\w){_FORCE_WRITE_KEYWORD}(?!\w)')
 _URL_RE = re.compile(r'https?://\S+')
 _TIME_HHMM_RE = re.compile(r'(?<!\d)([01]?\d|2[0-3]):([0-5]\d)(?!\d)')
 _MODEL_CB_PREFIX = 'model:'
 _MODEL_CB_DEFAULT = '__default__'
 _MODEL_CB_PRESET = ('gpt-4.1', 'gpt-4.1-mini')
+_LUNCH_SHORTCUTS = frozenset({'обед', 'lunch'})
+_BACK_SHORTCUTS = frozenset({'я здесь', 'вернулся', 'back'})
+# Commands available in group / non-owner chats; the owner's own user additionally gets the per-user ones.
+_PUBLIC_COMMANDS = frozenset({'/start', '/help', '/id', '/whoami', '/status'})
+_PUBLIC_OWNER_USER_COMMANDS = _PUBLIC_COMMANDS | {'/reminders', '/mm-otp', '/mm-reset'}
+# Buttons usable outside the owner chat (group chats, non-owner private chats): Codex follow-ups + dismiss.
+_CALLBACK_PUBLIC_ALLOWED = frozenset(
+    {
+        keyboards.CB_CX_SHORTER,
+        keyboards.CB_CX_PLAN3,
+        keyboards.CB_CX_STATUS1,
+        keyboards.CB_CX_NEXT,
+        keyboards.CB_DISMISS,
+    }
+)
+_CALLBACK_SETTINGS = frozenset(
+    {
+        keyboards.CB_SETTINGS,
+        keyboards.CB_SETTINGS_DELIVERY_EDIT,
+        keyboards.CB_SETTINGS_DELIVERY_NEW,
+        keyboards.CB_SETTINGS_DONE_TOGGLE,
+        keyboards.CB_SETTINGS_DONE_TTL_CYCLE,
+        keyboards.CB_SETTINGS_BOT_INITIATIVES_TOGGLE,
+        keyboards.CB_SETTINGS_LIVE_CHATTER_TOGGLE,
+        keyboards.CB_SETTINGS_MCP_LIVE_TOGGLE,
+        keyboards.CB_SETTINGS_USER_IN_LOOP_TOGGLE,
+    }
+)
+_CALLBACK_ADMIN_COMMANDS = {
+    keyboards.CB_ADMIN_DOCTOR: '/doctor',
+    keyboards.CB_ADMIN_STATS: '/stats',
+    keyboards.CB_ADMIN_DROP_QUEUE: '/drop queue',
+    keyboards.CB_ADMIN_DROP_ALL: '/drop all',
+}
+# Canned texts/prompts behind the help-menu and Codex follow-up buttons.
+_EOD_PHRASE = 'давай закончим день'
+_TEMPLATE_STATUS_TEXT = (
+    '✍️ Шаблон статуса (1 строка):\n'
+    '- сделал: …\n'
+    '- дальше: …\n'
+    '- блокер: …\n\n'
+    'Можно просто ответить одной строкой — бот поймёт, что ты здесь.'
+)
+_SUMMARY_PROMPT = (
+    'Сделай краткую сводку текущего контекста работы по репозиторию.\n'
+    'Ориентируйся на notes/work/daily-brief.md, notes/work/end-of-day.md и последние файлы notes/daily-logs/.\n'
+    'Формат ответа:\n'
+    '- 3-6 буллетов: что сейчас важно\n'
+    '- 1 буллет: блокер/риск\n'
+    '- 1 буллет: следующий шаг (<=10 минут)\n'
+    '- 1 буллет: микро-шаг (<=2 минуты)\n'
+    'Без воды, до 12 строк.'
+)
+_CODEX_FOLLOWUP_PROMPTS = {
+    keyboards.CB_CX_SHORTER: 'Сократи предыдущий ответ. Оставь смысл. Формат: 5-8 строк, без воды.',
+    keyboards.CB_CX_PLAN3: 'Сделай план на 3 шага по предыдущему ответу. Каждый шаг: <=10 минут. Добавь 1 микро-шаг (<=2 минуты).',
+    keyboards.CB_CX_STATUS1: 'Сформулируй статус ОДНОЙ строкой по предыдущему ответу (что сделал/что дальше/блокер) — максимально практично.',
+    keyboards.CB_CX_NEXT: 'Назови следующий шаг прямо сейчас (<=10 минут) и микро-шаг (<=2 минуты) по предыдущему ответу.',
+}
+# Ack status title of a dangerous-override run; the detail line comes from `_route_status_detail`.
+_STATUS_DANGEROUS_TITLE = '⚠️ DANGEROUS override'
+# Mute buttons: callback -> (snooze seconds, label).
+_CALLBACK_MUTES = {
+    keyboards.CB_MUTE_30M: (30 * 60, '30м'),
+    keyboards.CB_MUTE_1H: (60 * 60, '1ч'),
+    keyboards.CB_MUTE_2H: (2 * 60 * 60, '2ч'),
+    keyboards.CB_MUTE_1D: (24 * 60 * 60, '1д'),
+}
+# Voice-route button mode letter -> route choice.
+_VOICE_ROUTE_MODES = {'r': 'read', 'w': 'write', 'd': 'danger', 'n': 'none'}
+# Callback prefix -> Router handler method. The "open" ones are dispatched before the owner/group-chat gates.
+_CALLBACK_OPEN_PREFIX_HANDLERS = {
+    keyboards.CB_VOICE_ROUTE_PREFIX: '_cb_voice_route',
+    keyboards.CB_ASK_USER_PREFIX: '_cb_ask_user',
+    _MODEL_CB_PREFIX: '_cb_model',
+}
+_CALLBACK_PREFIX_HANDLERS = {
+    keyboards.CB_QUEUE_EDIT_PREFIX: '_cb_queue_edit_mode',
+    keyboards.CB_QUEUE_DONE_PREFIX: '_cb_queue_edit_mode',
+    keyboards.CB_QUEUE_CLEAR_PREFIX: '_cb_queue_clear',
+    keyboards.CB_QUEUE_ITEM_PREFIX: '_cb_queue_item',
+    keyboards.CB_QUEUE_ACT_PREFIX: '_cb_queue_action',
+    keyboards.CB_QUEUE_PAGE_PREFIX: '_cb_queue_page',
+    keyboards.CB_DANGER_ALLOW_PREFIX: '_cb_dangerous_confirm',
+    keyboards.CB_DANGER_DENY_PREFIX: '_cb_dangerous_confirm',
+}
+# Exact callback data -> Router handler method (dispatched after the owner/group-chat gates).
+_CALLBACK_EXACT_HANDLERS = {
+    **dict.fromkeys(_CALLBACK_SETTINGS, '_cb_settings'),
+    keyboards.CB_ADMIN: '_cb_admin_menu',
+    **dict.fromkeys(_CALLBACK_ADMIN_COMMANDS, '_cb_admin_command'),
+    keyboards.CB_DISMISS: '_cb_dismiss',
+    keyboards.CB_ACK: '_cb_ack',
+    keyboards.CB_BACK: '_cb_ack',
+    keyboards.CB_LUNCH_60: '_cb_lunch',
+    **dict.fromkeys(_CALLBACK_MUTES, '_cb_mute'),
+    keyboards.CB_GENTLE_TOGGLE: '_cb_gentle_toggle',
+    keyboards.CB_STATUS: '_cb_status',
+    keyboards.CB_TEMPLATE_STATUS: '_cb_template_status',
+    keyboards.CB_SUMMARY: '_cb_summary',
+    keyboards.CB_EOD: '_cb_eod',
+    keyboards.CB_RESET: '_cb_reset',
+    **dict.fromkeys(_CODEX_FOLLOWUP_PROMPTS, '_cb_codex_followup'),
+}
+# Codex-running callbacks (derived from the dispatch above): the poll thread answers a repeat press while the same
+# one is still queued or running instead of enqueueing a second run.
+DEBOUNCE_CALLBACK_DATA = frozenset({keyboards.CB_SUMMARY, *_CODEX_FOLLOWUP_PROMPTS})
+# Button clicks within this window of the previous one (same chat+user) don't re-mark user activity.
+_CALLBACK_ACTIVITY_MIN_INTERVAL_S = 5.0
+_CALLBACK_ACTIVITY_MAX_KEYS = 512
+# Queue navigation clicks are bursty and say nothing about the conversation: counted, not written to history.
+_CALLBACK_HISTORY_SKIP_PREFIXES = frozenset(
+    {keyboards.CB_QUEUE_PAGE_PREFIX, keyboards.CB_QUEUE_EDIT_PREFIX, keyboards.CB_QUEUE_DONE_PREFIX}
+)
+# One-line rendering of history event text (`Router._bot_context_block`) and exec progress summaries (`_short`).
+_EVENT_TEXT_NL_TABLE = str.maketrans({'\n': ' ', '\r': ' ', '\t': ' '})
+_EVENT_TEXT_MAX_CHARS = 280
+# Last delivered (text, parse_mode, reply_markup) fingerprint per edited message; see `Router._try_edit_codex_answer`.
+_EDIT_FINGERPRINTS_MAX = 4096
+# Persistent workers for heartbeat Telegram I/O (typing/progress edits); a stuck chat holds at most one.
+_HEARTBEAT_IO_WORKERS = 4
+_REQUEST_ID_HEX_CHARS = 10
+_REQUEST_ID_BATCH = 64
 
 
 def _strip_ultrathink_token(s: str) -> tuple[str, bool]:
@@ -224,7 +377,8 @@ def _extract_tg_bot_control_block(answer: object) -> tuple[str, dict[str, Any] |
     if not isinstance(answer, str):
         return (str(answer) if answer is not None else ''), None
     s = answer.rstrip()
-    m = _TG_BOT_CONTROL_BLOCK_RE.search(s)
+    # The fenced block must close the text: skip the regex scan for the common "no control block" case.
+    m = _TG_BOT_CONTROL_BLOCK_RE.search(s) if s.endswith('```') else None
     if not m:
         return _extract_trailing_control_json(answer)
     obj = _extract_json_object(m.group(1))
@@ -266,29 +420,17 @@ def _heuristic_write_needed(text: str) -> bool:
     return any(w in t for w in write_verbs)
 
 
-def _heuristic_dangerous_reason(text: str) -> str | None:
-    """Best-effort detection that the request needs dangerous override.
-
-    "Dangerous" is needed when we likely require network access (web search, git push/pull,
-    downloads, installs) or host-level operations (systemd, etc).
-    """
-    s = (text or '').strip()
-    if not s:
-        return None
-    t = s.casefold()
-
-    # If it's a "how to" question, prefer not to escalate (unless it's an explicit CLI command).
-    if re.match(r'^(как|почему|зачем|что|можно ли)\b', t):
-        if not re.search(
-            r'\bgit\s+(push|pull|fetch|clone)\b|'
-            r'\b(найди|поищи|поискать|загугли|погугли)\b.*\b(в\s+сети|в\s+интернете|в\s+web|в\s+вебе)\b|'
-            r'\b(google|гугл)\b|'
-            r'https?://',
-            t,
-        ):
-            return None
-
-    checks: list[tuple[str, str]] = [
+_DANGEROUS_HOWTO_RE = re.compile(r'^(как|почему|зачем|что|можно ли)\b')
+_DANGEROUS_HOWTO_ESCALATE_RE = re.compile(
+    r'\bgit\s+(push|pull|fetch|clone)\b|'
+    r'\b(найди|поищи|поискать|загугли|погугли)\b.*\b(в\s+сети|в\s+интернете|в\s+web|в\s+вебе)\b|'
+    r'\b(google|гугл)\b|'
+    r'https?://'
+)
+# Checked in order: the first matching pattern decides the reason.
+_DANGEROUS_CHECKS: tuple[tuple[re.Pattern[str], str], ...] = tuple(
+    (re.compile(pattern, re.M), reason)
+    for pattern, reason in (
         # Git network operations
         (r'\bgit\s+(push|pull|fetch|clone)\b', 'git (нужна сеть)'),
         (r'\b(запушь|пушни|пушь|пушнуть|запулли|запулл|запуллить)\b', 'git (пуш/пулл, нужна сеть)'),
@@ -306,19 +448,32 @@ def _heuristic_dangerous_reason(text: str) -> str | None:
         # Host/system operations
         (r'\b(systemctl|journalctl)\b', 'операции на хосте'),
         # Paths outside the repo (best-effort)
-        (r'(?m)(^|\s)/(etc|var|usr|opt|srv|run|root|home|tmp)/', 'доступ к файлам вне репозитория'),
+        (r'(^|\s)/(etc|var|usr|opt|srv|run|root|home|tmp)/', 'доступ к файлам вне репозитория'),
         (r'\b(в\s+другой\s+папке|вне\s+репозитория|outside\s+the\s+repo)\b', 'доступ к файлам вне репозитория'),
-        (r'(?m)(^|\s)~/(?:\S+)', 'доступ к файлам вне репозитория'),
+        (r'(^|\s)~/(?:\S+)', 'доступ к файлам вне репозитория'),
         (r'[a-zA-Z]:\\\\', 'доступ к файлам вне репозитория'),
-    ]
+    )
+)
 
-    for pattern, reason in checks:
-        try:
-            if re.search(pattern, t):
-                return reason
-        except re.error:
-            continue
 
+def _heuristic_dangerous_reason(text: str) -> str | None:
+    """Best-effort detection that the request needs dangerous override.
+
+    "Dangerous" is needed when we likely require network access (web search, git push/pull,
+    downloads, installs) or host-level operations (systemd, etc).
+    """
+    s = (text or '').strip()
+    if not s:
+        return None
+    t = s.casefold()
+
+    # If it's a "how to" question, prefer not to escalate (unless it's an explicit CLI command).
+    if _DANGEROUS_HOWTO_RE.match(t) and not _DANGEROUS_HOWTO_ESCALATE_RE.search(t):
+        return None
+
+    for pattern, reason in _DANGEROUS_CHECKS:
+        if pattern.search(t):
+            return reason
     return None
 
 
@@ -376,6 +531,291 @@ def _one_line(text: str, max_chars: int) -> str:
     return s
 
 
+def _md_is_safe(text: str) -> bool:
+    """Return True if legacy Telegram `Markdown` entities in `text` look balanced (single pass).
+
+    Conservative: nested entities, unterminated markers and bare `[...]` without a link target are
+    reported as unsafe, so the caller can send plain text instead of a request Telegram would reject.
+    """
+    n = len(text)
+    i = 0
+    while i < n:
+        ch = text[i]
+        if ch == '\\':
+            i += 2
+            continue
+        if ch == '`':
+            fence = '```' if text.startswith('```', i) else '`'
+            end = text.find(fence, i + len(fence))
+            if end < 0:
+                return False
+            i = end + len(fence)
+            continue
+        if ch == '*' or ch == '_':
+            j = i + 1
+            while j < n and text[j] != ch:
+                if text[j] in '*_`[':
+                    return False
+                j += 1
+            if j >= n:
+                return False
+            i = j + 1
+            continue
+        if ch == '[':
+            close = text.find(']', i + 1)
+            if close < 0 or not text.startswith('(', close + 1):
+                return False
+            end = text.find(')', close + 2)
+            if end < 0 or '[' in text[i + 1 : close]:
+                return False
+            i = end + 1
+            continue
+        i += 1
+    return True
+
+
+def _route_status_detail(
+    reason: str, reasoning_effort: str, think_suffix: str, profile_name: str, exec_mode: str, resume_label: str
+) -> str:
+    """Ack status detail shown once the route/profile is chosen (shared by the dangerous and regular paths)."""
+    return (
+        f'{reason} (reasoning={reasoning_effort}{think_suffix})\n'
+        f'▶️ Codex: profile={profile_name} {exec_mode}; {resume_label}'
+    )
+
+
+def _dangerous_confirmation_job(
+    *,
+    payload: str,
+    attachments: list[dict[str, Any]] | None,
+    reply_to: dict[str, Any] | None,
+    received_ts: float,
+    user_id: int,
+    message_id: int,
+    message_thread_id: int,
+    tg_chat: dict[str, Any] | None,
+    tg_user: dict[str, Any] | None,
+    now_ts: float,
+    ttl_seconds: int,
+    reason: str,
+) -> dict[str, Any]:
+    """Pending dangerous-confirmation job: the only copy of the message context (BotState stores it as is)."""
+    return {
+        'payload': payload,
+        'attachments': list(attachments or []),
+        'reply_to': dict(reply_to) if isinstance(reply_to, dict) else None,
+        'sent_ts': float(received_ts or 0.0),
+        'user_id': int(user_id or 0),
+        'message_id': int(message_id or 0),
+        'message_thread_id': int(message_thread_id or 0),
+        'tg_chat': dict(tg_chat) if isinstance(tg_chat, dict) else None,
+        'tg_user': dict(tg_user) if isinstance(tg_user, dict) else None,
+        'created_ts': float(now_ts),
+        'expires_ts': float(now_ts + ttl_seconds),
+        'reason': reason,
+    }
+
+
+def _accepted_kwargs(fn: object) -> frozenset[str] | None:
+    """Names of keyword arguments `fn` accepts; None if it takes **kwargs or can't be introspected."""
+    try:
+        params = inspect.signature(fn).parameters.values()  # type: ignore[arg-type]
+    except (TypeError, ValueError):
+        return None
+    names: set[str] = set()
+    for p in params:
+        if p.kind is inspect.Parameter.VAR_KEYWORD:
+            return None
+        if p.kind in (inspect.Parameter.POSITIONAL_OR_KEYWORD, inspect.Parameter.KEYWORD_ONLY):
+            names.add(p.name)
+    return frozenset(names)
+
+
+_request_id_pool: deque[str] = deque()
+_request_id_lock = threading.Lock()
+
+
+def _next_request_id() -> str:
+    """Short random id for confirmation callbacks; entropy is drawn in batches of `_REQUEST_ID_BATCH`."""
+    with _request_id_lock:
+        if not _request_id_pool:
+            n = _REQUEST_ID_HEX_CHARS
+            raw = secrets.token_hex(n * _REQUEST_ID_BATCH // 2)
+            _request_id_pool.extend(raw[i : i + n] for i in range(0, len(raw), n))
+        return _request_id_pool.popleft()
+
+
+# Codex exec-event summarizing helpers (used by the progress stream in Router.handle_text).
+_ARGS_PREVIEW_REPR = reprlib.Repr()
+_ARGS_PREVIEW_REPR.maxstring = 160
+_ARGS_PREVIEW_REPR.maxother = 160
+_ARGS_PREVIEW_REPR.maxlevel = 2
+
+
+def _fmt_elapsed(ts: float, started_ts: float) -> str:
+    elapsed = max(0, int(ts - started_ts))
+    hh, rem = divmod(elapsed, 3600)
+    mm, ss = divmod(rem, 60)
+    if hh > 0:
+        return f'+{hh}:{mm:02d}:{ss:02d}'
+    return f'+{mm}:{ss:02d}'
+
+
+def _short(s: str, n: int) -> str:
+    s = (s or '').translate(_EVENT_TEXT_NL_TABLE).strip()
+    if n <= 0 or len(s) <= n:
+        return s
+    return s[: max(0, n - 1)] + '…'
+
+
+def _exit_code_from_output(text: object) -> int | None:
+    if not isinstance(text, str) or not text.strip():
+        return None
+    m = _EXIT_CODE_RE.search(text)
+    if not m:
+        return None
+    try:
+        return int(m.group(1))
+    except Exception:
+        return None
+
+
+def _exit_code_from_tool_output(text: object) -> int | None:
+    obj: object = None
+    if isinstance(text, dict):
+        obj = text
+    elif isinstance(text, str) and '"exit_code"' in text:
+        # Outputs can be multi-KB; only parse the ones that can carry an exit code at all.
+        try:
+            obj = json.loads(text)
+        except Exception:
+            obj = None
+    if not isinstance(obj, dict):
+        return None
+    meta = obj.get('metadata')
+    if not isinstance(meta, dict):
+        return None
+    exit_code_raw = meta.get('exit_code')
+    if isinstance(exit_code_raw, bool):
+        return None
+    if isinstance(exit_code_raw, (int, float)):
+        return int(exit_code_raw)
+    if isinstance(exit_code_raw, str):
+        try:
+            return int(exit_code_raw.strip())
+        except Exception:
+            return None
+    return None
+
+
+def _detail_from_args(tool_name: str, args_raw: object) -> str:
+    args: object = None
+    if isinstance(args_raw, dict):
+        args = args_raw
+    elif isinstance(args_raw, str) and args_raw.strip():
+        try:
+            args = json.loads(args_raw)
+        except Exception:
+            return _short(args_raw, 140)
+    else:
+        return ''
+    if not isinstance(args, dict):
+        return _short(str(args_raw), 140)
+    cmd = args.get('command')
+    if tool_name == 'shell_command' and isinstance(cmd, str) and cmd.strip():
+        return _short(cmd.strip(), 140)
+    # Bounded preview instead of json.dumps of the whole dict: tool args can be kilobytes and only ~140 chars are shown.
+    parts: list[str] = []
+    total = 0
+    for k, v in args.items():
+        part = f'{k}={_ARGS_PREVIEW_REPR.repr(v)}'
+        parts.append(part)
+        total += len(part) + 2
+        if total > 160:
+            break
+    return _short(', '.join(parts), 140)
+
+
+def _detail_from_tool_input(tool_name: str, raw: object) -> str:
+    if not isinstance(raw, str) or not raw.strip():
+        return ''
+    if tool_name == 'apply_patch':
+        files: list[str] = _APPLY_PATCH_FILE_RE.findall(raw)
+        files = [f.strip() for f in files if f.strip()]
+        if files:
+            if len(files) == 1:
+                return str(files[0])
+            return f'{files[0]} (+{len(files) - 1})'
+    return _short(raw.strip(), 120)
+
+
+def _safe_int(s: str, default: int = 0) -> int:
+    """`int(s)` for a plain (optionally negative) decimal string, else `default` -- no exception round-trip."""
+    digits = s[1:] if s[:1] == '-' else s
+    return int(s) if digits.isdecimal() else default
+
+
+# Queue page order: (bucket, runtime_queue_snapshot() key of its head list), plus the row mark per bucket.
+_QUEUE_BUCKET_HEADS = (('prio', 'prio_head'), ('main', 'main_head'), ('paused', 'paused_head'), ('spool', 'spool_head'))
+_QUEUE_BUCKET_MARKS = {'prio': 'P', 'main': 'M', 'paused': '⏸', 'spool': 'S'}
+# A queue page needing more head rows than this first checks the real queue length (page numbers come from
+# callback data, so a stale or crafted one must not size the snapshot).
+_QUEUE_SNAPSHOT_ROWS_MAX = 100
+
+
+def _iter_queue_items(snap: dict[str, Any]) -> Iterator[tuple[str, int, str]]:
+    """Yield `(bucket, index_in_bucket, text)` for the non-empty queue heads in page order."""
+    for bucket, key in _QUEUE_BUCKET_HEADS:
+        head = snap.get(key)
+        if not isinstance(head, list):
+            continue
+        for bi, s in enumerate(head):
+            if isinstance(s, str):
+                s = s.strip()
+                if s:
+                    yield bucket, bi, s
+
+
+def _extract_message_id(resp: Any) -> int:
+    """`result.message_id` of a Telegram API response, or 0 (failed/deferred sends have none)."""
+    try:
+        return int(resp['result']['message_id'] or 0)
+    except (KeyError, TypeError, ValueError):
+        return 0
+
+
+def _edit_fingerprint(text: str, parse_mode: str | None, reply_markup: dict[str, Any] | None) -> bytes:
+    h = hashlib.blake2b(text.encode('utf-8', errors='replace'), digest_size=8)
+    h.update(b'\x00' + (parse_mode or '').encode('utf-8'))
+    if reply_markup:
+        h.update(b'\x00' + json.dumps(reply_markup, ensure_ascii=False, sort_keys=True).encode('utf-8'))
+    return h.digest()
+
+
+def _attachment_path_lines(attachments: list[Any]) -> list[str]:
+    """Render `- name (kind): path` lines for prompt attachment lists (skips entries without a path)."""
+    out: list[str] = []
+    append = out.append
+    for a in attachments:
+        if not isinstance(a, dict):
+            continue
+        path = a.get('path')
+        if not isinstance(path, str):
+            continue
+        path = path.strip()
+        if not path:
+            continue
+        name = a.get('name')
+        name = name.strip() if isinstance(name, str) else ''
+        kind = a.get('kind')
+        kind_s = str(kind).strip() if kind else ''
+        if kind_s:
+            append(f'- {name or path} ({kind_s}): {path}')
+        else:
+            append(f'- {name or path}: {path}')
+    return out
+
+
 def _attachment_brief_list(attachments: list[dict[str, Any]], *, limit: int = 8) -> list[str]:
     out: list[str] = []
     n = 0
@@ -480,16 +920,23 @@ def _reminder_reply_write_hint(*, user_text: str, reply_to: dict[str, Any] | Non
     return bool(has_move_verb or time_only or t_cf.startswith('на '))
 
 
+# Both formats have minute resolution, so results are cached per epoch minute (context blocks
+# format many timestamps that fall into the same few minutes).
+@functools.lru_cache(maxsize=8192)
+def _fmt_minute(minute: int, fmt: str) -> str:
+    return dt.datetime.fromtimestamp(minute * 60).strftime(fmt)
+
+
 def _fmt_time(ts: float) -> str:
     try:
-        return dt.datetime.fromtimestamp(ts).strftime('%H:%M')
+        return _fmt_minute(int(ts // 60), '%H:%M')
     except Exception:
         return '??:??'
 
 
 def _fmt_dt(ts: float) -> str:
     try:
-        return dt.datetime.fromtimestamp(ts).strftime('%Y-%m-%d %H:%M')
+        return _fmt_minute(int(ts // 60), '%Y-%m-%d %H:%M')
     except Exception:
         return '?'
 
@@ -592,6 +1039,215 @@ def _split_by_rendered_len(raw: str, *, render: Any, max_chars: int) -> list[str
     return out
 
 
+# Static prompt blocks for `Router._wrap_user_prompt` (only gated by per-chat Settings toggles).
+_MCP_TELEGRAM_BLOCK: tuple[str, ...] = (
+    'Telegram (MCP):',
+    '- Отправить текст в чат/топик: `mcp__telegram-send__send_message` (передай `chat_id` + `message_thread_id`).',
+    '- Отправить файл(ы) в чат/топик: `mcp__telegram-send__send_files` '
+    '(передай `paths[]`, опционально `caption`, и `chat_id` + `message_thread_id`).',
+    '- Переименовать текущий topic: `mcp__telegram-send__edit_forum_topic`.',
+)
+_MCP_FOLLOWUPS_ON_BLOCK: tuple[str, ...] = (
+    'Telegram follow-ups (MCP):',
+    '- Читать follow-ups во время работы: `mcp__telegram-followups__get_followups` / `mcp__telegram-followups__wait_followups` '
+    '(используй `after_message_id`, чтобы не повторяться).',
+    '- После обработки follow-ups: `mcp__telegram-followups__ack_followups` (чтобы бот не продублировал их из очереди).',
+)
+_MCP_FOLLOWUPS_OFF_BLOCK: tuple[str, ...] = ('Telegram follow-ups (MCP): отключено в Settings этого чата.',)
+_MCP_ASK_USER_OFF_BLOCK: tuple[str, ...] = (
+    'Blocking вопросы (ask_user): отключено в Settings этого чата. '
+    'Если не хватает данных — выбери безопасный дефолт и перечисли вопросы в ответе.',
+)
+_MCP_NOTE_BLOCK: tuple[str, ...] = (
+    'Примечание по MCP:',
+    '- `list_mcp_resources`/`list_mcp_resource_templates` могут вернуть пусто, даже если MCP-инструменты доступны.',
+    '- Для memory-сервера проверь `mcp__server-memory__read_graph` (или `codex mcp list --json` как shell-команду).',
+)
+
+
+# Extra safety instructions for write/danger runs in a parallel scheduler (`Router._parallel_write_safety_block`).
+_PARALLEL_WRITE_SAFETY_BLOCK = (
+    '\n'.join(
+        [
+            '----- PARALLEL_WRITE_SAFETY -----',
+            'Важно: этот запуск может идти параллельно с другими запусками Codex в том же репозитории '
+            '(файлы могут изменяться во время твоей работы).',
+            'Правила:',
+            '1) Никаких разрушительных действий без явного запроса пользователя: `git reset --hard`, '
+            '`git clean -fdx`, `rm -rf`, откат/чистка рабочего дерева, удаление чужих изменений.',
+            '2) Перед правкой файлов перечитывай их прямо перед `apply_patch`. Если патч не применился из‑за изменений '
+            'или видишь конфликт/дрейф — остановись и сообщи пользователю; НЕ пытайся «починить» через откат.',
+            '3) Держи дифф минимальным: без массовых форматирований/реорганизаций и без удаления «лишнего».',
+            '----- END_PARALLEL_WRITE_SAFETY -----',
+        ]
+    )
+    + '\n'
+)
+
+
+class _HeartbeatStop(threading.Event):
+    """Stop flag that also wakes the shared heartbeat loop so it can drop the entry promptly."""
+
+    def __init__(self, wake: threading.Event) -> None:
+        super().__init__()
+        self._wake_scheduler = wake
+
+    def set(self) -> None:
+        super().set()
+        self._wake_scheduler.set()
+
+
+class _HeartbeatHandle:
+    """Join/is_alive view of one registered heartbeat (mirrors the old per-request thread contract)."""
+
+    def __init__(self, *, stop: threading.Event, tick: Callable[[float], Callable[[], None] | None]) -> None:
+        self.stop = stop
+        self.tick = tick
+        self.lock = threading.Lock()
+        # Cleared while a tick or the Telegram I/O it returned is running.
+        self.idle = threading.Event()
+        self.idle.set()
+
+    def join(self, timeout: float | None = None) -> None:
+        # Sync with the scheduler's stop check: after this, no new tick can start for a stopped heartbeat.
+        with self.lock:
+            pass
+        self.idle.wait(timeout)
+
+    def is_alive(self) -> bool:
+        return not self.idle.is_set()
+
+
+class _HeartbeatIO:
+    """Small pool of long-lived daemon workers running the Telegram I/O returned by heartbeat ticks.
+
+    Workers are started on demand up to `max_workers` and then kept, blocked on the queue, for the next round.
+    """
+
+    def __init__(self, *, max_workers: int, name: str) -> None:
+        self._max_workers = max(1, int(max_workers))
+        self._name = name
+        self._lock = threading.Lock()
+        self._queue: queue.SimpleQueue[Callable[[], None]] = queue.SimpleQueue()
+        self._workers = 0
+        self._idle = 0
+
+    def submit(self, fn: Callable[[], None]) -> None:
+        with self._lock:
+            self._queue.put(fn)
+            if self._idle > 0:
+                self._idle -= 1
+                return
+            if self._workers >= self._max_workers:
+                return
+            self._workers += 1
+        threading.Thread(target=self._work, name=self._name, daemon=True).start()
+
+    def _work(self) -> None:
+        while True:
+            fn = self._queue.get()
+            try:
+                fn()
+            except Exception:
+                pass
+            with self._lock:
+                self._idle += 1
+
+
+class _HeartbeatScheduler:
+    """One daemon thread ticking every registered heartbeat (instead of a thread per in-flight request).
+
+    The thread is started on demand and exits once the registry is empty. Ticks only decide what is due;
+    the Telegram I/O they return runs on a few persistent `_HeartbeatIO` workers, so one slow or throttled
+    chat ties up a single worker instead of the tick loop. A heartbeat whose previous I/O is still in flight
+    skips the round instead of queueing.
+    """
+
+    def __init__(self, *, tick_seconds: float = 0.5) -> None:
+        self.tick_seconds = float(tick_seconds)
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._handles: list[_HeartbeatHandle] = []
+        self._thread: threading.Thread | None = None
+        self._on_round: Callable[[float], None] | None = None
+        self._io = _HeartbeatIO(max_workers=_HEARTBEAT_IO_WORKERS, name='tg-heartbeat-io')
+        self._round_idle = threading.Event()
+        self._round_idle.set()
+
+    def register(
+        self,
+        tick: Callable[[float], Callable[[], None] | None],
+        *,
+        on_round: Callable[[float], None] | None = None,
+    ) -> tuple[threading.Event, _HeartbeatHandle]:
+        stop = _HeartbeatStop(self._wake)
+        handle = _HeartbeatHandle(stop=stop, tick=tick)
+        with self._lock:
+            self._handles.append(handle)
+            if on_round is not None:
+                self._on_round = on_round
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop, name='tg-heartbeat', daemon=True)
+                self._thread.start()
+        return stop, handle
+
+    def _loop(self) -> None:
+        while True:
+            with self._lock:
+                self._handles = [h for h in self._handles if not h.stop.is_set()]
+                if not self._handles:
+                    self._thread = None
+                    return
+                handles = list(self._handles)
+                on_round = self._on_round
+            now_ts = time.time()
+            if on_round is not None and self._round_idle.is_set():
+                self._round_idle.clear()
+                round_io = functools.partial(on_round, now_ts)
+                self._io.submit(functools.partial(self._run_io, round_io, self._round_idle))
+            for h in handles:
+                with h.lock:
+                    if h.stop.is_set() or not h.idle.is_set():
+                        continue
+                    h.idle.clear()
+                try:
+                    io = h.tick(now_ts)
+                except Exception:
+                    io = None
+                if io is None:
+                    h.idle.set()
+                    continue
+                self._io.submit(functools.partial(self._run_io, io, h.idle))
+            self._wake.wait(self.tick_seconds)
+            self._wake.clear()
+
+    @staticmethod
+    def _run_io(fn: Callable[[], None], done: threading.Event) -> None:
+        try:
+            fn()
+        finally:
+            done.set()
+
+
+@dataclass(frozen=True)
+class _CallbackQuery:
+    """One inline-button press as seen by the `Router._cb_*` handlers (ids already coerced)."""
+
+    chat_id: int
+    message_thread_id: int
+    user_id: int
+    data: str
+    prefix: str  # '<head>:' of a prefixed callback, '' for exact-match ones
+    tail: str  # payload after the prefix (stripped)
+    callback_query_id: str
+    message_id: int
+    ack_message_id: int
+    tg_chat: dict[str, Any] | None
+    tg_user: dict[str, Any] | None
+    multi_tenant: bool
+    is_owner: bool
+
+
 @dataclass(frozen=True)
 class RouteDecision:
     mode: str  # "read" | "write"
@@ -653,6 +1309,117 @@ class Router:
     runtime_queue_edit_set: Callable[[bool], None] | None = None
 
     _tg_thread_ctx: threading.local = field(default_factory=threading.local, init=False, repr=False, compare=False)
+    _force_prefix_re: re.Pattern[str] = field(init=False, repr=False, compare=False)
+    _force_mode_re: re.Pattern[str] = field(init=False, repr=False, compare=False)
+    _owner_chat_int: int = field(init=False, repr=False, compare=False)
+    _min_profile_rank: int = field(init=False, repr=False, compare=False)
+    _api_send_params: frozenset[str] | None = field(init=False, repr=False, compare=False)
+    _eod_text: str = field(init=False, repr=False, compare=False)
+    _edit_fingerprints: OrderedDict[tuple[int, int], bytes] = field(
+        default_factory=OrderedDict, init=False, repr=False, compare=False
+    )
+    _edit_fingerprints_lock: threading.Lock = field(
+        default_factory=threading.Lock, init=False, repr=False, compare=False
+    )
+    _heartbeats: _HeartbeatScheduler = field(default_factory=_HeartbeatScheduler, init=False, repr=False, compare=False)
+    _heartbeat_last_flush: list[float] = field(default_factory=lambda: [0.0], init=False, repr=False, compare=False)
+    # Inline-keyboard edits from button handlers: off the handler thread, FIFO per chat.
+    _markup_lanes: ScopeLanes = field(
+        default_factory=lambda: ScopeLanes(name='tg-markup'), init=False, repr=False, compare=False
+    )
+    # (chat_id, user_id) -> monotonic ts of the last button click persisted via mark_user_activity.
+    _callback_activity_ts: dict[tuple[int, int], float] = field(
+        default_factory=dict, init=False, repr=False, compare=False
+    )
+    # (chat_id, message_id) -> token of the newest queued keyboard edit; older queued edits are dropped.
+    _markup_latest: dict[tuple[int, int], object] = field(default_factory=dict, init=False, repr=False, compare=False)
+    _markup_latest_lock: threading.Lock = field(default_factory=threading.Lock, init=False, repr=False, compare=False)
+
+    def __post_init__(self) -> None:
+        # Router override prefixes (∆/!/?) may be chained: strip all of them in one anchored match.
+        prefixes = {
+            (p or '').strip() for p in (self.force_danger_prefix, self.force_write_prefix, self.force_read_prefix)
+        }
+        alts = '|'.join(re.escape(p) for p in sorted((p for p in prefixes if p), key=len, reverse=True))
+        object.__setattr__(self, '_force_prefix_re', re.compile(rf'^(?:(?:{alts})\s*)+' if alts else r'(?!)'))
+        # Routing override: danger (optionally chained with write/read, which is then ignored) | write | read.
+        # Alternation order mirrors the precedence danger > write > read.
+        dp, wp, rp = (
+            re.escape(p) if p else ''
+            for p in (self.force_danger_prefix, self.force_write_prefix, self.force_read_prefix)
+        )
+        chained = '|'.join(p for p in (wp, rp) if p)
+        branches = []
+        if dp:
+            branches.append(rf'(?P<danger>{dp})' + (rf'\s*(?:{chained})?' if chained else ''))
+        if wp:
+            branches.append(rf'(?P<write>{wp})')
+        if rp:
+            branches.append(rf'(?P<read>{rp})')
+        mode_re = re.compile('^(?:' + '|'.join(branches) + ')' if branches else r'(?!)')
+        object.__setattr__(self, '_force_mode_re', mode_re)
+        # 0 means single-tenant mode (no owner chat configured).
+        object.__setattr__(self, '_owner_chat_int', int(self.owner_chat_id or 0))
+        object.__setattr__(
+            self, '_min_profile_rank', _MIN_PROFILE_RANKS.get((self.min_profile or 'read').strip().lower(), 0)
+        )
+        # Keyword args `api.send_message` accepts (None: anything). Simple API fakes in tests take fewer kwargs.
+        object.__setattr__(self, '_api_send_params', _accepted_kwargs(getattr(self.api, 'send_message', None)))
+        # Text the end-of-day button submits on the user's behalf (forced write mode).
+        object.__setattr__(self, '_eod_text', f'{self.force_write_prefix}{_EOD_PHRASE}')
+
+    def _edit_reply_markup_async(
+        self,
+        *,
+        chat_id: int,
+        message_id: int,
+        reply_markup: dict[str, Any] | None = None,
+        build_markup: Callable[[], dict[str, Any] | None] | None = None,
+    ) -> None:
+        """Fire-and-forget `editMessageReplyMarkup` (best-effort) on a per-chat lane.
+
+        Keyboard edits queued here reach Telegram in order, and only the newest one per message is sent: one
+        still queued when a newer one arrives is dropped. The lane is not ordered against synchronous edits, so
+        a handler that edits the same message again afterwards must use `_edit_reply_markup` instead.
+        `build_markup`, if given, builds the keyboard on the lane thread instead of `reply_markup`.
+        """
+        key = (int(chat_id), int(message_id))
+        token = object()
+
+        def _edit() -> None:
+            with self._markup_latest_lock:
+                if self._markup_latest.get(key) is not token:
+                    return
+                del self._markup_latest[key]
+            markup = build_markup() if build_markup is not None else reply_markup
+            self._edit_reply_markup(chat_id=chat_id, message_id=message_id, reply_markup=markup)
+
+        with self._markup_latest_lock:
+            self._markup_latest[key] = token
+        self._markup_lanes.submit(_edit, chat_id=chat_id)
+
+    def _edit_reply_markup(self, *, chat_id: int, message_id: int, reply_markup: dict[str, Any] | None) -> None:
+        """Best-effort `editMessageReplyMarkup` on the calling thread."""
+        try:
+            self.api.edit_message_reply_markup(chat_id=chat_id, message_id=message_id, reply_markup=reply_markup)
+        except Exception:
+            pass
+        # The keyboard is part of the edit fingerprint: whatever was stored for the message before this edit
+        # (even while it sat in the lane) is stale now. Dropping one that is still current only costs a re-send.
+        self._forget_edit((int(chat_id), int(message_id)))
+
+    def _split_force_mode(self, payload: str) -> tuple[str | None, str]:
+        """Return `(mode, payload)` where mode is danger/write/read if `payload` starts with an override prefix."""
+        m = self._force_mode_re.match(payload)
+        if not m:
+            return None, payload
+        mode = 'danger' if m.group('danger') is not None else ('write' if m.group('write') is not None else 'read')
+        return mode, payload[m.end() :].strip()
+
+    def _strip_force_prefixes(self, text: str) -> str:
+        """Strip leading (possibly chained) router override prefixes from `text`."""
+        m = self._force_prefix_re.match(text)
+        return text[m.end() :] if m else text
 
     @contextmanager
     def _tg_scope_ctx(self, *, chat_id: int, message_thread_id: int = 0) -> Any:
@@ -691,7 +1458,11 @@ class Router:
         return tid_i if tid_i > 0 else None
 
     def _is_owner_chat(self, chat_id: int) -> bool:
-        return int(self.owner_chat_id or 0) != 0 and int(chat_id) == int(self.owner_chat_id)
+        return self._owner_chat_int != 0 and int(chat_id) == self._owner_chat_int
+
+    def _owner_chat_allowed(self, chat_id: int) -> bool:
+        """Owner-only features: allowed in single-tenant mode or in the owner chat."""
+        return self._owner_chat_int == 0 or int(chat_id) == self._owner_chat_int
 
     def _maybe_autorename_topic(self, *, chat_id: int, message_thread_id: int, payload: str, mode: str) -> None:
         if int(chat_id) <= 0:
@@ -699,7 +1470,7 @@ class Router:
         tid = int(message_thread_id or 0)
         if tid <= 0:
             return
-        multi_tenant = int(self.owner_chat_id or 0) != 0
+        multi_tenant = self._owner_chat_int != 0
         if multi_tenant and not self._is_owner_chat(chat_id):
             return
         try:
@@ -739,7 +1510,7 @@ class Router:
 
     def _codex_context(self, chat_id: int) -> tuple[Path, str]:
         paths = self.workspaces.ensure_workspace(chat_id)
-        multi_tenant = int(self.owner_chat_id or 0) != 0
+        multi_tenant = self._owner_chat_int != 0
         env_policy = 'restricted' if (multi_tenant and not self._is_owner_chat(chat_id)) else 'full'
         return (paths.repo_root, env_policy)
 
@@ -760,7 +1531,7 @@ class Router:
             'mcp_servers.telegram-send.env.TG_MCP_FOLLOWUPS_ENABLED': '0',
         }
 
-        multi_tenant = int(self.owner_chat_id or 0) != 0
+        multi_tenant = self._owner_chat_int != 0
         is_owner = (not multi_tenant) or self._is_owner_chat(chat_id)
         if not is_owner:
             return overrides
@@ -880,10 +1651,23 @@ class Router:
     def _maybe_edit_ack(self, *, chat_id: int, message_id: int, text: str) -> None:
         if message_id <= 0:
             return
+        # Status/progress edits often repeat the same text: don't spend a request on an unchanged message.
+        edit_key = (int(chat_id), int(message_id))
+        fingerprint = _edit_fingerprint(text, None, None)
+        if self._edit_is_unchanged(edit_key, fingerprint):
+            return
         try:
             self.api.edit_message_text(chat_id=chat_id, message_id=message_id, text=text)
         except Exception:
-            pass
+            return
+        self._remember_edit(edit_key, fingerprint)
+
+    def _api_send_message(self, **kwargs: Any) -> Any:
+        """`api.send_message` with the kwargs it doesn't support dropped (thread/coalesce-less fakes)."""
+        accepted = self._api_send_params
+        if accepted is not None:
+            kwargs = {k: v for k, v in kwargs.items() if k in accepted}
+        return self.api.send_message(**kwargs)
 
     def _ack_coalesce_key_for_text(self, *, chat_id: int, message_id: int) -> str:
         try:
@@ -920,6 +1704,7 @@ class Router:
                 fn(chat_id=int(chat_id), coalesce_key=ck, text=text)
             except Exception:
                 pass
+            self._forget_edit_by_coalesce_key(chat_id=int(chat_id), coalesce_key=ck)
 
     def _send_done_notice(
         self, *, chat_id: int, reply_to_message_id: int | None, delete_after_seconds: int = 300
@@ -931,29 +1716,18 @@ class Router:
         """
         if int(chat_id) == 0:
             return
-        from . import keyboards
 
         done_key = f'done:{int(chat_id)}:{int(reply_to_message_id or 0)}:{uuid4().hex[:8]}'
         try:
-            try:
-                resp = self.api.send_message(
-                    chat_id=int(chat_id),
-                    message_thread_id=self._tg_message_thread_id(),
-                    text='✅ Готово',
-                    reply_to_message_id=(int(reply_to_message_id) if reply_to_message_id else None),
-                    reply_markup=keyboards.dismiss_menu(),
-                    coalesce_key=done_key,
-                    timeout=10,
-                )
-            except TypeError:
-                # Backward-compatible with tests/fakes.
-                resp = self.api.send_message(
-                    chat_id=int(chat_id),
-                    text='✅ Готово',
-                    reply_to_message_id=(int(reply_to_message_id) if reply_to_message_id else None),
-                    reply_markup=keyboards.dismiss_menu(),
-                    timeout=10,
-                )
+            resp = self._api_send_message(
+                chat_id=int(chat_id),
+                message_thread_id=self._tg_message_thread_id(),
+                text='✅ Готово',
+                reply_to_message_id=(int(reply_to_message_id) if reply_to_message_id else None),
+                reply_markup=keyboards.dismiss_menu(),
+                coalesce_key=done_key,
+                timeout=10,
+            )
         except Exception:
             self.state.metric_inc('delivery.done.send_fail')
             return
@@ -969,11 +1743,7 @@ class Router:
             pass
 
         # Fallback: in-memory timer (best-effort).
-        msg_id = 0
-        try:
-            msg_id = int(((resp.get('result') or {}) if isinstance(resp, dict) else {}).get('message_id') or 0)
-        except Exception:
-            msg_id = 0
+        msg_id = _extract_message_id(resp)
 
         if msg_id <= 0 or int(delete_after_seconds) <= 0:
             return
@@ -1110,44 +1880,25 @@ class Router:
                 status: dict[str, str] = {'title': '🔌 Сеть восстановилась. Продолжаю задачу…', 'detail': ''}
             else:
                 status = {'title': '🔄 Бот перезапустился. Продолжаю задачу…', 'detail': ''}
-            ack_id = 0
             try:
                 ack_id_from_job = int(job.get('ack_message_id') or 0)
             except Exception:
                 ack_id_from_job = 0
             ack_key = self._ack_coalesce_key_for_text(chat_id=chat_id, message_id=msg_id)
-            ack_id_from_state = (
-                int(self.state.tg_message_id_for_coalesce_key(chat_id=chat_id, coalesce_key=ack_key) or 0)
-                if ack_key
-                else 0
+            ack_id = self.state.resolve_ack_message_id(
+                chat_id=chat_id, coalesce_key=ack_key, fallback_message_id=ack_id_from_job
             )
-            ack_id = int(ack_id_from_state or ack_id_from_job or 0)
-            if ack_key and ack_id_from_state > 0 and ack_id_from_job > 0 and ack_id_from_state != ack_id_from_job:
-                self.state.metric_inc('delivery.ack.mismatch')
-            if ack_key and ack_id_from_state <= 0 and ack_id_from_job > 0:
-                other_key = self.state.tg_coalesce_key_for_message_id(chat_id=chat_id, message_id=int(ack_id_from_job))
-                if other_key and other_key != ack_key:
-                    self.state.metric_inc('delivery.ack.stale')
-                    ack_id = 0
             if ack_id <= 0 and msg_id > 0:
                 try:
-                    try:
-                        resp = self.api.send_message(
-                            chat_id=chat_id,
-                            message_thread_id=(message_thread_id if int(message_thread_id or 0) > 0 else None),
-                            text=status['title'],
-                            reply_to_message_id=msg_id or None,
-                            coalesce_key=(ack_key or None),
-                            timeout=10,
-                        )
-                    except TypeError:
-                        resp = self.api.send_message(
-                            chat_id=chat_id,
-                            text=status['title'],
-                            reply_to_message_id=msg_id or None,
-                            timeout=10,
-                        )
-                    ack_id = int(((resp.get('result') or {}) if isinstance(resp, dict) else {}).get('message_id') or 0)
+                    resp = self._api_send_message(
+                        chat_id=chat_id,
+                        message_thread_id=(message_thread_id if int(message_thread_id or 0) > 0 else None),
+                        text=status['title'],
+                        reply_to_message_id=msg_id or None,
+                        coalesce_key=(ack_key or None),
+                        timeout=10,
+                    )
+                    ack_id = _extract_message_id(resp)
                 except Exception:
                     ack_id = 0
             if ack_id > 0 and (int(job.get('ack_message_id') or 0) > 0 or ack_key):
@@ -1195,7 +1946,7 @@ class Router:
                 )
 
                 dangerous = bool(job.get('dangerous') or False)
-                if dangerous and not (int(self.owner_chat_id or 0) == 0 or self._is_owner_chat(chat_id)):
+                if dangerous and not self._owner_chat_allowed(chat_id):
                     dangerous = False
                 automation = bool(job.get('automation') or False)
                 reasoning_effort = str(job.get('reasoning_effort') or '').strip().lower()
@@ -1214,7 +1965,7 @@ class Router:
 
                 repo_root, env_policy = self._codex_context(chat_id)
                 codex_config_overrides.update(self._codex_mcp_config_overrides(chat_id=chat_id, repo_root=repo_root))
-                run_t0 = time.time()
+                run_t0 = time.monotonic()
                 session_key = self._codex_session_key(chat_id=chat_id, message_thread_id=message_thread_id)
                 if dangerous:
                     answer = self.codex.run_dangerous_with_progress(
@@ -1237,7 +1988,7 @@ class Router:
                         env_policy=env_policy,
                         config_overrides=codex_config_overrides,
                     )
-                run_ms = (time.time() - run_t0) * 1000.0
+                run_ms = (time.monotonic() - run_t0) * 1000.0
                 self.state.metric_observe_ms('codex.run', run_ms)
                 self.state.metric_inc('codex.run.retry')
                 self.state.metric_inc(
@@ -1356,77 +2107,150 @@ class Router:
 
         return resumed
 
-    def _start_heartbeat(
+    def _request_dangerous_confirmation(
         self,
         *,
         chat_id: int,
-        message_thread_id: int = 0,
-        ack_message_id: int,
-        ack_coalesce_key: str = '',
-        started_ts: float,
-        status: dict[str, str],
-    ) -> tuple[threading.Event, threading.Thread]:
-        stop = threading.Event()
-
-        def render(now_ts: float) -> str:
-            elapsed = max(0, int(now_ts - started_ts))
-            mm, ss = divmod(elapsed, 60)
-            elapsed_s = f'{mm}:{ss:02d}'
-            title = status.get('title', '').strip()
-            detail = status.get('detail', '').strip()
-            base = f'⏳ Работаю… {elapsed_s}'
-            if title:
-                base = f'{title}\n{base}'
-            if detail:
-                return f'{base}\n{detail}'
-            return base
-
-        def loop() -> None:
-            last_typing = 0.0
-            last_edit = 0.0
-            last_flush = 0.0
-            typing_every = float(max(2, int(self.tg_typing_interval_seconds)))
-            edit_every = float(max(10, int(self.tg_progress_edit_interval_seconds)))
-            flush_every = float(max(1, min(10, int(edit_every // 2 or 2))))
-
-            while not stop.is_set():
-                now_ts = time.time()
-
-                # While Codex is busy, keep replaying any queued Telegram ops (deferred sends/edits).
-                if (now_ts - last_flush) >= flush_every:
-                    last_flush = now_ts
-                    flush_fn = getattr(self.api, 'flush_outbox', None)
-                    if callable(flush_fn):
-                        try:
-                            flush_fn(max_ops=10)
-                        except Exception:
-                            pass
-
-                if self.tg_typing_enabled and (now_ts - last_typing) >= typing_every:
-                    last_typing = now_ts
-                    try:
-                        self.api.send_chat_action(
+        message_thread_id: int,
+        payload: str,
+        attachments: list[dict[str, Any]] | None,
+        reply_to: dict[str, Any] | None,
+        received_ts: float,
+        user_id: int,
+        message_id: int,
+        tg_chat: dict[str, Any] | None,
+        tg_user: dict[str, Any] | None,
+        reason: str,
+        ttl_seconds: int,
+        metric_suffix: str,
+        prompt_head: str,
+        ack_id: int,
+        prefer_edit_delivery: bool,
+    ) -> str:
+        """Park the job as a pending dangerous confirmation and show the Yes/No prompt; returns the request id."""
+        rid = _next_request_id()
+        self.state.set_pending_dangerous_confirmation(
+            chat_id=chat_id,
+            message_thread_id=message_thread_id,
+            request_id=rid,
+            job=_dangerous_confirmation_job(
+                payload=payload,
+                attachments=attachments,
+                reply_to=reply_to,
+                received_ts=received_ts,
+                user_id=user_id,
+                message_id=message_id,
+                message_thread_id=message_thread_id,
+                tg_chat=tg_chat,
+                tg_user=tg_user,
+                now_ts=time.time(),
+                ttl_seconds=ttl_seconds,
+                reason=reason,
+            ),
+            max_per_chat=1,
+        )
+        self.state.metric_inc('dangerous.prompt')
+        self.state.metric_inc(f'dangerous.prompt.{metric_suffix}')
+
+        stripped = payload.strip()
+        preview = (stripped[:179] + '…') if len(stripped) > 180 else stripped
+        prompt_text = f'{prompt_head}\n{preview}'
+        prompt_kb = keyboards.dangerous_confirm_menu(rid)
+        if prefer_edit_delivery and int(ack_id) > 0:
+            self._send_or_edit_message(
+                chat_id=chat_id,
+                text=prompt_text,
+                ack_message_id=int(ack_id),
+                reply_markup=prompt_kb,
+                reply_to_message_id=message_id or None,
+                kind='bot',
+            )
+        else:
+            self._send_message(
+                chat_id=chat_id,
+                text=prompt_text,
+                reply_markup=prompt_kb,
+                reply_to_message_id=message_id or None,
+                kind='bot',
+            )
+        return rid
+
+    def _start_heartbeat(
+        self,
+        *,
+        chat_id: int,
+        message_thread_id: int = 0,
+        ack_message_id: int,
+        ack_coalesce_key: str = '',
+        started_ts: float,
+        status: dict[str, str],
+    ) -> tuple[threading.Event, _HeartbeatHandle]:
+        def render(now_ts: float) -> str:
+            elapsed = max(0, int(now_ts - started_ts))
+            mm, ss = divmod(elapsed, 60)
+            elapsed_s = f'{mm}:{ss:02d}'
+            title = status.get('title', '').strip()
+            detail = status.get('detail', '').strip()
+            base = f'⏳ Работаю… {elapsed_s}'
+            if title:
+                base = f'{title}\n{base}'
+            if detail:
+                return f'{base}\n{detail}'
+            return base
+
+        typing_every = float(max(2, int(self.tg_typing_interval_seconds)))
+        edit_every = float(max(10, int(self.tg_progress_edit_interval_seconds)))
+        last = {'typing': 0.0, 'edit': 0.0}
+
+        def tick(now_ts: float) -> Callable[[], None] | None:
+            # Runs on the shared heartbeat thread: only decide what is due, the returned I/O runs in the chat's lane.
+            typing_due = self.tg_typing_enabled and (now_ts - last['typing']) >= typing_every
+            edit_due = self.tg_progress_edit_enabled and (now_ts - last['edit']) >= edit_every
+            if not (typing_due or edit_due):
+                return None
+            if typing_due:
+                last['typing'] = now_ts
+            if edit_due:
+                last['edit'] = now_ts
+            text = render(now_ts) if edit_due else ''
+
+            def io() -> None:
+                if typing_due:
+                    try:
+                        self.api.send_chat_action(
                             chat_id=chat_id,
                             message_thread_id=self._tg_message_thread_id(override=message_thread_id),
                             action='typing',
                         )
                     except Exception:
                         pass
-
-                if self.tg_progress_edit_enabled and (now_ts - last_edit) >= edit_every:
-                    last_edit = now_ts
+                if edit_due:
                     self._maybe_edit_ack_or_queue(
                         chat_id=chat_id,
                         message_id=int(ack_message_id or 0),
                         coalesce_key=ack_coalesce_key,
-                        text=render(now_ts),
+                        text=text,
                     )
 
-                stop.wait(0.5)
+            return io
 
-        t = threading.Thread(target=loop, name='tg-heartbeat', daemon=True)
-        t.start()
-        return stop, t
+        return self._heartbeats.register(tick, on_round=self._heartbeat_flush_outbox)
+
+    def _heartbeat_flush_outbox(self, now_ts: float) -> None:
+        # While Codex is busy, keep replaying any queued Telegram ops (deferred sends/edits): once per round,
+        # not once per in-flight request.
+        edit_every = float(max(10, int(self.tg_progress_edit_interval_seconds)))
+        flush_every = float(max(1, min(10, int(edit_every // 2 or 2))))
+        # The heartbeat scheduler never runs two of these at once, so the timestamp needs no lock.
+        if (now_ts - self._heartbeat_last_flush[0]) < flush_every:
+            return
+        self._heartbeat_last_flush[0] = now_ts
+        flush_fn = getattr(self.api, 'flush_outbox', None)
+        if callable(flush_fn):
+            try:
+                flush_fn(max_ops=10)
+            except Exception:
+                pass
 
     def _send_or_edit_message(
         self,
@@ -1440,8 +2264,15 @@ class Router:
     ) -> None:
         ack_id = int(ack_message_id or 0)
         if ack_id > 0:
+            # Repeated button presses (queue paging, double clicks) usually re-render the same screen:
+            # skip the round-trip when this exact text+keyboard was the last thing put into the message.
+            edit_key = (int(chat_id), ack_id)
+            fingerprint = _edit_fingerprint(text, None, reply_markup)
+            if self._edit_is_unchanged(edit_key, fingerprint):
+                return
             try:
                 self.api.edit_message_text(chat_id=chat_id, message_id=ack_id, text=text, reply_markup=reply_markup)
+                self._remember_edit(edit_key, fingerprint)
                 self.state.append_history(
                     role='bot',
                     kind=kind,
@@ -1457,6 +2288,7 @@ class Router:
                 # Telegram returns "Bad Request: message is not modified" if both text and keyboard are unchanged.
                 # Treat it as a no-op to avoid spamming duplicate messages on repeated button presses.
                 if 'message is not modified' in str(e).lower():
+                    self._remember_edit(edit_key, fingerprint)
                     return
                 pass
 
@@ -1558,18 +2390,23 @@ class Router:
                 return
 
             # Pass-through parse_mode (Markdown/MarkdownV2). If Telegram rejects it, fallback to plain.
-            try:
-                self.api.send_chunks(
-                    chat_id=chat_id,
-                    message_thread_id=self._tg_message_thread_id(override=message_thread_id),
-                    text=text,
-                    parse_mode=pm,
-                    reply_markup=reply_markup,
-                    reply_to_message_id=reply_to_message_id,
-                )
-                return
-            except Exception:
-                pass
+            # Legacy Markdown is validated locally first: unbalanced markup goes straight to plain text
+            # instead of costing a rejected request.
+            if pm.lower() != 'markdown' or _md_is_safe(text):
+                try:
+                    self.api.send_chunks(
+                        chat_id=chat_id,
+                        message_thread_id=self._tg_message_thread_id(override=message_thread_id),
+                        text=text,
+                        parse_mode=pm,
+                        reply_markup=reply_markup,
+                        reply_to_message_id=reply_to_message_id,
+                    )
+                    return
+                except Exception:
+                    pass
+            else:
+                self.state.metric_inc('delivery.markdown.unsafe')
 
         self.api.send_chunks(
             chat_id=chat_id,
@@ -1579,6 +2416,27 @@ class Router:
             reply_to_message_id=reply_to_message_id,
         )
 
+    def _edit_is_unchanged(self, key: tuple[int, int], fingerprint: bytes) -> bool:
+        with self._edit_fingerprints_lock:
+            return self._edit_fingerprints.get(key) == fingerprint
+
+    def _remember_edit(self, key: tuple[int, int], fingerprint: bytes) -> None:
+        with self._edit_fingerprints_lock:
+            self._edit_fingerprints[key] = fingerprint
+            self._edit_fingerprints.move_to_end(key)
+            while len(self._edit_fingerprints) > _EDIT_FINGERPRINTS_MAX:
+                self._edit_fingerprints.popitem(last=False)
+
+    def _forget_edit(self, key: tuple[int, int]) -> None:
+        """Drop the fingerprint of a message edited without one (it no longer says what the message shows)."""
+        with self._edit_fingerprints_lock:
+            self._edit_fingerprints.pop(key, None)
+
+    def _forget_edit_by_coalesce_key(self, *, chat_id: int, coalesce_key: str) -> None:
+        mid = self.state.tg_message_id_for_coalesce_key(chat_id=int(chat_id), coalesce_key=coalesce_key)
+        if mid > 0:
+            self._forget_edit((int(chat_id), int(mid)))
+
     def _try_edit_codex_answer(
         self,
         *,
@@ -1592,9 +2450,11 @@ class Router:
 
         Telegram cannot edit a single message beyond the 4096 chars limit. If the answer would be split
         into multiple chunks, return False so caller can fallback to send_chunks().
+        Re-editing a message with identical content is skipped (Telegram would answer "message is not modified").
         """
         if int(message_id) <= 0:
             return False
+        edit_key = (int(chat_id), int(message_id))
 
         parse_mode = (self.tg_codex_parse_mode or '').strip()
         pm = parse_mode.strip()
@@ -1608,24 +2468,27 @@ class Router:
             raw_msg, html_msg = messages[0]
             send_text = html_msg or raw_msg or text
             send_pm: str | None = 'HTML' if html_msg else None
-            try:
-                self.api.edit_message_text(
-                    chat_id=chat_id,
-                    message_id=message_id,
-                    text=send_text,
-                    parse_mode=send_pm,
-                    reply_markup=reply_markup,
-                )
-            except Exception:
+            fingerprint = _edit_fingerprint(send_text, send_pm, reply_markup)
+            if not self._edit_is_unchanged(edit_key, fingerprint):
                 try:
                     self.api.edit_message_text(
                         chat_id=chat_id,
                         message_id=message_id,
-                        text=raw_msg or text,
+                        text=send_text,
+                        parse_mode=send_pm,
                         reply_markup=reply_markup,
                     )
                 except Exception:
-                    return False
+                    try:
+                        self.api.edit_message_text(
+                            chat_id=chat_id,
+                            message_id=message_id,
+                            text=raw_msg or text,
+                            reply_markup=reply_markup,
+                        )
+                    except Exception:
+                        return False
+                self._remember_edit(edit_key, fingerprint)
 
             self.state.append_history(
                 role='bot',
@@ -1642,27 +2505,32 @@ class Router:
         if len(text) > 4096:
             return False
 
-        try:
-            if pm:
-                self.api.edit_message_text(
-                    chat_id=chat_id,
-                    message_id=message_id,
-                    text=text,
-                    parse_mode=pm,
-                    reply_markup=reply_markup,
-                )
-            else:
-                self.api.edit_message_text(
-                    chat_id=chat_id,
-                    message_id=message_id,
-                    text=text,
-                    reply_markup=reply_markup,
-                )
-        except Exception:
+        fingerprint = _edit_fingerprint(text, pm or None, reply_markup)
+        if not self._edit_is_unchanged(edit_key, fingerprint):
             try:
-                self.api.edit_message_text(chat_id=chat_id, message_id=message_id, text=text, reply_markup=reply_markup)
+                if pm:
+                    self.api.edit_message_text(
+                        chat_id=chat_id,
+                        message_id=message_id,
+                        text=text,
+                        parse_mode=pm,
+                        reply_markup=reply_markup,
+                    )
+                else:
+                    self.api.edit_message_text(
+                        chat_id=chat_id,
+                        message_id=message_id,
+                        text=text,
+                        reply_markup=reply_markup,
+                    )
             except Exception:
-                return False
+                try:
+                    self.api.edit_message_text(
+                        chat_id=chat_id, message_id=message_id, text=text, reply_markup=reply_markup
+                    )
+                except Exception:
+                    return False
+            self._remember_edit(edit_key, fingerprint)
 
         self.state.append_history(
             role='bot',
@@ -1726,9 +2594,12 @@ class Router:
                 ts = float(ev.get('ts') or 0.0)
                 role = str(ev.get('role') or '?')
                 kind = str(ev.get('kind') or '?')
-                text = str(ev.get('text') or '').replace('\n', ' ').strip()
-                if len(text) > 280:
-                    text = text[:279] + '…'
+                text = str(ev.get('text') or '')
+                if '\n' in text or '\r' in text or '\t' in text:
+                    text = text.translate(_EVENT_TEXT_NL_TABLE)
+                text = text.strip()
+                if len(text) > _EVENT_TEXT_MAX_CHARS:
+                    text = text[: _EVENT_TEXT_MAX_CHARS - 1] + '…'
                 sent_ts = 0.0
                 meta = ev.get('meta') or {}
                 if isinstance(meta, dict):
@@ -1742,28 +2613,13 @@ class Router:
                     suffix = f' (processed {_fmt_time(ts)})'
                 lines.append(f'[{_fmt_time(shown_ts)}]{suffix} {role}/{kind}: {text}')
         lines.append('----- END_TELEGRAM_BOT_CONTEXT -----')
-        return '\n'.join(lines).strip() + '\n'
+        # Both ends are fixed marker lines, so no strip() pass is needed; the trailing '' yields the final newline.
+        lines.append('')
+        return '\n'.join(lines)
 
     def _parallel_write_safety_block(self) -> str:
         """Extra safety instructions for write/danger runs in a parallel scheduler."""
-        lines: list[str] = []
-        lines.append('----- PARALLEL_WRITE_SAFETY -----')
-        lines.append(
-            'Важно: этот запуск может идти параллельно с другими запусками Codex в том же репозитории '
-            '(файлы могут изменяться во время твоей работы).'
-        )
-        lines.append('Правила:')
-        lines.append(
-            '1) Никаких разрушительных действий без явного запроса пользователя: `git reset --hard`, '
-            '`git clean -fdx`, `rm -rf`, откат/чистка рабочего дерева, удаление чужих изменений.'
-        )
-        lines.append(
-            '2) Перед правкой файлов перечитывай их прямо перед `apply_patch`. Если патч не применился из‑за изменений '
-            'или видишь конфликт/дрейф — остановись и сообщи пользователю; НЕ пытайся «починить» через откат.'
-        )
-        lines.append('3) Держи дифф минимальным: без массовых форматирований/реорганизаций и без удаления «лишнего».')
-        lines.append('----- END_PARALLEL_WRITE_SAFETY -----')
-        return '\n'.join(lines).strip() + '\n'
+        return _PARALLEL_WRITE_SAFETY_BLOCK
 
     def _wrap_user_prompt(
         self,
@@ -1775,8 +2631,12 @@ class Router:
         sent_ts: float | None = None,
         tg_chat: dict[str, Any] | None = None,
         tg_user: dict[str, Any] | None = None,
+        message_thread_id: int | None = None,
     ) -> str:
-        ctx = self._bot_context_block(chat_id=chat_id, message_thread_id=int(self._tg_message_thread_id() or 0))
+        if message_thread_id is None:
+            message_thread_id = self._tg_message_thread_id()
+        tid = int(message_thread_id or 0)
+        ctx = self._bot_context_block(chat_id=chat_id, message_thread_id=tid)
         # Keep prompt structure stable to help the model parse it.
         lines: list[str] = []
         lines.append(ctx)
@@ -1785,7 +2645,7 @@ class Router:
         if sent_ts and sent_ts > 0:
             lines.append(f'Время отправки текущего сообщения: {_fmt_dt(float(sent_ts))}')
         # Add chat/sender context so the model can adapt tone and address people by name.
-        multi_tenant = int(self.owner_chat_id or 0) != 0
+        multi_tenant = self._owner_chat_int != 0
         is_owner = self._is_owner_chat(chat_id)
         chat_type = ''
         chat_name = ''
@@ -1810,7 +2670,6 @@ class Router:
             lines.append(f'- name: {chat_name}')
         if multi_tenant:
             lines.append(f'- kb_scope: {"main (owner)" if is_owner else "isolated (per-chat)"}')
-        tid = int(self._tg_message_thread_id() or 0)
         if tid > 0:
             lines.append(f'- message_thread_id: {tid}')
         if sender_name:
@@ -1852,62 +2711,20 @@ class Router:
             rt_attachments = reply_to.get('attachments') or []
             if isinstance(rt_attachments, list) and rt_attachments:
                 lines.append('Прикреплённые файлы из reply:')
-                for a in rt_attachments:
-                    if not isinstance(a, dict):
-                        continue
-                    path = a.get('path')
-                    name = a.get('name')
-                    kind = a.get('kind')
-                    if not isinstance(path, str) or not path.strip():
-                        continue
-                    if not isinstance(name, str) or not name.strip():
-                        name = path
-                    kind_s = str(kind or '').strip()
-                    suffix = f' ({kind_s})' if kind_s else ''
-                    lines.append(f'- {str(name).strip()}{suffix}: {path.strip()}')
+                lines.extend(_attachment_path_lines(rt_attachments))
         if attachments:
             lines.append('Прикреплённые файлы (сохранены локально, доступны агенту):')
-            for a in attachments:
-                if not isinstance(a, dict):
-                    continue
-                path = a.get('path')
-                name = a.get('name')
-                kind = a.get('kind')
-                if not isinstance(path, str) or not path.strip():
-                    continue
-                if not isinstance(name, str) or not name.strip():
-                    name = path
-                kind_s = str(kind or '').strip()
-                suffix = f' ({kind_s})' if kind_s else ''
-                lines.append(f'- {str(name).strip()}{suffix}: {path.strip()}')
+            lines.extend(_attachment_path_lines(attachments))
 
         if (not multi_tenant) or is_owner:
-            lines.append('Telegram (MCP):')
-            lines.append(
-                '- Отправить текст в чат/топик: `mcp__telegram-send__send_message` (передай `chat_id` + `message_thread_id`).'
-            )
-            lines.append(
-                '- Отправить файл(ы) в чат/топик: `mcp__telegram-send__send_files` '
-                '(передай `paths[]`, опционально `caption`, и `chat_id` + `message_thread_id`).'
-            )
-            lines.append('- Переименовать текущий topic: `mcp__telegram-send__edit_forum_topic`.')
+            lines.extend(_MCP_TELEGRAM_BLOCK)
 
             followups_enabled = True
             try:
                 followups_enabled = bool(self.state.ux_mcp_live_enabled(chat_id=chat_id))
             except Exception:
                 followups_enabled = True
-            if followups_enabled:
-                lines.append('Telegram follow-ups (MCP):')
-                lines.append(
-                    '- Читать follow-ups во время работы: `mcp__telegram-followups__get_followups` / `mcp__telegram-followups__wait_followups` '
-                    '(используй `after_message_id`, чтобы не повторяться).'
-                )
-                lines.append(
-                    '- После обработки follow-ups: `mcp__telegram-followups__ack_followups` (чтобы бот не продублировал их из очереди).'
-                )
-            else:
-                lines.append('Telegram follow-ups (MCP): отключено в Settings этого чата.')
+            lines.extend(_MCP_FOLLOWUPS_ON_BLOCK if followups_enabled else _MCP_FOLLOWUPS_OFF_BLOCK)
 
             ask_enabled = True
             try:
@@ -1915,25 +2732,18 @@ class Router:
             except Exception:
                 ask_enabled = True
             if not ask_enabled:
-                lines.append(
-                    'Blocking вопросы (ask_user): отключено в Settings этого чата. '
-                    'Если не хватает данных — выбери безопасный дефолт и перечисли вопросы в ответе.'
-                )
+                lines.extend(_MCP_ASK_USER_OFF_BLOCK)
 
         # MCP UX: some servers expose tools only (no resources), so list_mcp_* can be empty.
         u_cf = (user_text or '').casefold()
         if 'mcp' in u_cf:
-            lines.append('Примечание по MCP:')
-            lines.append(
-                '- `list_mcp_resources`/`list_mcp_resource_templates` могут вернуть пусто, даже если MCP-инструменты доступны.'
-            )
-            lines.append(
-                '- Для memory-сервера проверь `mcp__server-memory__read_graph` (или `codex mcp list --json` как shell-команду).'
-            )
+            lines.extend(_MCP_NOTE_BLOCK)
 
         lines.append('Пользовательское сообщение:')
         lines.append(user_text.strip())
-        return '\n'.join(lines).strip() + '\n'
+        # `ctx` starts with a marker line and the user text is already stripped: join once, no strip()/concat copies.
+        lines.append('')
+        return '\n'.join(lines)
 
     # -----------------------------
     # Public handlers
@@ -1956,8 +2766,16 @@ class Router:
         tg_chat: dict[str, Any] | None = None,
         tg_user: dict[str, Any] | None = None,
     ) -> None:
-        self._tg_thread_ctx.chat_id = int(chat_id)
-        self._tg_thread_ctx.message_thread_id = int(message_thread_id or 0)
+        # Resolved once per message: below, pass `message_thread_id` explicitly instead of re-reading the thread-local.
+        # Scalar ids/timestamps are coerced here once; the rest of the handler uses them as is.
+        chat_id = int(chat_id)
+        message_thread_id = int(message_thread_id or 0)
+        user_id = int(user_id or 0)
+        message_id = int(message_id or 0)
+        received_ts = float(received_ts or 0.0)
+        ack_message_id = int(ack_message_id or 0)
+        self._tg_thread_ctx.chat_id = chat_id
+        self._tg_thread_ctx.message_thread_id = message_thread_id
 
         text = (text or '').strip()
         if not text:
@@ -1967,17 +2785,7 @@ class Router:
             return
 
         # Treat slash-commands as control-plane even when prefixed with router overrides (!/?/∆).
-        cmd_text = text
-        prefixes = (self.force_danger_prefix, self.force_write_prefix, self.force_read_prefix)
-        while True:
-            changed = False
-            for p in prefixes:
-                pref = (p or '').strip()
-                if pref and cmd_text.startswith(pref):
-                    cmd_text = cmd_text[len(pref) :].lstrip()
-                    changed = True
-            if not changed:
-                break
+        cmd_text = self._strip_force_prefixes(text)
 
         force_new_task = False
         if cmd_text.startswith('/'):
@@ -1997,18 +2805,20 @@ class Router:
                 cmd_text = rest
 
         is_command = bool(cmd_text.startswith('/')) and (not force_new_task)
+        owner_or_single_tenant = self._owner_chat_allowed(chat_id)
+        is_private = chat_id > 0
 
         # Any user text counts as activity.
-        counts_for_watch = (int(self.owner_chat_id or 0) == 0 or self._is_owner_chat(chat_id)) and int(chat_id) > 0
+        counts_for_watch = owner_or_single_tenant and is_private
         self.state.mark_user_activity(chat_id=chat_id, user_id=user_id, counts_for_watch=counts_for_watch)
         if not skip_history:
             user_meta: dict[str, Any] = {}
             if message_id:
-                user_meta['tg_message_id'] = int(message_id)
-            if int(message_thread_id or 0) > 0:
-                user_meta['tg_message_thread_id'] = int(message_thread_id)
+                user_meta['tg_message_id'] = message_id
+            if message_thread_id > 0:
+                user_meta['tg_message_thread_id'] = message_thread_id
             if received_ts and received_ts > 0:
-                user_meta['tg_sent_ts'] = float(received_ts)
+                user_meta['tg_sent_ts'] = received_ts
             if isinstance(tg_chat, dict):
                 nm = tg_chat.get('name') or tg_chat.get('title')
                 if isinstance(nm, str) and nm.strip():
@@ -2049,11 +2859,7 @@ class Router:
         # Light local shortcuts (so you can answer quickly).
         # In multi-tenant mode they are owner-only to avoid cross-chat state changes.
         t_cf = text.casefold()
-        if (
-            int(chat_id) > 0
-            and (int(self.owner_chat_id or 0) == 0 or self._is_owner_chat(chat_id))
-            and t_cf in {'обед', 'lunch'}
-        ):
+        if is_private and owner_or_single_tenant and t_cf in _LUNCH_SHORTCUTS:
             self.state.set_snooze(60 * 60, kind='lunch')
             self.state.append_history(
                 role='bot',
@@ -2064,27 +2870,24 @@ class Router:
                 max_events=self.history_max_events,
                 max_chars=self.history_entry_max_chars,
             )
-            from .keyboards import help_menu
-
             self._send_message(
                 chat_id=chat_id,
                 text='🍽️ Ок, пауза на 60 минут. Вернёшься — напиши /back.',
-                reply_markup=help_menu(gentle_active=self.state.is_gentle_active()),
+                reply_markup=keyboards.help_menu(gentle_active=self.state.is_gentle_active()),
                 reply_to_message_id=message_id or None,
             )
             return
 
-        if (
-            int(chat_id) > 0
-            and (int(self.owner_chat_id or 0) == 0 or self._is_owner_chat(chat_id))
-            and t_cf in {'я здесь', 'вернулся', 'back'}
-        ):
+        if is_private and owner_or_single_tenant and t_cf in _BACK_SHORTCUTS:
             self.state.clear_snooze()
             self._send_message(chat_id=chat_id, text='✅ Принял.', reply_to_message_id=message_id or None)
             return
 
         payload = text
-        waiting = self.state.waiting_for_user(chat_id=chat_id, message_thread_id=message_thread_id)
+        scope_snapshot = self.state.snapshot_for_chat(
+            chat_id=chat_id, message_thread_id=message_thread_id, voice_message_id=message_id
+        )
+        waiting = scope_snapshot.waiting_for_user
         if waiting is not None:
             if force_new_task:
                 try:
@@ -2128,42 +2931,32 @@ class Router:
                 resume_lines.append('Продолжай исходную задачу с учётом ответа.')
                 payload = (prefix or '') + '\n'.join(resume_lines)
 
-        if int(message_id or 0) > 0:
+        if message_id > 0:
             # Voice auto-transcribe UX: let the user force routing via inline buttons (read/write/danger/none).
-            pending_voice = self.state.pending_voice_route(
-                chat_id=chat_id, message_thread_id=message_thread_id, voice_message_id=int(message_id)
-            )
-            if pending_voice is not None:
-                choice = self.state.pending_voice_route_choice(
-                    chat_id=chat_id, message_thread_id=message_thread_id, voice_message_id=int(message_id)
-                )
+            if scope_snapshot.pending_voice_route is not None:
+                choice = scope_snapshot.voice_route_choice
                 timeout_s = max(0, int(self.tg_voice_route_choice_timeout_seconds or 0))
                 if choice is None and timeout_s > 0:
-                    deadline = time.time() + float(timeout_s)
-                    while time.time() < deadline:
-                        choice = self.state.pending_voice_route_choice(
-                            chat_id=chat_id,
-                            message_thread_id=message_thread_id,
-                            voice_message_id=int(message_id),
-                        )
-                        if choice is not None:
-                            break
-                        time.sleep(0.25)
+                    # Wakes up as soon as the voice-route button callback stores the choice.
+                    choice = self.state.wait_voice_route_choice(
+                        chat_id=chat_id,
+                        message_thread_id=message_thread_id,
+                        voice_message_id=message_id,
+                        timeout_seconds=float(timeout_s),
+                    )
+                    # Collect mode may have changed while we were waiting for the button.
+                    scope_snapshot = self.state.snapshot_for_chat(chat_id=chat_id, message_thread_id=message_thread_id)
 
                 # Single-use: clean up state and remove keyboard once routing begins.
                 try:
                     self.state.pop_pending_voice_route(
-                        chat_id=chat_id, message_thread_id=message_thread_id, voice_message_id=int(message_id)
+                        chat_id=chat_id, message_thread_id=message_thread_id, voice_message_id=message_id
                     )
                 except Exception:
                     pass
-                if int(ack_message_id or 0) > 0:
-                    try:
-                        self.api.edit_message_reply_markup(
-                            chat_id=chat_id, message_id=int(ack_message_id), reply_markup=None
-                        )
-                    except Exception:
-                        pass
+                if ack_message_id > 0:
+                    # Same lane as the button handler's selection refresh, so the removal can't be overtaken by it.
+                    self._edit_reply_markup_async(chat_id=chat_id, message_id=ack_message_id, reply_markup=None)
 
                 if choice == 'danger':
                     self.state.metric_inc('voice.route.danger')
@@ -2177,20 +2970,20 @@ class Router:
                 elif choice == 'none':
                     self.state.metric_inc('voice.route.none')
         if waiting is None:
-            collect_status = self.state.collect_status(chat_id=chat_id, message_thread_id=message_thread_id)
+            collect_status = scope_snapshot.collect_status
             if collect_status in {'active', 'pending'}:
                 item: dict[str, Any] = {
                     'text': payload,
-                    'message_id': int(message_id or 0),
-                    'user_id': int(user_id or 0),
-                    'received_ts': float(received_ts or 0.0),
+                    'message_id': message_id,
+                    'user_id': user_id,
+                    'received_ts': received_ts,
                 }
                 if attachments:
                     item['attachments'] = list(attachments)
                 if isinstance(reply_to, dict):
                     item['reply_to'] = dict(reply_to)
                 self.state.collect_append(chat_id=chat_id, message_thread_id=message_thread_id, item=item)
-                pending_count = len(self.state.collect_pending.get(f'{int(chat_id)}:{int(message_thread_id or 0)}', []))
+                pending_count = self.state.collect_pending_count(chat_id=chat_id, message_thread_id=message_thread_id)
                 self._send_or_edit_message(
                     chat_id=chat_id,
                     text=f'collect queued: {collect_status}, pending={pending_count}',
@@ -2201,27 +2994,17 @@ class Router:
         forced: str | None = None
         forced_reason: str | None = None
         dangerous_reason_override: str | None = None
-        dangerous = False
-        if self.force_danger_prefix and payload.startswith(self.force_danger_prefix):
-            dangerous = True
-            payload = payload[len(self.force_danger_prefix) :].strip()
-            # Keep compatibility with existing force prefixes (strip them if user chained prefixes).
-            if self.force_write_prefix and payload.startswith(self.force_write_prefix):
-                payload = payload[len(self.force_write_prefix) :].strip()
-            elif self.force_read_prefix and payload.startswith(self.force_read_prefix):
-                payload = payload[len(self.force_read_prefix) :].strip()
-
-        if not dangerous:
-            if self.force_write_prefix and payload.startswith(self.force_write_prefix):
-                forced = 'write'
-                forced_reason = f'forced by prefix {self.force_write_prefix}'
-                payload = payload[len(self.force_write_prefix) :].strip()
-            elif self.force_read_prefix and payload.startswith(self.force_read_prefix):
-                forced = 'read'
-                forced_reason = f'forced by prefix {self.force_read_prefix}'
-                payload = payload[len(self.force_read_prefix) :].strip()
-
-        dangerous_chat_allowed = int(self.owner_chat_id or 0) == 0 or self._is_owner_chat(chat_id)
+        # Single anchored match; a write/read prefix chained after the danger prefix is stripped for compatibility.
+        prefix_mode, payload = self._split_force_mode(payload)
+        dangerous = prefix_mode == 'danger'
+        if prefix_mode == 'write':
+            forced = 'write'
+            forced_reason = f'forced by prefix {self.force_write_prefix}'
+        elif prefix_mode == 'read':
+            forced = 'read'
+            forced_reason = f'forced by prefix {self.force_read_prefix}'
+
+        dangerous_chat_allowed = owner_or_single_tenant
         dangerous_allowed = bool(dangerous_chat_allowed and allow_dangerous)
         if dangerous and not dangerous_chat_allowed:
             self._send_message(
@@ -2236,23 +3019,36 @@ class Router:
 
         # Optional "minimum profile" floor (env: ROUTER_MIN_PROFILE/TG_MIN_PROFILE).
         # read < write < danger. When set to write: never run in read; when set to danger: always dangerous.
-        min_profile = (self.min_profile or 'read').strip().lower()
-        if not dangerous_allowed and min_profile in {'danger', 'dangerous'}:
-            min_profile = 'write'
-        if min_profile in {'danger', 'dangerous'}:
+        min_profile_rank = self._min_profile_rank
+        if not dangerous_allowed and min_profile_rank == 2:
+            min_profile_rank = 1
+        if min_profile_rank == 2:
             if not dangerous:
                 dangerous = True
                 dangerous_reason_override = 'forced: min_profile=danger'
             forced = None
             forced_reason = None
-        elif min_profile == 'write':
+        elif min_profile_rank == 1:
             if not dangerous and forced != 'write':
                 forced = 'write'
                 forced_reason = 'forced: min_profile=write'
 
-        payload, ultrathink = _strip_ultrathink_token(payload)
-        payload, fastthink = _strip_fastthink_token(payload)
-        if (not dangerous) and forced != 'read' and payload and _FORCE_WRITE_KEYWORD_RE.search(payload):
+        # Both meta-tokens end in "think": one substring test skips the two regex scans for ordinary messages.
+        payload_cf = payload.casefold()
+        ultrathink = fastthink = False
+        if 'think' in payload_cf:
+            payload, ultrathink = _strip_ultrathink_token(payload)
+            payload, fastthink = _strip_fastthink_token(payload)
+            if ultrathink or fastthink:
+                payload_cf = payload.casefold()
+        if (
+            (not dangerous)
+            and forced != 'read'
+            and payload
+            # Plain substring prefilter: the word-boundary regex only runs when the keyword is present at all.
+            and _FORCE_WRITE_KEYWORD in payload_cf
+            and _FORCE_WRITE_KEYWORD_RE.search(payload)
+        ):
             # UX shortcut: "реализуй" almost always implies code changes.
             self.state.metric_inc('router.force_write.keyword_realizuy')
             if forced != 'write':
@@ -2272,10 +3068,6 @@ class Router:
             and message_id > 0
             and not dangerous_confirmed
         ):
-            from . import keyboards
-
-            rid = uuid4().hex[:10]
-            now_ts = time.time()
             ttl_seconds = 30 * 60
             if isinstance(tg_ctrl, dict):
                 try:
@@ -2284,51 +3076,24 @@ class Router:
                     ttl_seconds = 30 * 60
             ttl_seconds = max(60, min(int(ttl_seconds), 24 * 60 * 60))
 
-            self.state.set_pending_dangerous_confirmation(
+            self._request_dangerous_confirmation(
                 chat_id=chat_id,
                 message_thread_id=message_thread_id,
-                request_id=rid,
-                job={
-                    'payload': payload,
-                    'attachments': list(attachments or []),
-                    'reply_to': dict(reply_to) if isinstance(reply_to, dict) else None,
-                    'sent_ts': float(received_ts or 0.0),
-                    'user_id': int(user_id or 0),
-                    'message_id': int(message_id or 0),
-                    'message_thread_id': int(message_thread_id or 0),
-                    'tg_chat': dict(tg_chat) if isinstance(tg_chat, dict) else None,
-                    'tg_user': dict(tg_user) if isinstance(tg_user, dict) else None,
-                    'created_ts': float(now_ts),
-                    'expires_ts': float(now_ts + ttl_seconds),
-                    'reason': str(dangerous_reason_override or 'forced dangerous').strip(),
-                },
-                max_per_chat=1,
+                payload=payload,
+                attachments=attachments,
+                reply_to=reply_to,
+                received_ts=received_ts,
+                user_id=user_id,
+                message_id=message_id,
+                tg_chat=tg_chat,
+                tg_user=tg_user,
+                reason=str(dangerous_reason_override or 'forced dangerous').strip(),
+                ttl_seconds=ttl_seconds,
+                metric_suffix='explicit',
+                prompt_head='⚠️ Подтверди dangerous override:',
+                ack_id=ack_message_id,
+                prefer_edit_delivery=self.state.ux_prefer_edit_delivery(chat_id=chat_id),
             )
-            self.state.metric_inc('dangerous.prompt')
-            self.state.metric_inc('dangerous.prompt.explicit')
-
-            preview = payload.strip()
-            if len(preview) > 180:
-                preview = preview[:179] + '…'
-            prompt_text = f'⚠️ Подтверди dangerous override:\n{preview}'
-            prefer_edit_delivery = self.state.ux_prefer_edit_delivery(chat_id=chat_id)
-            if prefer_edit_delivery and int(ack_message_id) > 0:
-                self._send_or_edit_message(
-                    chat_id=chat_id,
-                    text=prompt_text,
-                    ack_message_id=int(ack_message_id),
-                    reply_markup=keyboards.dangerous_confirm_menu(rid),
-                    reply_to_message_id=message_id or None,
-                    kind='bot',
-                )
-            else:
-                self._send_message(
-                    chat_id=chat_id,
-                    text=prompt_text,
-                    reply_markup=keyboards.dangerous_confirm_menu(rid),
-                    reply_to_message_id=message_id or None,
-                    kind='bot',
-                )
             return
 
         # Router-first dangerous suggestion (before running Codex). We never enable dangerous silently:
@@ -2340,43 +3105,23 @@ class Router:
                     dangerous = True
                     dangerous_reason_override = dangerous_reason
                 else:
-                    from . import keyboards
-
-                    rid = uuid4().hex[:10]
-                    now_ts = time.time()
-                    ttl_seconds = 30 * 60
-                    self.state.set_pending_dangerous_confirmation(
+                    self._request_dangerous_confirmation(
                         chat_id=chat_id,
                         message_thread_id=message_thread_id,
-                        request_id=rid,
-                        job={
-                            'payload': payload,
-                            'attachments': list(attachments or []),
-                            'reply_to': dict(reply_to) if isinstance(reply_to, dict) else None,
-                            'sent_ts': float(received_ts or 0.0),
-                            'user_id': int(user_id or 0),
-                            'message_id': int(message_id or 0),
-                            'message_thread_id': int(message_thread_id or 0),
-                            'tg_chat': dict(tg_chat) if isinstance(tg_chat, dict) else None,
-                            'tg_user': dict(tg_user) if isinstance(tg_user, dict) else None,
-                            'created_ts': float(now_ts),
-                            'expires_ts': float(now_ts + ttl_seconds),
-                            'reason': dangerous_reason,
-                        },
-                        max_per_chat=1,
-                    )
-                    self.state.metric_inc('dangerous.prompt')
-                    self.state.metric_inc('dangerous.prompt.router_first')
-
-                    preview = payload.strip()
-                    if len(preview) > 180:
-                        preview = preview[:179] + '…'
-                    self._send_message(
-                        chat_id=chat_id,
-                        text=f'⚠️ Похоже, нужен dangerous override ({dangerous_reason}). Разрешить?\n{preview}',
-                        reply_markup=keyboards.dangerous_confirm_menu(rid),
-                        reply_to_message_id=message_id or None,
-                        kind='bot',
+                        payload=payload,
+                        attachments=attachments,
+                        reply_to=reply_to,
+                        received_ts=received_ts,
+                        user_id=user_id,
+                        message_id=message_id,
+                        tg_chat=tg_chat,
+                        tg_user=tg_user,
+                        reason=dangerous_reason,
+                        ttl_seconds=30 * 60,
+                        metric_suffix='router_first',
+                        prompt_head=f'⚠️ Похоже, нужен dangerous override ({dangerous_reason}). Разрешить?',
+                        ack_id=0,
+                        prefer_edit_delivery=False,
                     )
                     return
 
@@ -2389,41 +3134,23 @@ class Router:
         # Prefer editing the original "✅ Принял" ack to avoid extra bot messages.
         # Fallback: if we don't have the ack message_id (e.g. delivery deferred), create a fresh progress message.
         ack_key = self._ack_coalesce_key_for_text(chat_id=chat_id, message_id=message_id)
-        ack_id_from_event = int(ack_message_id or 0)
-        ack_id_from_state = (
-            int(self.state.tg_message_id_for_coalesce_key(chat_id=chat_id, coalesce_key=ack_key) or 0) if ack_key else 0
+        ack_id = self.state.resolve_ack_message_id(
+            chat_id=chat_id, coalesce_key=ack_key, fallback_message_id=ack_message_id
         )
-        ack_id = int(ack_id_from_state or ack_id_from_event or 0)
-        if ack_key and ack_id_from_state > 0 and ack_id_from_event > 0 and ack_id_from_state != ack_id_from_event:
-            self.state.metric_inc('delivery.ack.mismatch')
-        if ack_key and ack_id_from_state <= 0 and ack_id_from_event > 0:
-            other_key = self.state.tg_coalesce_key_for_message_id(chat_id=chat_id, message_id=int(ack_id_from_event))
-            if other_key and other_key != ack_key:
-                self.state.metric_inc('delivery.ack.stale')
-                ack_id = 0
         if ack_id <= 0 and message_id > 0:
             try:
-                try:
-                    resp = self.api.send_message(
-                        chat_id=chat_id,
-                        message_thread_id=self._tg_message_thread_id(),
-                        text=status['title'],
-                        reply_to_message_id=int(message_id),
-                        coalesce_key=(ack_key or None),
-                        timeout=10,
-                    )
-                except TypeError:
-                    # Backward-compatible with simple fakes in unit tests.
-                    resp = self.api.send_message(
-                        chat_id=chat_id,
-                        text=status['title'],
-                        reply_to_message_id=int(message_id),
-                        timeout=10,
-                    )
-                ack_id = int(((resp.get('result') or {}) if isinstance(resp, dict) else {}).get('message_id') or 0)
+                resp = self._api_send_message(
+                    chat_id=chat_id,
+                    message_thread_id=(message_thread_id or None),
+                    text=status['title'],
+                    reply_to_message_id=message_id,
+                    coalesce_key=(ack_key or None),
+                    timeout=10,
+                )
+                ack_id = _extract_message_id(resp)
             except Exception:
                 ack_id = 0
-        if int(ack_id) > 0 and (int(ack_message_id or 0) > 0 or ack_key):
+        if int(ack_id) > 0 and (ack_message_id > 0 or ack_key):
             self._maybe_edit_ack_or_queue(
                 chat_id=chat_id, message_id=ack_id, coalesce_key=ack_key, text=status['title']
             )
@@ -2496,58 +3223,26 @@ class Router:
                         dangerous = True
                         dangerous_reason_override = dr
                     elif message_id > 0:
-                        from . import keyboards
-
                         prefer_edit_delivery = self.state.ux_prefer_edit_delivery(chat_id=chat_id)
-
-                        rid = uuid4().hex[:10]
-                        now_ts = time.time()
-                        ttl_seconds = 30 * 60
-                        self.state.set_pending_dangerous_confirmation(
+                        self._request_dangerous_confirmation(
                             chat_id=chat_id,
                             message_thread_id=message_thread_id,
-                            request_id=rid,
-                            job={
-                                'payload': payload,
-                                'attachments': list(attachments or []),
-                                'reply_to': dict(reply_to) if isinstance(reply_to, dict) else None,
-                                'sent_ts': float(received_ts or 0.0),
-                                'user_id': int(user_id or 0),
-                                'message_id': int(message_id or 0),
-                                'message_thread_id': int(message_thread_id or 0),
-                                'tg_chat': dict(tg_chat) if isinstance(tg_chat, dict) else None,
-                                'tg_user': dict(tg_user) if isinstance(tg_user, dict) else None,
-                                'created_ts': float(now_ts),
-                                'expires_ts': float(now_ts + ttl_seconds),
-                                'reason': dr,
-                            },
-                            max_per_chat=1,
+                            payload=payload,
+                            attachments=attachments,
+                            reply_to=reply_to,
+                            received_ts=received_ts,
+                            user_id=user_id,
+                            message_id=message_id,
+                            tg_chat=tg_chat,
+                            tg_user=tg_user,
+                            reason=dr,
+                            ttl_seconds=30 * 60,
+                            metric_suffix='classifier',
+                            prompt_head=f'⚠️ Похоже, нужен dangerous override ({dr}). Разрешить?',
+                            ack_id=int(ack_id),
+                            prefer_edit_delivery=prefer_edit_delivery,
                         )
-                        self.state.metric_inc('dangerous.prompt')
-                        self.state.metric_inc('dangerous.prompt.classifier')
-
-                        preview = payload.strip()
-                        if len(preview) > 180:
-                            preview = preview[:179] + '…'
-                        prompt_text = f'⚠️ Похоже, нужен dangerous override ({dr}). Разрешить?\n{preview}'
-                        prompt_kb = keyboards.dangerous_confirm_menu(rid)
-                        if prefer_edit_delivery and int(ack_id) > 0:
-                            self._send_or_edit_message(
-                                chat_id=chat_id,
-                                text=prompt_text,
-                                ack_message_id=int(ack_id),
-                                reply_markup=prompt_kb,
-                                reply_to_message_id=message_id or None,
-                                kind='bot',
-                            )
-                        else:
-                            self._send_message(
-                                chat_id=chat_id,
-                                text=prompt_text,
-                                reply_markup=prompt_kb,
-                                reply_to_message_id=message_id or None,
-                                kind='bot',
-                            )
+                        if not (prefer_edit_delivery and int(ack_id) > 0):
                             status['title'] = '⏸️ Жду подтверждения dangerous…'
                             status['detail'] = dr
                             self._maybe_edit_ack_or_queue(
@@ -2575,10 +3270,9 @@ class Router:
                     reasoning_effort = 'low'
                 think_suffix = (', ultrathink' if ultrathink else '') + (', fastthink' if fastthink else '')
 
-                status['title'] = '⚠️ DANGEROUS override'
-                status['detail'] = (
-                    f'{reason} (reasoning={reasoning_effort}{think_suffix})\n'
-                    f'▶️ Codex: profile={profile.name} {exec_mode}; {resume_label}'
+                status['title'] = _STATUS_DANGEROUS_TITLE
+                status['detail'] = _route_status_detail(
+                    reason, reasoning_effort, think_suffix, profile.name, exec_mode, resume_label
                 )
                 self._maybe_edit_ack_or_queue(
                     chat_id=chat_id,
@@ -2591,7 +3285,7 @@ class Router:
                     wait_s = 0
                     if received_ts > 0:
                         wait_s = max(0, int(started_ts - received_ts))
-                    dbg = f'[danger] chat_id={int(chat_id)} profile={profile.name} {exec_mode}; wait={wait_s}s; reason={reason}'
+                    dbg = f'[danger] chat_id={chat_id} profile={profile.name} {exec_mode}; wait={wait_s}s; reason={reason}'
                     self._send_message(chat_id=chat_id, text=dbg, kind='debug', reply_to_message_id=message_id or None)
             else:
                 if not payload:
@@ -2644,9 +3338,8 @@ class Router:
                 status['title'] = (
                     f'🚦 Режим: {decision.mode} (conf={decision.confidence:.2f}, cx={decision.complexity})'
                 )
-                status['detail'] = (
-                    f'{decision.reason} (reasoning={reasoning_effort}{think_suffix})\n'
-                    f'▶️ Codex: profile={profile.name} {exec_mode}; {resume_label}'
+                status['detail'] = _route_status_detail(
+                    decision.reason, reasoning_effort, think_suffix, profile.name, exec_mode, resume_label
                 )
                 self._maybe_edit_ack_or_queue(
                     chat_id=chat_id,
@@ -2660,13 +3353,15 @@ class Router:
                     if received_ts > 0:
                         wait_s = max(0, int(started_ts - received_ts))
                     dbg = (
-                        f'[router] chat_id={int(chat_id)} mode={decision.mode} conf={decision.confidence:.2f} '
+                        f'[router] chat_id={chat_id} mode={decision.mode} conf={decision.confidence:.2f} '
                         f'profile={profile.name} {exec_mode}; wait={wait_s}s; cx={decision.complexity}; '
                         f'ultrathink={int(bool(ultrathink))}; fastthink={int(bool(fastthink))}; '
                         f'reasoning={reasoning_effort}; reason={decision.reason}'
                     )
                     self._send_message(chat_id=chat_id, text=dbg, kind='debug', reply_to_message_id=message_id or None)
 
+            # Built inline on purpose: handle_text already runs on its own `tg-job` thread (see app.worker_loop),
+            # so prompt assembly never blocks polling or other chats; a separate pool would only add a handoff.
             wrapped = self._wrap_user_prompt(
                 payload,
                 chat_id=chat_id,
@@ -2675,6 +3370,7 @@ class Router:
                 sent_ts=received_ts if received_ts > 0 else None,
                 tg_chat=tg_chat,
                 tg_user=tg_user,
+                message_thread_id=message_thread_id,
             )
             if dangerous or automation:
                 wrapped = self._parallel_write_safety_block() + '\n' + wrapped
@@ -2702,7 +3398,7 @@ class Router:
                         rt_attachments = len([a for a in at0 if isinstance(a, dict)])
                 self.codex.log_note(
                     'tg_prompt '
-                    f'chat_id={int(chat_id)} msg_id={int(message_id or 0)} '
+                    f'chat_id={chat_id} msg_id={message_id} '
                     f'profile={profile_name} reasoning={reasoning_effort} ultrathink={int(bool(ultrathink))} fastthink={int(bool(fastthink))} '
                     f'reply_mid={int(rt_mid)} '
                     f'reply_text_len={int(rt_text_len)} reply_quote_len={int(rt_quote_len)} '
@@ -2713,7 +3409,9 @@ class Router:
             status['title'] = f'▶️ Codex: выполняю ({profile.name})…'
 
             base_detail = status.get('detail', '').strip()
-            progress_lines: list[str] = []
+            # Constant for the run; only the event lines below it change.
+            exec_detail_prefix = (base_detail + '\n\n🛰️ Exec events:\n').lstrip()
+            progress_lines: deque[str] = deque(maxlen=3)
             last_progress_ts = 0.0
             call_name_by_id: dict[str, str] = {}
             call_detail_by_id: dict[str, str] = {}
@@ -2782,130 +3480,46 @@ class Router:
                 if text_s:
                     _maybe_send_live_chatter(text_s, now_ts=now_ts, force=force)
 
-            def _fmt_elapsed(ts: float) -> str:
-                elapsed = max(0, int(ts - started_ts))
-                hh, rem = divmod(elapsed, 3600)
-                mm, ss = divmod(rem, 60)
-                if hh > 0:
-                    return f'+{hh}:{mm:02d}:{ss:02d}'
-                return f'+{mm}:{ss:02d}'
-
-            def _short(s: str, n: int) -> str:
-                s = (s or '').replace('\n', ' ').strip()
-                if n <= 0 or len(s) <= n:
-                    return s
-                return s[: max(0, n - 1)] + '…'
-
-            def _exit_code_from_output(text: object) -> int | None:
-                if not isinstance(text, str) or not text.strip():
-                    return None
-                m = re.search(r'Exit\\s+code:\\s*(\\d+)', text)
-                if not m:
-                    return None
-                try:
-                    return int(m.group(1))
-                except Exception:
-                    return None
-
-            def _exit_code_from_tool_output(text: object) -> int | None:
-                obj: object = None
-                if isinstance(text, dict):
-                    obj = text
-                elif isinstance(text, str) and text.strip():
-                    try:
-                        obj = json.loads(text)
-                    except Exception:
-                        obj = None
-                if not isinstance(obj, dict):
-                    return None
-                meta = obj.get('metadata')
-                if not isinstance(meta, dict):
-                    return None
-                exit_code_raw = meta.get('exit_code')
-                if isinstance(exit_code_raw, bool):
-                    return None
-                if isinstance(exit_code_raw, (int, float)):
-                    return int(exit_code_raw)
-                if isinstance(exit_code_raw, str):
-                    try:
-                        return int(exit_code_raw.strip())
-                    except Exception:
-                        return None
-                return None
-
-            def _detail_from_args(tool_name: str, args_raw: object) -> str:
-                args: object = None
-                if isinstance(args_raw, dict):
-                    args = args_raw
-                elif isinstance(args_raw, str) and args_raw.strip():
-                    try:
-                        args = json.loads(args_raw)
-                    except Exception:
-                        return _short(args_raw, 140)
-                else:
-                    return ''
-                if not isinstance(args, dict):
-                    return _short(str(args_raw), 140)
-                cmd = args.get('command')
-                if tool_name == 'shell_command' and isinstance(cmd, str) and cmd.strip():
-                    return _short(cmd.strip(), 140)
-                return _short(json.dumps(args, ensure_ascii=False), 140)
-
-            def _detail_from_tool_input(tool_name: str, raw: object) -> str:
-                if not isinstance(raw, str) or not raw.strip():
-                    return ''
-                if tool_name == 'apply_patch':
-                    files: list[str] = re.findall(
-                        r'^\\*\\*\\* (?:Update|Add|Delete) File: (.+)$', raw, flags=re.MULTILINE
-                    )
-                    files = [f.strip() for f in files if f.strip()]
-                    if files:
-                        if len(files) == 1:
-                            return str(files[0])
-                        return f'{files[0]} (+{len(files) - 1})'
-                return _short(raw.strip(), 120)
-
-            def on_event(ev: dict[str, Any]) -> None:
-                nonlocal last_progress_ts
-                now_ts = time.time()
+            def on_event(ev: dict[str, Any]) -> None:
+                nonlocal last_progress_ts
+                now_ts = time.time()
 
                 summary_body = ''
 
                 t = str(ev.get('type') or '').strip()
+                ev_msg = ev.get('message')
                 payload = ev.get('payload')
 
-                def _candidate_dicts(root: dict[str, Any]) -> list[dict[str, Any]]:
-                    out: list[dict[str, Any]] = []
+                def _candidate_dicts(root: dict[str, Any]) -> Iterator[dict[str, Any]]:
+                    # Walked lazily (no list per event): the top-level payload first, then nested dicts.
+                    if isinstance(payload, dict):
+                        yield payload
                     for key in ('payload', 'item', 'data', 'delta'):
                         v = root.get(key)
                         if isinstance(v, dict):
-                            out.append(v)
+                            if v is not payload:
+                                yield v
                             # Common nesting patterns (best-effort).
                             for inner_key in ('payload', 'item', 'data', 'delta'):
                                 inner = v.get(inner_key)
-                                if isinstance(inner, dict):
-                                    out.append(inner)
-                    return out
-
-                candidates = _candidate_dicts(ev)
-                if isinstance(payload, dict) and payload not in candidates:
-                    candidates.insert(0, payload)
+                                if isinstance(inner, dict) and inner is not payload:
+                                    yield inner
 
                 if live_chatter_enabled and not self.state.is_waiting_for_user(
                     chat_id=chat_id, message_thread_id=message_thread_id
                 ):
-                    text_candidates: list[str] = []
-                    msg0 = ev.get('message')
-                    if isinstance(msg0, str) and msg0.strip():
-                        text_candidates.append(msg0.strip())
-                    for node in candidates:
-                        for k in ('message', 'text', 'content'):
-                            v = node.get(k)
-                            if isinstance(v, str) and v.strip():
-                                text_candidates.append(v.strip())
-                    for txt in text_candidates:
-                        if not any(x in txt for x in ('tg_bot', 'tg-bot', 'tgctl', 'tg_bot_ctl')):
+
+                    def _text_candidates() -> Iterator[object]:
+                        yield ev_msg
+                        for node in _candidate_dicts(ev):
+                            for k in ('message', 'text', 'content'):
+                                yield node.get(k)
+
+                    for txt in _text_candidates():
+                        # The mention gate runs before strip(): most candidates are dropped without a copy.
+                        if not isinstance(txt, str) or not _TG_BOT_MENTION_RE.search(txt):
                             continue
+                        txt = txt.strip()
                         _, ctrl = _extract_tg_bot_control_block(txt)
                         if ctrl:
                             _maybe_send_chatter_from_ctrl(ctrl, now_ts=now_ts)
@@ -2918,12 +3532,16 @@ class Router:
                 def _maybe_tool_call_from(node: dict[str, Any]) -> bool:
                     nonlocal summary_body
 
+                    if _TOOL_CALL_NODE_KEYS.isdisjoint(node):
+                        return False
                     pt = str(node.get('type') or node.get('kind') or '').strip()
                     call_id = str(node.get('call_id') or node.get('id') or node.get('tool_call_id') or '').strip()
                     name = str(node.get('name') or node.get('tool_name') or '').strip()
 
-                    if pt in {'function_call', 'custom_tool_call', 'tool_call'}:
+                    if pt in _TOOL_CALL_TYPES:
                         if call_id and name:
+                            if call_id not in call_name_by_id and len(call_name_by_id) >= _TOOL_CALL_IDS_MAX:
+                                call_name_by_id.pop(next(iter(call_name_by_id)))
                             call_name_by_id[call_id] = name
 
                         detail = ''
@@ -2932,16 +3550,15 @@ class Router:
                         else:
                             detail = _detail_from_tool_input(name, node.get('input'))
                         if call_id and detail:
+                            if call_id not in call_detail_by_id and len(call_detail_by_id) >= _TOOL_CALL_IDS_MAX:
+                                call_detail_by_id.pop(next(iter(call_detail_by_id)))
                             call_detail_by_id[call_id] = detail
 
                         if name:
                             summary_body = f'{name}: {detail}' if detail else name
                             return True
 
-                    if (
-                        pt in {'function_call_output', 'custom_tool_call_output', 'tool_call_output'}
-                        or 'output' in node
-                    ):
+                    if pt in _TOOL_CALL_OUTPUT_TYPES or 'output' in node:
                         if call_id and call_id in call_name_by_id:
                             name = call_name_by_id.get(call_id) or name
                         detail = call_detail_by_id.get(call_id) or ''
@@ -2960,12 +3577,14 @@ class Router:
 
                     return False
 
-                for node in candidates:
+                node0: dict[str, Any] | None = None
+                for node in _candidate_dicts(ev):
+                    if node0 is None:
+                        node0 = node
                     if _maybe_tool_call_from(node):
                         break
 
-                if not summary_body and t.startswith('item.') and candidates:
-                    node0 = candidates[0]
+                if not summary_body and t.startswith('item.') and node0 is not None:
                     stage = str(node0.get('type') or node0.get('kind') or '').strip()
                     name0 = str(node0.get('name') or node0.get('tool_name') or '').strip()
                     if not stage and name0:
@@ -2975,14 +3594,10 @@ class Router:
                         # Make the common items more readable:
                         label = 'command' if stage == 'command_execution' else stage
 
-                        status_mark = ''
-                        if t.endswith('.started'):
-                            status_mark = '…'
-                        elif t.endswith('.completed'):
-                            status_mark = '✓'
+                        status_mark = _ITEM_STATUS_MARKS.get(t.rpartition('.')[2], '')
 
                         preview = ''
-                        for k in ('command', 'cmd', 'path', 'file', 'query', 'pattern'):
+                        for k in _ITEM_PREVIEW_KEYS:
                             v = node0.get(k)
                             if isinstance(v, str) and v.strip():
                                 preview = v.strip()
@@ -3012,30 +3627,18 @@ class Router:
                             summary_body = f'{label} {status_mark}'.strip()
 
                 if not summary_body:
-                    if not t or t in {
-                        'turn.started',
-                        'thread.started',
-                        'turn_context',
-                        'event_msg',
-                        'response_item',
-                        'session_meta',
-                    }:
+                    if not t or t in _IGNORED_EVENT_TYPES:
                         return
-                    msg = ev.get('message')
-                    msg_s = msg.strip() if isinstance(msg, str) else ''
+                    msg_s = ev_msg.strip() if isinstance(ev_msg, str) else ''
                     summary_body = f'{t}: {msg_s}' if msg_s else t
 
-                summary = f'{_fmt_elapsed(now_ts)} {summary_body}'.replace('\n', ' ').strip()
-                summary = _short(summary, 220)
+                summary = _short(f'{_fmt_elapsed(now_ts, started_ts)} {summary_body}', 220)
 
                 if progress_lines and progress_lines[-1] == summary:
                     return
                 progress_lines.append(summary)
-                if len(progress_lines) > 3:
-                    del progress_lines[:-3]
 
-                block = '\n'.join([f'• {x}' for x in progress_lines])
-                status['detail'] = (base_detail + '\n\n🛰️ Exec events:\n' + block).strip()
+                status['detail'] = exec_detail_prefix + '\n'.join(['• ' + x for x in progress_lines])
 
             use_json_progress = _env_bool('TG_CODEX_JSON_PROGRESS', False)
             repo_root, env_policy = self._codex_context(chat_id)
@@ -3046,32 +3649,32 @@ class Router:
 
             # Crash recovery: persist the current Codex job before starting the run. If the bot is restarted
             # mid-run (systemd restart, crash), we can auto-resume it from `pending_codex_jobs_by_scope`.
+            now_ts = time.time()
+            job = {
+                'payload': payload,
+                'attachments': list(attachments or []),
+                'reply_to': dict(reply_to) if isinstance(reply_to, dict) else None,
+                'sent_ts': received_ts,
+                'automation': bool(automation),
+                'dangerous': bool(dangerous),
+                'profile_name': str(profile.name),
+                'exec_mode': str(exec_mode),
+                'reason': str(reason),
+                'reasoning_effort': str(reasoning_effort),
+                'defer_reason': 'in_progress',
+                'message_id': message_id,
+                'ack_message_id': int(ack_id or 0),
+                'message_thread_id': message_thread_id,
+                'user_id': user_id,
+                'model': run_model,
+                'tg_chat': dict(tg_chat) if isinstance(tg_chat, dict) else None,
+                'tg_user': dict(tg_user) if isinstance(tg_user, dict) else None,
+                'created_ts': float(now_ts),
+                'attempts': 0,
+                'next_attempt_ts': float(now_ts),
+                'last_error': 'in_progress',
+            }
             try:
-                now_ts = time.time()
-                job = {
-                    'payload': payload,
-                    'attachments': list(attachments or []),
-                    'reply_to': dict(reply_to) if isinstance(reply_to, dict) else None,
-                    'sent_ts': float(received_ts or 0.0),
-                    'automation': bool(automation),
-                    'dangerous': bool(dangerous),
-                    'profile_name': str(profile.name),
-                    'exec_mode': str(exec_mode),
-                    'reason': str(reason),
-                    'reasoning_effort': str(reasoning_effort),
-                    'defer_reason': 'in_progress',
-                    'message_id': int(message_id or 0),
-                    'ack_message_id': int(ack_id or 0),
-                    'message_thread_id': int(message_thread_id or 0),
-                    'user_id': int(user_id or 0),
-                    'model': run_model,
-                    'tg_chat': dict(tg_chat) if isinstance(tg_chat, dict) else None,
-                    'tg_user': dict(tg_user) if isinstance(tg_user, dict) else None,
-                    'created_ts': float(now_ts),
-                    'attempts': 0,
-                    'next_attempt_ts': float(now_ts),
-                    'last_error': 'in_progress',
-                }
                 self.state.set_pending_codex_job(chat_id=chat_id, message_thread_id=message_thread_id, job=job)
                 job_registered = True
             except Exception:
@@ -3086,7 +3689,7 @@ class Router:
                 )
             except Exception:
                 pass
-            run_t0 = time.time()
+            run_t0 = time.monotonic()
             session_key = self._codex_session_key(chat_id=chat_id, message_thread_id=message_thread_id)
             if dangerous:
                 answer = self.codex.run_dangerous_with_progress(
@@ -3109,7 +3712,7 @@ class Router:
                     env_policy=env_policy,
                     config_overrides=codex_config_overrides,
                 )
-            run_ms = (time.time() - run_t0) * 1000.0
+            run_ms = (time.monotonic() - run_t0) * 1000.0
             self.state.metric_observe_ms('codex.run', run_ms)
             self.state.metric_inc(
                 'codex.run.danger' if dangerous else ('codex.run.write' if automation else 'codex.run.read')
@@ -3121,31 +3724,6 @@ class Router:
             if isinstance(answer, str) and answer.lstrip().startswith('[codex error]') and not self._codex_network_ok():
                 self.state.metric_inc('codex.run.deferred_network')
                 now_ts = time.time()
-                if not job or not str(job.get('payload') or '').strip():
-                    job = {
-                        'payload': payload,
-                        'attachments': list(attachments or []),
-                        'reply_to': dict(reply_to) if isinstance(reply_to, dict) else None,
-                        'sent_ts': float(received_ts or 0.0),
-                        'automation': bool(automation),
-                        'dangerous': bool(dangerous),
-                        'profile_name': str(profile.name),
-                        'exec_mode': str(exec_mode),
-                        'reason': str(reason),
-                        'reasoning_effort': str(reasoning_effort),
-                        'defer_reason': 'network',
-                        'message_id': int(message_id or 0),
-                        'ack_message_id': int(ack_id or 0),
-                        'message_thread_id': int(message_thread_id or 0),
-                        'user_id': int(user_id or 0),
-                        'model': run_model,
-                        'tg_chat': dict(tg_chat) if isinstance(tg_chat, dict) else None,
-                        'tg_user': dict(tg_user) if isinstance(tg_user, dict) else None,
-                        'created_ts': float(now_ts),
-                        'attempts': 0,
-                        'next_attempt_ts': float(now_ts),
-                        'last_error': 'in_progress',
-                    }
                 attempts = int(job.get('attempts') or 0) + 1
                 job['attempts'] = attempts
                 job['defer_reason'] = 'network'
@@ -3288,8 +3866,6 @@ class Router:
                     msg_lines.append(f'Дефолт: {default_s}')
                 question_msg = '\n'.join([x for x in msg_lines if x is not None]).strip()
 
-                from . import keyboards
-
                 reply_markup = keyboards.ask_user_menu(options=options, default=default_s)
 
                 self._send_message(
@@ -3316,9 +3892,9 @@ class Router:
                             'ping_count': 0,
                             'last_ping_ts': 0.0,
                             'mode': mode,
-                            'origin_message_id': int(message_id or 0),
+                            'origin_message_id': message_id,
                             'origin_ack_message_id': int(ack_id or 0),
-                            'origin_user_id': int(user_id or 0),
+                            'origin_user_id': user_id,
                         },
                     )
                     self.state.metric_inc('user_in_loop.question_asked')
@@ -3341,11 +3917,11 @@ class Router:
                 chat_id=chat_id,
                 answer=answer,
                 payload=payload,
-                attachments=(list(attachments or []) if isinstance(attachments, list) else None),
-                reply_to=(dict(reply_to) if isinstance(reply_to, dict) else None),
-                received_ts=float(received_ts or 0.0),
-                user_id=int(user_id or 0),
-                message_id=int(message_id or 0),
+                attachments=attachments if isinstance(attachments, list) else None,
+                reply_to=reply_to if isinstance(reply_to, dict) else None,
+                received_ts=received_ts,
+                user_id=user_id,
+                message_id=message_id,
                 dangerous=bool(dangerous),
             )
 
@@ -3439,1025 +4015,973 @@ class Router:
         ack_message_id: int = 0,
         tg_chat: dict[str, Any] | None = None,
         tg_user: dict[str, Any] | None = None,
+        callback_answered: bool = False,
     ) -> None:
         """Handle inline button presses.
 
         We map buttons to the same semantics as commands so the bot stays predictable.
+        `callback_answered=True` means the caller already stopped the spinner (app.py does it on the poll thread).
         """
-        from . import keyboards
-
-        self._tg_thread_ctx.chat_id = int(chat_id)
-        self._tg_thread_ctx.message_thread_id = int(message_thread_id or 0)
+        # Scalar ids are coerced here once; the rest of the handler uses them as is.
+        chat_id = int(chat_id)
+        message_thread_id = int(message_thread_id or 0)
+        user_id = int(user_id or 0)
+        message_id = int(message_id or 0)
+        ack_message_id = int(ack_message_id or 0)
+        self._tg_thread_ctx.chat_id = chat_id
+        self._tg_thread_ctx.message_thread_id = message_thread_id
+
+        # Prefixed callbacks are '<head>:<tail>': split once instead of probing every prefix with startswith().
+        cb_head, cb_sep, cb_tail = data.partition(':')
+        cb_prefix = f'{cb_head}:' if cb_sep else ''
+        cb_tail = cb_tail.strip()
+
+        # Stop the "loading" spinner ASAP (a second answer is just a wasted round-trip that Telegram rejects).
+        if not callback_answered:
+            try:
+                self.api.answer_callback_query(callback_query_id=callback_query_id)
+            except Exception:
+                pass
 
-        # Stop the "loading" spinner ASAP.
-        try:
-            self.api.answer_callback_query(callback_query_id=callback_query_id)
-        except Exception:
-            pass
+        # Owner gating is decided once per click (the owner id is cached as an int in __post_init__).
+        multi_tenant = self._owner_chat_int != 0
+        is_owner = multi_tenant and chat_id == self._owner_chat_int
 
-        # Any click counts as activity.
-        counts_for_watch = (int(self.owner_chat_id or 0) == 0 or self._is_owner_chat(chat_id)) and int(chat_id) > 0
-        self.state.mark_user_activity(chat_id=chat_id, user_id=user_id, counts_for_watch=counts_for_watch)
+        # Any click counts as activity; mark_user_activity saves the whole state, so click bursts write it once.
+        # A click after a watcher ping always goes through: it is what disarms the ping escalation.
+        activity_key = (chat_id, user_id)
+        now_mono = time.monotonic()
+        counts_for_watch = (is_owner or not multi_tenant) and chat_id > 0
+        last_activity_ts = self._callback_activity_ts.get(activity_key)
+        if (
+            last_activity_ts is None
+            or now_mono - last_activity_ts >= _CALLBACK_ACTIVITY_MIN_INTERVAL_S
+            or (counts_for_watch and self.state.ping_pending())
+        ):
+            if last_activity_ts is None and len(self._callback_activity_ts) >= _CALLBACK_ACTIVITY_MAX_KEYS:
+                for stale_key, ts in list(self._callback_activity_ts.items()):
+                    if now_mono - ts >= _CALLBACK_ACTIVITY_MIN_INTERVAL_S:
+                        self._callback_activity_ts.pop(stale_key, None)
+            self._callback_activity_ts[activity_key] = now_mono
+            self.state.mark_user_activity(chat_id=chat_id, user_id=user_id, counts_for_watch=counts_for_watch)
 
         # Record what user pressed (store a human label, keep raw callback in meta).
-        label = keyboards.describe_callback_data(data) or data
+        if cb_prefix in _CALLBACK_HISTORY_SKIP_PREFIXES:
+            self.state.metric_inc('history.button.skipped')
+        else:
+            label = keyboards.describe_callback_data(data) or data
 
-        meta: dict[str, Any] = {'callback': data, 'message_id': int(message_id)}
-        if int(message_thread_id or 0) > 0:
-            meta['message_thread_id'] = int(message_thread_id)
+            meta: dict[str, Any] = {'callback': data, 'message_id': message_id}
+            if message_thread_id > 0:
+                meta['message_thread_id'] = message_thread_id
 
-        self.state.append_history(
-            role='user',
-            kind='button',
-            text=label,
-            meta=meta,
+            self.state.append_history(
+                role='user',
+                kind='button',
+                text=label,
+                meta=meta,
+                chat_id=chat_id,
+                message_thread_id=message_thread_id,
+                max_events=self.history_max_events,
+                max_chars=self.history_entry_max_chars,
+            )
+
+        cb = _CallbackQuery(
             chat_id=chat_id,
             message_thread_id=message_thread_id,
-            max_events=self.history_max_events,
-            max_chars=self.history_entry_max_chars,
+            user_id=user_id,
+            data=data,
+            prefix=cb_prefix,
+            tail=cb_tail,
+            callback_query_id=callback_query_id,
+            message_id=message_id,
+            ack_message_id=ack_message_id,
+            tg_chat=tg_chat,
+            tg_user=tg_user,
+            multi_tenant=multi_tenant,
+            is_owner=is_owner,
         )
-
-        # Voice-route selection (control plane, no Codex).
-        if data.startswith(keyboards.CB_VOICE_ROUTE_PREFIX):
-            rest = data[len(keyboards.CB_VOICE_ROUTE_PREFIX) :].strip()
-            parts = rest.split(':')
-            if len(parts) == 2:
-                try:
-                    voice_mid = int(parts[0] or 0)
-                except Exception:
-                    voice_mid = 0
-                mode = str(parts[1] or '').strip().lower()
-                choice = {'r': 'read', 'w': 'write', 'd': 'danger', 'n': 'none'}.get(mode, '')
-                if voice_mid > 0 and choice:
-                    self.state.metric_inc('voice.route.click')
-                    self.state.set_voice_route_choice(
-                        chat_id=chat_id,
-                        message_thread_id=message_thread_id,
-                        voice_message_id=voice_mid,
-                        choice=choice,
-                    )
-                    if message_id > 0:
-                        try:
-                            self.api.edit_message_reply_markup(
-                                chat_id=chat_id,
-                                message_id=message_id,
-                                reply_markup=keyboards.voice_route_menu(
-                                    voice_message_id=voice_mid,
-                                    selected=choice,
-                                ),
-                            )
-                        except Exception:
-                            pass
+        # Voice route / ask-user / model picker run before the owner and group-chat gates (own checks inside).
+        handler_name = _CALLBACK_OPEN_PREFIX_HANDLERS.get(cb_prefix)
+        if handler_name:
+            getattr(self, handler_name)(cb)
             return
 
-        if data.startswith(keyboards.CB_ASK_USER_PREFIX):
-            waiting = self.state.waiting_for_user(chat_id=chat_id, message_thread_id=message_thread_id)
-            if waiting is None:
-                if message_id > 0:
-                    try:
-                        self.api.edit_message_reply_markup(chat_id=chat_id, message_id=message_id, reply_markup=None)
-                    except Exception:
-                        pass
+        if multi_tenant and not is_owner:
+            if data not in _CALLBACK_PUBLIC_ALLOWED:
                 self._send_message(
                     chat_id=chat_id,
-                    message_thread_id=message_thread_id,
-                    text='⚠️ Этот вопрос уже не актуален.',
+                    text='⛔️ Эта кнопка доступна только в owner-чате.',
                     reply_to_message_id=message_id or None,
                 )
                 return
 
-            rest = data[len(keyboards.CB_ASK_USER_PREFIX) :].strip()
-            answer_text = ''
-            if rest == 'def':
-                d = waiting.get('default')
-                answer_text = d.strip() if isinstance(d, str) else ''
-            elif rest.isdigit():
-                try:
-                    idx = int(rest) - 1
-                except Exception:
-                    idx = -1
-                opts = waiting.get('options')
-                if isinstance(opts, list) and 0 <= idx < len(opts) and isinstance(opts[idx], str):
-                    answer_text = str(opts[idx]).strip()
-
-            if not answer_text:
-                answer_text = rest
-
-            if message_id > 0:
-                try:
-                    self.api.edit_message_reply_markup(chat_id=chat_id, message_id=message_id, reply_markup=None)
-                except Exception:
-                    pass
-
-            if not answer_text:
+        # Group chats: allow only safe Codex follow-up buttons.
+        if chat_id < 0:
+            if data not in _CALLBACK_PUBLIC_ALLOWED:
                 self._send_message(
                     chat_id=chat_id,
-                    message_thread_id=message_thread_id,
-                    text='⚠️ Не понял ответ. Ответь текстом, пожалуйста.',
+                    text='⛔️ Эта кнопка доступна только в личке.',
                     reply_to_message_id=message_id or None,
                 )
                 return
 
-            try:
-                origin_ack = int(waiting.get('origin_ack_message_id') or 0)
-            except Exception:
-                origin_ack = 0
-
-            self.handle_text(
-                chat_id=chat_id,
-                message_thread_id=message_thread_id,
-                user_id=user_id,
-                text=answer_text,
-                message_id=0,
-                ack_message_id=origin_ack,
-                skip_history=True,
-                tg_chat=tg_chat,
-                tg_user=tg_user,
-            )
+        handler_name = _CALLBACK_PREFIX_HANDLERS.get(cb_prefix) or _CALLBACK_EXACT_HANDLERS.get(data)
+        if handler_name:
+            getattr(self, handler_name)(cb)
             return
 
-        multi_tenant = int(self.owner_chat_id or 0) != 0
-        is_owner = self._is_owner_chat(chat_id)
+        # Unknown callback
+        self._send_message(chat_id=chat_id, text='Не понял кнопку. /help', reply_to_message_id=message_id or None)
 
-        if data.startswith(_MODEL_CB_PREFIX):
-            if int(chat_id) < 0:
-                self._send_message(
-                    chat_id=chat_id,
-                    text='⛔️ Эта кнопка доступна только в личке.',
-                    reply_to_message_id=message_id or None,
-                )
-                return
-            if multi_tenant and not is_owner:
-                self._send_message(
-                    chat_id=chat_id,
-                    text='⛔️ Эта кнопка доступна только в owner-чате.',
-                    reply_to_message_id=message_id or None,
-                )
-                return
+    def _cb_admin_menu(self, cb: _CallbackQuery) -> None:
+        """Admin menu (owner chat only)."""
+        chat_id = cb.chat_id
+        message_id = cb.message_id
+        text_out, reply_markup = self._render_admin_menu(chat_id=chat_id)
+        self._send_or_edit_message(
+            chat_id=chat_id,
+            text=text_out,
+            ack_message_id=message_id,
+            reply_markup=reply_markup,
+            reply_to_message_id=message_id or None,
+            kind='bot',
+        )
 
-            raw_model = data[len(_MODEL_CB_PREFIX) :].strip()
-            selected_model = '' if not raw_model or raw_model == _MODEL_CB_DEFAULT else raw_model
-            scope_thread_id = int(self._tg_message_thread_id() or 0)
-            self.state.set_last_codex_profile_state(
-                chat_id=chat_id,
-                message_thread_id=scope_thread_id,
-                mode=self.state.last_codex_mode_for(chat_id=chat_id, message_thread_id=scope_thread_id),
-                reasoning=self.state.last_codex_reasoning_for(chat_id=chat_id, message_thread_id=scope_thread_id),
-                model=selected_model,
+    def _cb_admin_command(self, cb: _CallbackQuery) -> None:
+        """Admin menu buttons that map 1:1 to an owner command."""
+        chat_id = cb.chat_id
+        user_id = cb.user_id
+        message_id = cb.message_id
+        admin_cmd = _CALLBACK_ADMIN_COMMANDS[cb.data]
+        self._handle_command(
+            chat_id=chat_id,
+            user_id=user_id,
+            text=admin_cmd,
+            reply_to_message_id=message_id or None,
+            ack_message_id=message_id,
+        )
+
+    def _cb_dismiss(self, cb: _CallbackQuery) -> None:
+        """One-off: delete the message that hosts this inline keyboard."""
+        chat_id = cb.chat_id
+        message_id = cb.message_id
+        self.state.metric_inc('delivery.dismiss.click')
+        if message_id > 0:
+            try:
+                self.api.delete_message(chat_id=chat_id, message_id=message_id)
+                self.state.metric_inc('delivery.dismiss.ok')
+            except Exception:
+                self.state.metric_inc('delivery.dismiss.fail')
+                pass
+
+    def _cb_ack(self, cb: _CallbackQuery) -> None:
+        """'I'm here' / 'back': clear the snooze."""
+        chat_id = cb.chat_id
+        message_id = cb.message_id
+        self.state.clear_snooze()
+        self._send_message(chat_id=chat_id, text='✅ Ок, на связи.', reply_to_message_id=message_id or None)
+
+    def _cb_lunch(self, cb: _CallbackQuery) -> None:
+        """Lunch break: snooze for an hour."""
+        chat_id = cb.chat_id
+        message_id = cb.message_id
+        self.state.set_snooze(60 * 60, kind='lunch')
+        self._send_message(
+            chat_id=chat_id,
+            text='🍽️ Ок, пауза на 60 минут. Вернёшься — /back.',
+            reply_to_message_id=message_id or None,
+        )
+
+    def _cb_mute(self, cb: _CallbackQuery) -> None:
+        """Mute buttons (30m/1h/2h/1d); repeated mutes may auto-enable gentle mode."""
+        chat_id = cb.chat_id
+        message_id = cb.message_id
+        seconds, label = _CALLBACK_MUTES[cb.data]
+        self.state.set_snooze(seconds, kind='mute')
+        self._send_message(chat_id=chat_id, text=f'🔕 Ок. Пауза {label}.', reply_to_message_id=message_id or None)
+        self._maybe_auto_enable_gentle(chat_id=chat_id, reason='auto: multiple mutes')
+
+    def _cb_gentle_toggle(self, cb: _CallbackQuery) -> None:
+        """Gentle mode toggle."""
+        chat_id = cb.chat_id
+        message_id = cb.message_id
+        if self.state.is_gentle_active():
+            self.state.disable_gentle()
+            self._send_message(
+                chat_id=chat_id, text='▶️ Ок. Щадящий режим выключен.', reply_to_message_id=message_id or None
+            )
+        else:
+            self.state.enable_gentle(
+                seconds=int(self.gentle_default_minutes) * 60, reason='manual: user pressed button', extend=True
             )
-            model_label = selected_model if isinstance(selected_model, str) and selected_model else '<default>'
             self._send_message(
                 chat_id=chat_id,
-                text=f'✅ Модель для scope {chat_id}:{scope_thread_id} сохранена: {model_label}',
+                text=f'🫶 Ок. Включил щадящий режим на {self.gentle_default_minutes}м.',
                 reply_to_message_id=message_id or None,
             )
-            return
 
-        if multi_tenant and not is_owner:
-            allowed = {
-                keyboards.CB_CX_SHORTER,
-                keyboards.CB_CX_PLAN3,
-                keyboards.CB_CX_STATUS1,
-                keyboards.CB_CX_NEXT,
-                keyboards.CB_DISMISS,
-            }
-            if data not in allowed:
-                self._send_message(
-                    chat_id=chat_id,
-                    text='⛔️ Эта кнопка доступна только в owner-чате.',
-                    reply_to_message_id=message_id or None,
-                )
-                return
+    def _cb_status(self, cb: _CallbackQuery) -> None:
+        """Quick status."""
+        chat_id = cb.chat_id
+        message_id = cb.message_id
+        base = self.watcher.build_status_text(dt.datetime.now(), self.state)
+        gentle = 'ON' if self.state.is_gentle_active() else 'OFF'
+        snooze = 'ON' if self.state.is_snoozed() else 'OFF'
+        self._send_message(
+            chat_id=chat_id,
+            text=(f'📌 Статус\n{base}\nGentle: {gentle}\nSnooze: {snooze}'),
+            reply_markup=keyboards.help_menu(gentle_active=self.state.is_gentle_active()),
+            reply_to_message_id=message_id or None,
+        )
 
-        # Group chats: allow only safe Codex follow-up buttons.
-        if int(chat_id) < 0:
-            allowed = {
-                keyboards.CB_CX_SHORTER,
-                keyboards.CB_CX_PLAN3,
-                keyboards.CB_CX_STATUS1,
-                keyboards.CB_CX_NEXT,
-                keyboards.CB_DISMISS,
-            }
-            if data not in allowed:
-                self._send_message(
-                    chat_id=chat_id,
-                    text='⛔️ Эта кнопка доступна только в личке.',
-                    reply_to_message_id=message_id or None,
-                )
-                return
+    def _cb_template_status(self, cb: _CallbackQuery) -> None:
+        """Template for a 1-line status."""
+        chat_id = cb.chat_id
+        message_id = cb.message_id
+        self._send_message(
+            chat_id=chat_id,
+            text=_TEMPLATE_STATUS_TEXT,
+            reply_markup=keyboards.help_menu(gentle_active=self.state.is_gentle_active()),
+            reply_to_message_id=message_id or None,
+        )
 
-        # Settings (owner chat only)
-        if data in {
-            keyboards.CB_SETTINGS,
-            keyboards.CB_SETTINGS_DELIVERY_EDIT,
-            keyboards.CB_SETTINGS_DELIVERY_NEW,
-            keyboards.CB_SETTINGS_DONE_TOGGLE,
-            keyboards.CB_SETTINGS_DONE_TTL_CYCLE,
-            keyboards.CB_SETTINGS_BOT_INITIATIVES_TOGGLE,
-            keyboards.CB_SETTINGS_LIVE_CHATTER_TOGGLE,
-            keyboards.CB_SETTINGS_MCP_LIVE_TOGGLE,
-            keyboards.CB_SETTINGS_USER_IN_LOOP_TOGGLE,
-        }:
-            if data == keyboards.CB_SETTINGS_DELIVERY_EDIT:
-                self.state.ux_set_prefer_edit_delivery(chat_id=chat_id, value=True)
-            elif data == keyboards.CB_SETTINGS_DELIVERY_NEW:
-                self.state.ux_set_prefer_edit_delivery(chat_id=chat_id, value=False)
-            elif data == keyboards.CB_SETTINGS_DONE_TOGGLE:
-                done_enabled = self.state.ux_done_notice_enabled(chat_id=chat_id)
-                self.state.ux_set_done_notice_enabled(chat_id=chat_id, value=(not done_enabled))
-            elif data == keyboards.CB_SETTINGS_DONE_TTL_CYCLE:
-                ttl_seconds = self.state.ux_done_notice_delete_seconds(chat_id=chat_id)
-                options = [60, 300, 900, 0]
-                if ttl_seconds not in options:
-                    nxt = options[0]
-                else:
-                    nxt = options[(options.index(ttl_seconds) + 1) % len(options)]
-                self.state.ux_set_done_notice_delete_seconds(chat_id=chat_id, seconds=nxt)
-            elif data == keyboards.CB_SETTINGS_BOT_INITIATIVES_TOGGLE:
-                bot_initiatives_enabled = self.state.ux_bot_initiatives_enabled(chat_id=chat_id)
-                self.state.ux_set_bot_initiatives_enabled(chat_id=chat_id, value=(not bot_initiatives_enabled))
-            elif data == keyboards.CB_SETTINGS_LIVE_CHATTER_TOGGLE:
-                chatter_enabled = self.state.ux_live_chatter_enabled(chat_id=chat_id)
-                self.state.ux_set_live_chatter_enabled(chat_id=chat_id, value=(not chatter_enabled))
-            elif data == keyboards.CB_SETTINGS_MCP_LIVE_TOGGLE:
-                mcp_live_enabled = self.state.ux_mcp_live_enabled(chat_id=chat_id)
-                self.state.ux_set_mcp_live_enabled(chat_id=chat_id, value=(not mcp_live_enabled))
-            elif data == keyboards.CB_SETTINGS_USER_IN_LOOP_TOGGLE:
-                user_in_loop_enabled = self.state.ux_user_in_loop_enabled(chat_id=chat_id)
-                self.state.ux_set_user_in_loop_enabled(chat_id=chat_id, value=(not user_in_loop_enabled))
+    def _cb_eod(self, cb: _CallbackQuery) -> None:
+        """End-of-day trigger (runs as a forced-write text request)."""
+        chat_id = cb.chat_id
+        message_thread_id = cb.message_thread_id
+        user_id = cb.user_id
+        message_id = cb.message_id
+        tg_chat = cb.tg_chat
+        tg_user = cb.tg_user
+        self.handle_text(
+            chat_id=chat_id,
+            message_thread_id=message_thread_id,
+            user_id=user_id,
+            text=self._eod_text,
+            attachments=None,
+            message_id=message_id,
+            tg_chat=tg_chat,
+            tg_user=tg_user,
+        )
 
-            text_out, reply_markup = self._render_settings_menu(chat_id=chat_id)
-            self._send_or_edit_message(
-                chat_id=chat_id,
-                text=text_out,
-                ack_message_id=int(message_id or 0),
-                reply_markup=reply_markup,
-                reply_to_message_id=message_id or None,
-                kind='bot',
-            )
-            return
+    def _cb_reset(self, cb: _CallbackQuery) -> None:
+        """Reset Codex sessions."""
+        chat_id = cb.chat_id
+        message_id = cb.message_id
+        self.codex.reset()
+        self._send_message(
+            chat_id=chat_id,
+            text='♻️ Сбросил telegram-Codex сессии (CODEX_HOME профилей).',
+            reply_to_message_id=message_id or None,
+        )
 
-        # Admin menu (owner chat only)
-        if data == keyboards.CB_ADMIN:
-            text_out, reply_markup = self._render_admin_menu(chat_id=chat_id)
-            self._send_or_edit_message(
-                chat_id=chat_id,
-                text=text_out,
-                ack_message_id=int(message_id or 0),
-                reply_markup=reply_markup,
-                reply_to_message_id=message_id or None,
-                kind='bot',
-            )
-            return
+    def _cb_settings(self, cb: _CallbackQuery) -> None:
+        """Settings menu toggles (owner chat only); re-renders the menu in place."""
+        chat_id = cb.chat_id
+        message_id = cb.message_id
+        data = cb.data
+        if data == keyboards.CB_SETTINGS_DELIVERY_EDIT:
+            self.state.ux_set_prefer_edit_delivery(chat_id=chat_id, value=True)
+        elif data == keyboards.CB_SETTINGS_DELIVERY_NEW:
+            self.state.ux_set_prefer_edit_delivery(chat_id=chat_id, value=False)
+        elif data == keyboards.CB_SETTINGS_DONE_TOGGLE:
+            done_enabled = self.state.ux_done_notice_enabled(chat_id=chat_id)
+            self.state.ux_set_done_notice_enabled(chat_id=chat_id, value=(not done_enabled))
+        elif data == keyboards.CB_SETTINGS_DONE_TTL_CYCLE:
+            ttl_seconds = self.state.ux_done_notice_delete_seconds(chat_id=chat_id)
+            options = [60, 300, 900, 0]
+            if ttl_seconds not in options:
+                nxt = options[0]
+            else:
+                nxt = options[(options.index(ttl_seconds) + 1) % len(options)]
+            self.state.ux_set_done_notice_delete_seconds(chat_id=chat_id, seconds=nxt)
+        elif data == keyboards.CB_SETTINGS_BOT_INITIATIVES_TOGGLE:
+            bot_initiatives_enabled = self.state.ux_bot_initiatives_enabled(chat_id=chat_id)
+            self.state.ux_set_bot_initiatives_enabled(chat_id=chat_id, value=(not bot_initiatives_enabled))
+        elif data == keyboards.CB_SETTINGS_LIVE_CHATTER_TOGGLE:
+            chatter_enabled = self.state.ux_live_chatter_enabled(chat_id=chat_id)
+            self.state.ux_set_live_chatter_enabled(chat_id=chat_id, value=(not chatter_enabled))
+        elif data == keyboards.CB_SETTINGS_MCP_LIVE_TOGGLE:
+            mcp_live_enabled = self.state.ux_mcp_live_enabled(chat_id=chat_id)
+            self.state.ux_set_mcp_live_enabled(chat_id=chat_id, value=(not mcp_live_enabled))
+        elif data == keyboards.CB_SETTINGS_USER_IN_LOOP_TOGGLE:
+            user_in_loop_enabled = self.state.ux_user_in_loop_enabled(chat_id=chat_id)
+            self.state.ux_set_user_in_loop_enabled(chat_id=chat_id, value=(not user_in_loop_enabled))
+
+        text_out, reply_markup = self._render_settings_menu(chat_id=chat_id)
+        self._send_or_edit_message(
+            chat_id=chat_id,
+            text=text_out,
+            ack_message_id=message_id,
+            reply_markup=reply_markup,
+            reply_to_message_id=message_id or None,
+            kind='bot',
+        )
 
-        if data in {
-            keyboards.CB_ADMIN_DOCTOR,
-            keyboards.CB_ADMIN_STATS,
-            keyboards.CB_ADMIN_DROP_QUEUE,
-            keyboards.CB_ADMIN_DROP_ALL,
-        }:
-            cmd = {
-                keyboards.CB_ADMIN_DOCTOR: '/doctor',
-                keyboards.CB_ADMIN_STATS: '/stats',
-                keyboards.CB_ADMIN_DROP_QUEUE: '/drop queue',
-                keyboards.CB_ADMIN_DROP_ALL: '/drop all',
-            }[data]
-            self._handle_command(
-                chat_id=chat_id,
-                user_id=user_id,
-                text=cmd,
-                reply_to_message_id=message_id or None,
-                ack_message_id=int(message_id or 0),
-            )
-            return
+    def _ensure_progress_message(self, cb: _CallbackQuery, *, title: str) -> tuple[int, str]:
+        """Show `title` in the callback's progress message; return `(progress_message_id, ack_key)`.
 
-        # Queue UI (owner chat)
-        if data.startswith(keyboards.CB_QUEUE_EDIT_PREFIX):
-            raw_page = data[len(keyboards.CB_QUEUE_EDIT_PREFIX) :].strip()
+        Reuses the ack the poll thread already posted (by id or coalesce key), otherwise replies to the
+        button's message. `progress_message_id` is 0 if nothing could be shown.
+        """
+        chat_id = cb.chat_id
+        message_id = cb.message_id
+        ack_key = self._ack_coalesce_key_for_callback(chat_id=chat_id, callback_query_id=cb.callback_query_id)
+        progress_message_id = cb.ack_message_id
+        if progress_message_id <= 0 and ack_key:
+            progress_message_id = int(
+                self.state.tg_message_id_for_coalesce_key(chat_id=chat_id, coalesce_key=ack_key) or 0
+            )
+        if progress_message_id > 0:
+            self._maybe_edit_ack_or_queue(
+                chat_id=chat_id, message_id=progress_message_id, coalesce_key=ack_key, text=title
+            )
+        elif message_id > 0:
             try:
-                page = int(raw_page)
+                resp = self._api_send_message(
+                    chat_id=chat_id,
+                    message_thread_id=self._tg_message_thread_id(),
+                    text=title,
+                    reply_to_message_id=message_id,
+                    coalesce_key=(ack_key or None),
+                    timeout=10,
+                )
+                progress_message_id = _extract_message_id(resp)
             except Exception:
-                page = 0
-            if self.runtime_queue_edit_set:
-                try:
-                    self.runtime_queue_edit_set(True)
-                except Exception:
-                    pass
-            text_out, reply_markup_opt = self._render_queue_page(chat_id=chat_id, page=page, page_size=5)
-            self._send_or_edit_message(
+                progress_message_id = 0
+        return progress_message_id, ack_key
+
+    def _cb_summary(self, cb: _CallbackQuery) -> None:
+        """Read-only Codex summary of the current scope, delivered like a normal Codex answer."""
+        chat_id = cb.chat_id
+        message_thread_id = cb.message_thread_id
+        user_id = cb.user_id
+        message_id = cb.message_id
+        tg_chat = cb.tg_chat
+        tg_user = cb.tg_user
+        started_ts = time.time()
+        status: dict[str, str] = {'title': '▶️ Codex: сводка…', 'detail': ''}
+
+        progress_message_id, ack_key = self._ensure_progress_message(cb, title=status['title'])
+
+        stop_hb, hb_thread = self._start_heartbeat(
+            chat_id=chat_id,
+            message_thread_id=message_thread_id,
+            ack_message_id=int(progress_message_id or 0),
+            ack_coalesce_key=ack_key,
+            started_ts=started_ts,
+            status=status,
+        )
+        prompt = _SUMMARY_PROMPT
+        try:
+            wrapped = self._wrap_user_prompt(prompt, chat_id=chat_id, tg_chat=tg_chat, tg_user=tg_user)
+            repo_root, env_policy = self._codex_context(chat_id)
+            session_key = self._codex_session_key(chat_id=chat_id, message_thread_id=message_thread_id)
+            answer = self.codex.run(
+                prompt=wrapped,
+                automation=False,
                 chat_id=chat_id,
-                text=text_out,
-                ack_message_id=int(message_id or 0),
-                reply_markup=reply_markup_opt,
-                reply_to_message_id=message_id or None,
-                kind='bot',
+                session_key=session_key,
+                repo_root=repo_root,
+                env_policy=env_policy,
+                config_overrides={'model_reasoning_effort': 'medium'},
             )
-            return
-
-        if data.startswith(keyboards.CB_QUEUE_DONE_PREFIX):
-            raw_page = data[len(keyboards.CB_QUEUE_DONE_PREFIX) :].strip()
-            try:
-                page = int(raw_page)
-            except Exception:
-                page = 0
-            if self.runtime_queue_edit_set:
-                try:
-                    self.runtime_queue_edit_set(False)
-                except Exception:
-                    pass
-            text_out, reply_markup_opt = self._render_queue_page(chat_id=chat_id, page=page, page_size=5)
-            self._send_or_edit_message(
+            self.state.set_last_codex_run(
                 chat_id=chat_id,
-                text=text_out,
-                ack_message_id=int(message_id or 0),
-                reply_markup=reply_markup_opt,
-                reply_to_message_id=message_id or None,
-                kind='bot',
+                message_thread_id=message_thread_id,
+                automation=False,
+                profile_name=self.codex.chat_profile.name,
             )
-            return
 
-        if data.startswith(keyboards.CB_QUEUE_CLEAR_PREFIX):
-            raw_page = data[len(keyboards.CB_QUEUE_CLEAR_PREFIX) :].strip()
+            stop_hb.set()
             try:
-                page = int(raw_page)
+                hb_thread.join(timeout=1.0)
             except Exception:
-                page = 0
-            if self.runtime_queue_drop:
-                try:
-                    self.runtime_queue_drop('queue')
-                except Exception:
-                    pass
-            text_out, reply_markup_opt = self._render_queue_page(
-                chat_id=chat_id, page=page, page_size=5, notice='🧹 Cleared'
-            )
-            self._send_or_edit_message(
+                pass
+            heartbeat_stopped = True
+            try:
+                heartbeat_stopped = not hb_thread.is_alive()
+            except Exception:
+                heartbeat_stopped = True
+
+            cleaned_answer, reply_markup = self._prepare_codex_answer_reply(
                 chat_id=chat_id,
-                text=text_out,
-                ack_message_id=int(message_id or 0),
-                reply_markup=reply_markup_opt,
-                reply_to_message_id=message_id or None,
-                kind='bot',
+                answer=answer,
+                payload=prompt,
+                attachments=None,
+                reply_to=None,
+                received_ts=0.0,
+                user_id=user_id,
+                message_id=message_id,
+                dangerous=False,
             )
-            return
+            answer_out = f'**🧠 Сводка**\n{cleaned_answer}'.strip()
 
-        if data.startswith(keyboards.CB_QUEUE_ITEM_PREFIX):
-            rest = data[len(keyboards.CB_QUEUE_ITEM_PREFIX) :].strip()
-            parts = rest.split(':')
-            if len(parts) != 3:
-                text_out, reply_markup_opt = self._render_queue_page(chat_id=chat_id, page=0, page_size=5)
-            else:
-                bucket = str(parts[0] or '').strip().lower()
-                try:
-                    idx = int(parts[1])
-                except Exception:
-                    idx = 0
-                try:
-                    page = int(parts[2])
-                except Exception:
-                    page = 0
-                text_out, reply_markup_opt = self._render_queue_item(
-                    chat_id=chat_id, bucket=bucket, index=idx, page=page, page_size=5
+            edited = False
+            prefer_edit_delivery = self.state.ux_prefer_edit_delivery(chat_id=chat_id) and heartbeat_stopped
+            if prefer_edit_delivery and int(progress_message_id or 0) > 0:
+                edited = self._try_edit_codex_answer(
+                    chat_id=chat_id,
+                    message_id=int(progress_message_id),
+                    text=answer_out,
+                    history_text=answer_out,
+                    reply_markup=reply_markup,
                 )
-            self._send_or_edit_message(
-                chat_id=chat_id,
-                text=text_out,
-                ack_message_id=int(message_id or 0),
-                reply_markup=reply_markup_opt,
-                reply_to_message_id=message_id or None,
-                kind='bot',
-            )
-            return
 
-        if data.startswith(keyboards.CB_QUEUE_ACT_PREFIX):
-            rest = data[len(keyboards.CB_QUEUE_ACT_PREFIX) :].strip()
-            parts = rest.split(':')
-            if len(parts) != 4:
-                text_out, reply_markup_opt = self._render_queue_page(
-                    chat_id=chat_id, page=0, page_size=5, notice='⚠️ Bad action'
+            if not edited:
+                self.state.metric_inc('delivery.answer.chunked')
+                self._send_chunks(
+                    chat_id=chat_id,
+                    text=answer_out,
+                    reply_markup=reply_markup,
+                    reply_to_message_id=message_id or None,
+                    kind='codex',
                 )
+                if heartbeat_stopped:
+                    self._maybe_edit_ack_or_queue(
+                        chat_id=chat_id,
+                        message_id=int(progress_message_id or 0),
+                        coalesce_key=ack_key,
+                        text='✅ Готово. Ответ ниже.',
+                    )
             else:
-                bucket = str(parts[0] or '').strip().lower()
-                try:
-                    idx = int(parts[1])
-                except Exception:
-                    idx = 0
-                act = str(parts[2] or '').strip().lower()
-                try:
-                    page = int(parts[3])
-                except Exception:
-                    page = 0
-
-                edit_active = False
-                if self.runtime_queue_edit_active:
-                    try:
-                        edit_active = bool(self.runtime_queue_edit_active())
-                    except Exception:
-                        edit_active = False
-
-                notice = ''
-                if not edit_active:
-                    notice = '⛔️ Edit mode is OFF'
-                elif not self.runtime_queue_mutate:
-                    notice = '⚠️ Mutate not supported'
-                else:
-                    try:
-                        res = dict(self.runtime_queue_mutate(bucket, act, idx))
-                    except Exception:
-                        res = {'ok': False, 'error': 'exception'}
-                    if not bool(res.get('ok') or False):
-                        notice = f'⚠️ {res.get("error") or "failed"}'
-                    elif not bool(res.get('changed') or False):
-                        notice = 'ℹ️ No-op'
-
-                text_out, reply_markup_opt = self._render_queue_page(
-                    chat_id=chat_id, page=page, page_size=5, notice=notice
-                )
-            self._send_or_edit_message(
-                chat_id=chat_id,
-                text=text_out,
-                ack_message_id=int(message_id or 0),
-                reply_markup=reply_markup_opt,
-                reply_to_message_id=message_id or None,
-                kind='bot',
-            )
+                self.state.metric_inc('delivery.answer.edited')
+                if self.state.ux_done_notice_enabled(chat_id=chat_id):
+                    delete_after_seconds = self.state.ux_done_notice_delete_seconds(chat_id=chat_id)
+                    self._send_done_notice(
+                        chat_id=chat_id,
+                        reply_to_message_id=message_id or None,
+                        delete_after_seconds=delete_after_seconds,
+                    )
             return
-
-        if data.startswith(keyboards.CB_QUEUE_PAGE_PREFIX):
-            raw_page = data[len(keyboards.CB_QUEUE_PAGE_PREFIX) :].strip()
+        finally:
+            stop_hb.set()
             try:
-                page = int(raw_page)
+                hb_thread.join(timeout=1.0)
             except Exception:
-                page = 0
-            text_out, reply_markup_opt = self._render_queue_page(chat_id=chat_id, page=page, page_size=5)
-            self._send_or_edit_message(
-                chat_id=chat_id,
-                text=text_out,
-                ack_message_id=int(message_id or 0),
-                reply_markup=reply_markup_opt,
-                reply_to_message_id=message_id or None,
-                kind='bot',
-            )
-            return
+                pass
 
-        # Dangerous override confirmations
-        if data.startswith(keyboards.CB_DANGER_ALLOW_PREFIX) or data.startswith(keyboards.CB_DANGER_DENY_PREFIX):
-            allow = data.startswith(keyboards.CB_DANGER_ALLOW_PREFIX)
-            prefer_edit_delivery = self.state.ux_prefer_edit_delivery(chat_id=chat_id)
-            edit_ack_id = int(message_id or 0) if prefer_edit_delivery else 0
-            self.state.metric_inc('dangerous.confirm.click')
-            self.state.metric_inc('dangerous.confirm.allow' if allow else 'dangerous.confirm.deny')
-            rid = (
-                data[len(keyboards.CB_DANGER_ALLOW_PREFIX) :].strip()
-                if allow
-                else data[len(keyboards.CB_DANGER_DENY_PREFIX) :].strip()
-            )
+    def _cb_codex_followup(self, cb: _CallbackQuery) -> None:
+        """Codex answer follow-ups (shorter / 3-step plan / 1-line status / next step)."""
+        chat_id = cb.chat_id
+        message_thread_id = cb.message_thread_id
+        user_id = cb.user_id
+        message_id = cb.message_id
+        tg_chat = cb.tg_chat
+        tg_user = cb.tg_user
+        data = cb.data
+        started_ts = time.time()
+        followup_status: dict[str, str] = {'title': '▶️ Codex: follow-up…', 'detail': ''}
 
-            job = self.state.pending_dangerous_confirmation(
-                chat_id=chat_id, message_thread_id=message_thread_id, request_id=rid
-            )
-            if not job:
-                # Remove the keyboard so stale buttons can't be clicked again.
-                if message_id > 0:
-                    try:
-                        self.api.edit_message_reply_markup(chat_id=chat_id, message_id=message_id, reply_markup=None)
-                    except Exception:
-                        pass
-                # Best-effort cleanup (if it was expired/stale in state).
-                try:
-                    self.state.pop_pending_dangerous_confirmation(
-                        chat_id=chat_id, message_thread_id=message_thread_id, request_id=rid
-                    )
-                except Exception:
-                    pass
-                self._send_or_edit_message(
-                    chat_id=chat_id,
-                    text='⚠️ Запрос на dangerous уже неактуален (или был обработан). Если всё ещё нужно — отправь исходную команду ещё раз.',
-                    ack_message_id=edit_ack_id,
-                    reply_to_message_id=message_id or None,
-                    kind='bot',
-                )
-                return
+        progress_message_id, ack_key = self._ensure_progress_message(cb, title=followup_status['title'])
 
-            try:
-                original_user_id = int(job.get('user_id') or 0)
-            except Exception:
-                original_user_id = 0
-            try:
-                original_message_id = int(job.get('message_id') or 0)
-            except Exception:
-                original_message_id = 0
-            rt_id = int(original_message_id or message_id or 0)
-            rt = rt_id if rt_id > 0 else None
-            if original_user_id > 0 and int(user_id) != original_user_id:
-                self._send_message(chat_id=chat_id, text='Not authorized.', reply_to_message_id=rt)
-                return
+        stop_hb, hb_thread = self._start_heartbeat(
+            chat_id=chat_id,
+            message_thread_id=message_thread_id,
+            ack_message_id=int(progress_message_id or 0),
+            ack_coalesce_key=ack_key,
+            started_ts=started_ts,
+            status=followup_status,
+        )
+        followup = _CODEX_FOLLOWUP_PROMPTS[data]
 
-            # Remove the keyboard so the user can't click twice.
-            if message_id > 0:
-                try:
-                    self.api.edit_message_reply_markup(chat_id=chat_id, message_id=message_id, reply_markup=None)
-                except Exception:
-                    pass
+        try:
+            wrapped = self._wrap_user_prompt(followup, chat_id=chat_id, tg_chat=tg_chat, tg_user=tg_user)
 
-            job = self.state.pop_pending_dangerous_confirmation(
-                chat_id=chat_id, message_thread_id=message_thread_id, request_id=rid
+            automation = self.state.last_codex_automation_for(chat_id, message_thread_id=message_thread_id)
+            profile_name = self.state.last_codex_profile_for(chat_id, message_thread_id=message_thread_id)
+            profile_model = self.state.last_codex_model_for(chat_id=chat_id, message_thread_id=message_thread_id)
+            profile_reasoning = self.state.last_codex_reasoning_for(
+                chat_id=chat_id, message_thread_id=message_thread_id
             )
-            if not job:
-                self._send_or_edit_message(
-                    chat_id=chat_id,
-                    text='⚠️ Запрос на dangerous уже неактуален (или был обработан). Если всё ещё нужно — отправь исходную команду ещё раз.',
-                    ack_message_id=edit_ack_id,
-                    reply_to_message_id=rt,
-                    kind='bot',
-                )
-                return
-
-            payload = str(job.get('payload') or '').strip()
-            if not payload:
-                self._send_or_edit_message(
-                    chat_id=chat_id,
-                    text='⚠️ Пустой запрос. Отправь исходную команду ещё раз.',
-                    ack_message_id=edit_ack_id,
-                    reply_to_message_id=rt,
-                    kind='bot',
-                )
-                return
-
-            attachments = job.get('attachments')
-            reply_to = job.get('reply_to')
-            job_tg_chat = job.get('tg_chat') if isinstance(job.get('tg_chat'), dict) else None
-            job_tg_user = job.get('tg_user') if isinstance(job.get('tg_user'), dict) else None
-            try:
-                sent_ts = float(job.get('sent_ts') or 0.0)
-            except Exception:
-                sent_ts = 0.0
-
-            if not allow:
-                # Proceed in normal read/write mode: run router+classifier without dangerous.
-                self.state.metric_inc('dangerous.confirm.denied')
-                self.handle_text(
-                    chat_id=chat_id,
-                    user_id=user_id,
-                    text=payload,
-                    attachments=list(attachments) if isinstance(attachments, list) else None,
-                    reply_to=dict(reply_to) if isinstance(reply_to, dict) else None,
-                    message_id=rt_id,
-                    received_ts=sent_ts,
-                    ack_message_id=int(message_id or 0),
-                    skip_history=True,
-                    allow_dangerous=False,
-                    tg_chat=job_tg_chat or tg_chat,
-                    tg_user=job_tg_user or tg_user,
-                )
-                return
-
-            self._send_or_edit_message(
+            repo_root, env_policy = self._codex_context(chat_id)
+            session_key = self._codex_session_key(chat_id=chat_id, message_thread_id=message_thread_id)
+            codex_config_overrides: dict[str, object] = {'model_reasoning_effort': profile_reasoning}
+            if profile_model:
+                codex_config_overrides['model'] = profile_model
+            codex_config_overrides.update(self._codex_mcp_config_overrides(chat_id=chat_id, repo_root=repo_root))
+            answer = self.codex.run_followup_by_profile_name(
+                prompt=wrapped,
+                profile_name=profile_name,
                 chat_id=chat_id,
-                text='⚠️ Разрешение получено. Запускаю dangerous override…',
-                ack_message_id=edit_ack_id,
-                reply_to_message_id=rt,
-                kind='bot',
+                session_key=session_key,
+                sandbox_override=self.codex_followup_sandbox,
+                repo_root=repo_root,
+                env_policy=env_policy,
+                config_overrides=codex_config_overrides,
             )
-            self.state.metric_inc('dangerous.confirm.allowed')
-            self.handle_text(
+            self.state.set_last_codex_run(
                 chat_id=chat_id,
-                user_id=user_id,
-                text=f'{self.force_danger_prefix}{payload}',
-                attachments=list(attachments) if isinstance(attachments, list) else None,
-                reply_to=dict(reply_to) if isinstance(reply_to, dict) else None,
-                message_id=rt_id,
-                received_ts=sent_ts,
-                ack_message_id=edit_ack_id,
-                skip_history=True,
-                dangerous_confirmed=True,
-                tg_chat=job_tg_chat or tg_chat,
-                tg_user=job_tg_user or tg_user,
+                message_thread_id=message_thread_id,
+                automation=automation,
+                profile_name=profile_name,
+                model=profile_model,
+                reasoning=profile_reasoning,
             )
-            return
 
-        # One-off: delete the message that hosts this inline keyboard.
-        if data == keyboards.CB_DISMISS:
-            self.state.metric_inc('delivery.dismiss.click')
-            if message_id > 0:
-                try:
-                    self.api.delete_message(chat_id=int(chat_id), message_id=int(message_id))
-                    self.state.metric_inc('delivery.dismiss.ok')
-                except Exception:
-                    self.state.metric_inc('delivery.dismiss.fail')
-                    pass
-            return
-
-        # Dispatch: basic controls
-        if data in {keyboards.CB_ACK, keyboards.CB_BACK}:
-            self.state.clear_snooze()
-            self._send_message(chat_id=chat_id, text='✅ Ок, на связи.', reply_to_message_id=message_id or None)
-            return
+            stop_hb.set()
+            try:
+                hb_thread.join(timeout=1.0)
+            except Exception:
+                pass
+            heartbeat_stopped = True
+            try:
+                heartbeat_stopped = not hb_thread.is_alive()
+            except Exception:
+                heartbeat_stopped = True
 
-        if data == keyboards.CB_LUNCH_60:
-            self.state.set_snooze(60 * 60, kind='lunch')
-            self._send_message(
+            header = keyboards.describe_callback_data(data) or data
+            cleaned_answer, reply_markup = self._prepare_codex_answer_reply(
                 chat_id=chat_id,
-                text='🍽️ Ок, пауза на 60 минут. Вернёшься — /back.',
-                reply_to_message_id=message_id or None,
+                answer=answer,
+                payload=followup,
+                attachments=None,
+                reply_to=None,
+                received_ts=0.0,
+                user_id=user_id,
+                message_id=message_id,
+                dangerous=False,
             )
-            return
-
-        if data in {keyboards.CB_MUTE_30M, keyboards.CB_MUTE_1H, keyboards.CB_MUTE_2H, keyboards.CB_MUTE_1D}:
-            seconds = {
-                keyboards.CB_MUTE_30M: 30 * 60,
-                keyboards.CB_MUTE_1H: 60 * 60,
-                keyboards.CB_MUTE_2H: 2 * 60 * 60,
-                keyboards.CB_MUTE_1D: 24 * 60 * 60,
-            }[data]
-            self.state.set_snooze(seconds, kind='mute')
-            label = {
-                keyboards.CB_MUTE_30M: '30м',
-                keyboards.CB_MUTE_1H: '1ч',
-                keyboards.CB_MUTE_2H: '2ч',
-                keyboards.CB_MUTE_1D: '1д',
-            }[data]
-            self._send_message(chat_id=chat_id, text=f'🔕 Ок. Пауза {label}.', reply_to_message_id=message_id or None)
-            self._maybe_auto_enable_gentle(chat_id=chat_id, reason='auto: multiple mutes')
-            return
+            answer_out = f'**{header}**\n{cleaned_answer}'.strip()
 
-        # Gentle toggle button
-        if data == keyboards.CB_GENTLE_TOGGLE:
-            if self.state.is_gentle_active():
-                self.state.disable_gentle()
-                self._send_message(
-                    chat_id=chat_id, text='▶️ Ок. Щадящий режим выключен.', reply_to_message_id=message_id or None
-                )
-            else:
-                self.state.enable_gentle(
-                    seconds=int(self.gentle_default_minutes) * 60, reason='manual: user pressed button', extend=True
-                )
-                self._send_message(
+            edited = False
+            prefer_edit_delivery = self.state.ux_prefer_edit_delivery(chat_id=chat_id) and heartbeat_stopped
+            if prefer_edit_delivery and int(progress_message_id or 0) > 0:
+                edited = self._try_edit_codex_answer(
                     chat_id=chat_id,
-                    text=f'🫶 Ок. Включил щадящий режим на {self.gentle_default_minutes}м.',
-                    reply_to_message_id=message_id or None,
+                    message_id=int(progress_message_id),
+                    text=answer_out,
+                    history_text=answer_out,
+                    reply_markup=reply_markup,
                 )
-            return
 
-        # Quick status
-        if data == keyboards.CB_STATUS:
-            base = self.watcher.build_status_text(dt.datetime.now(), self.state)
-            gentle = 'ON' if self.state.is_gentle_active() else 'OFF'
-            snooze = 'ON' if self.state.is_snoozed() else 'OFF'
-            self._send_message(
-                chat_id=chat_id,
-                text=(f'📌 Статус\n{base}\nGentle: {gentle}\nSnooze: {snooze}'),
-                reply_markup=keyboards.help_menu(gentle_active=self.state.is_gentle_active()),
-                reply_to_message_id=message_id or None,
-            )
-            return
-
-        # Template for 1-line status
-        if data == keyboards.CB_TEMPLATE_STATUS:
-            self._send_message(
-                chat_id=chat_id,
-                text=(
-                    '✍️ Шаблон статуса (1 строка):\n'
-                    '- сделал: …\n'
-                    '- дальше: …\n'
-                    '- блокер: …\n\n'
-                    'Можно просто ответить одной строкой — бот поймёт, что ты здесь.'
-                ),
-                reply_markup=keyboards.help_menu(gentle_active=self.state.is_gentle_active()),
-                reply_to_message_id=message_id or None,
-            )
-            return
-
-        # Summary (read-only)
-        if data == keyboards.CB_SUMMARY:
-            started_ts = time.time()
-            status: dict[str, str] = {'title': '▶️ Codex: сводка…', 'detail': ''}
-
-            ack_key = self._ack_coalesce_key_for_callback(chat_id=chat_id, callback_query_id=callback_query_id)
-            progress_message_id = int(ack_message_id or 0)
-            if progress_message_id <= 0 and ack_key:
-                progress_message_id = int(
-                    self.state.tg_message_id_for_coalesce_key(chat_id=chat_id, coalesce_key=ack_key) or 0
-                )
-            if progress_message_id > 0:
-                self._maybe_edit_ack_or_queue(
-                    chat_id=chat_id, message_id=int(progress_message_id), coalesce_key=ack_key, text=status['title']
+            if not edited:
+                self.state.metric_inc('delivery.answer.chunked')
+                self._send_chunks(
+                    chat_id=chat_id,
+                    text=answer_out,
+                    reply_markup=reply_markup,
+                    reply_to_message_id=message_id or None,
+                    kind='codex',
                 )
-            elif message_id > 0:
-                try:
-                    try:
-                        resp = self.api.send_message(
-                            chat_id=chat_id,
-                            message_thread_id=self._tg_message_thread_id(),
-                            text=status['title'],
-                            reply_to_message_id=int(message_id),
-                            coalesce_key=(ack_key or None),
-                            timeout=10,
-                        )
-                    except TypeError:
-                        resp = self.api.send_message(
-                            chat_id=chat_id,
-                            text=status['title'],
-                            reply_to_message_id=int(message_id),
-                            timeout=10,
-                        )
-                    progress_message_id = int(
-                        ((resp.get('result') or {}) if isinstance(resp, dict) else {}).get('message_id') or 0
+                if heartbeat_stopped:
+                    self._maybe_edit_ack_or_queue(
+                        chat_id=chat_id,
+                        message_id=int(progress_message_id or 0),
+                        coalesce_key=ack_key,
+                        text='✅ Готово. Ответ ниже.',
                     )
-                except Exception:
-                    progress_message_id = 0
-
-            stop_hb, hb_thread = self._start_heartbeat(
-                chat_id=chat_id,
-                message_thread_id=message_thread_id,
-                ack_message_id=int(progress_message_id or 0),
-                ack_coalesce_key=ack_key,
-                started_ts=started_ts,
-                status=status,
-            )
-            prompt = (
-                'Сделай краткую сводку текущего контекста работы по репозиторию.\n'
-                'Ориентируйся на notes/work/daily-brief.md, notes/work/end-of-day.md и последние файлы notes/daily-logs/.\n'
-                'Формат ответа:\n'
-                '- 3-6 буллетов: что сейчас важно\n'
-                '- 1 буллет: блокер/риск\n'
-                '- 1 буллет: следующий шаг (<=10 минут)\n'
-                '- 1 буллет: микро-шаг (<=2 минуты)\n'
-                'Без воды, до 12 строк.'
-            )
+            else:
+                self.state.metric_inc('delivery.answer.edited')
+                if self.state.ux_done_notice_enabled(chat_id=chat_id):
+                    delete_after_seconds = self.state.ux_done_notice_delete_seconds(chat_id=chat_id)
+                    self._send_done_notice(
+                        chat_id=chat_id,
+                        reply_to_message_id=message_id or None,
+                        delete_after_seconds=delete_after_seconds,
+                    )
+            return
+        finally:
+            stop_hb.set()
             try:
-                wrapped = self._wrap_user_prompt(prompt, chat_id=chat_id, tg_chat=tg_chat, tg_user=tg_user)
-                repo_root, env_policy = self._codex_context(chat_id)
-                session_key = self._codex_session_key(chat_id=chat_id, message_thread_id=message_thread_id)
-                answer = self.codex.run(
-                    prompt=wrapped,
-                    automation=False,
-                    chat_id=chat_id,
-                    session_key=session_key,
-                    repo_root=repo_root,
-                    env_policy=env_policy,
-                    config_overrides={'model_reasoning_effort': 'medium'},
-                )
-                self.state.set_last_codex_run(
-                    chat_id=chat_id,
-                    message_thread_id=message_thread_id,
-                    automation=False,
-                    profile_name=self.codex.chat_profile.name,
-                )
-
-                stop_hb.set()
-                try:
-                    hb_thread.join(timeout=1.0)
-                except Exception:
-                    pass
-                heartbeat_stopped = True
-                try:
-                    heartbeat_stopped = not hb_thread.is_alive()
-                except Exception:
-                    heartbeat_stopped = True
+                hb_thread.join(timeout=1.0)
+            except Exception:
+                pass
 
-                cleaned_answer, reply_markup = self._prepare_codex_answer_reply(
+    def _cb_voice_route(self, cb: _CallbackQuery) -> None:
+        """Voice-route selection (control plane, no Codex)."""
+        chat_id = cb.chat_id
+        message_thread_id = cb.message_thread_id
+        message_id = cb.message_id
+        # Payload: '<voice_message_id>:<mode>'.
+        mid_s, sep, mode = cb.tail.partition(':')
+        if sep and ':' not in mode:
+            voice_mid = int(mid_s) if mid_s.isdecimal() else 0
+            mode = mode.strip().lower()
+            choice = _VOICE_ROUTE_MODES.get(mode, '')
+            if voice_mid > 0 and choice:
+                self.state.metric_inc('voice.route.click')
+                self.state.set_voice_route_choice(
                     chat_id=chat_id,
-                    answer=answer,
-                    payload=prompt,
-                    attachments=None,
-                    reply_to=None,
-                    received_ts=0.0,
-                    user_id=user_id,
-                    message_id=message_id or 0,
-                    dangerous=False,
+                    message_thread_id=message_thread_id,
+                    voice_message_id=voice_mid,
+                    choice=choice,
                 )
-                answer_out = f'**🧠 Сводка**\n{cleaned_answer}'.strip()
-
-                edited = False
-                prefer_edit_delivery = self.state.ux_prefer_edit_delivery(chat_id=chat_id) and heartbeat_stopped
-                if prefer_edit_delivery and int(progress_message_id or 0) > 0:
-                    edited = self._try_edit_codex_answer(
+                if message_id > 0:
+                    self._edit_reply_markup_async(
                         chat_id=chat_id,
-                        message_id=int(progress_message_id),
-                        text=answer_out,
-                        history_text=answer_out,
-                        reply_markup=reply_markup,
+                        message_id=message_id,
+                        build_markup=functools.partial(
+                            keyboards.voice_route_menu, voice_message_id=voice_mid, selected=choice
+                        ),
                     )
 
-                if not edited:
-                    self.state.metric_inc('delivery.answer.chunked')
-                    self._send_chunks(
-                        chat_id=chat_id,
-                        text=answer_out,
-                        reply_markup=reply_markup,
-                        reply_to_message_id=message_id or None,
-                        kind='codex',
-                    )
-                    if heartbeat_stopped:
-                        self._maybe_edit_ack_or_queue(
-                            chat_id=chat_id,
-                            message_id=int(progress_message_id or 0),
-                            coalesce_key=ack_key,
-                            text='✅ Готово. Ответ ниже.',
-                        )
-                else:
-                    self.state.metric_inc('delivery.answer.edited')
-                    if self.state.ux_done_notice_enabled(chat_id=chat_id):
-                        delete_after_seconds = self.state.ux_done_notice_delete_seconds(chat_id=chat_id)
-                        self._send_done_notice(
-                            chat_id=chat_id,
-                            reply_to_message_id=message_id or None,
-                            delete_after_seconds=delete_after_seconds,
-                        )
-                return
-            finally:
-                stop_hb.set()
-                try:
-                    hb_thread.join(timeout=1.0)
-                except Exception:
-                    pass
-
-        # End-of-day trigger
-        if data == keyboards.CB_EOD:
-            self.handle_text(
+    def _cb_ask_user(self, cb: _CallbackQuery) -> None:
+        """Answer to a blocking Codex question (user-in-the-loop)."""
+        chat_id = cb.chat_id
+        message_thread_id = cb.message_thread_id
+        user_id = cb.user_id
+        message_id = cb.message_id
+        tg_chat = cb.tg_chat
+        tg_user = cb.tg_user
+        waiting = self.state.waiting_for_user(chat_id=chat_id, message_thread_id=message_thread_id)
+        if waiting is None:
+            if message_id > 0:
+                self._edit_reply_markup_async(chat_id=chat_id, message_id=message_id, reply_markup=None)
+            self._send_message(
                 chat_id=chat_id,
                 message_thread_id=message_thread_id,
-                user_id=user_id,
-                text=f'{self.force_write_prefix}давай закончим день',
-                attachments=None,
-                message_id=message_id or 0,
-                tg_chat=tg_chat,
-                tg_user=tg_user,
+                text='⚠️ Этот вопрос уже не актуален.',
+                reply_to_message_id=message_id or None,
             )
             return
 
-        # Reset Codex sessions
-        if data == keyboards.CB_RESET:
-            self.codex.reset()
+        rest = cb.tail
+        answer_text = ''
+        if rest == 'def':
+            d = waiting.get('default')
+            answer_text = d.strip() if isinstance(d, str) else ''
+        elif rest.isdecimal():
+            idx = int(rest) - 1
+            opts = waiting.get('options')
+            if isinstance(opts, list) and 0 <= idx < len(opts) and isinstance(opts[idx], str):
+                answer_text = str(opts[idx]).strip()
+
+        if not answer_text:
+            answer_text = rest
+
+        if message_id > 0:
+            self._edit_reply_markup_async(chat_id=chat_id, message_id=message_id, reply_markup=None)
+
+        if not answer_text:
             self._send_message(
                 chat_id=chat_id,
-                text='♻️ Сбросил telegram-Codex сессии (CODEX_HOME профилей).',
+                message_thread_id=message_thread_id,
+                text='⚠️ Не понял ответ. Ответь текстом, пожалуйста.',
                 reply_to_message_id=message_id or None,
             )
             return
 
-        # Codex answer follow-ups
-        if data in {keyboards.CB_CX_SHORTER, keyboards.CB_CX_PLAN3, keyboards.CB_CX_STATUS1, keyboards.CB_CX_NEXT}:
-            started_ts = time.time()
-            followup_status: dict[str, str] = {'title': '▶️ Codex: follow-up…', 'detail': ''}
+        try:
+            origin_ack = int(waiting.get('origin_ack_message_id') or 0)
+        except Exception:
+            origin_ack = 0
 
-            ack_key = self._ack_coalesce_key_for_callback(chat_id=chat_id, callback_query_id=callback_query_id)
-            progress_message_id = int(ack_message_id or 0)
-            if progress_message_id <= 0 and ack_key:
-                progress_message_id = int(
-                    self.state.tg_message_id_for_coalesce_key(chat_id=chat_id, coalesce_key=ack_key) or 0
-                )
-            if progress_message_id > 0:
-                self._maybe_edit_ack_or_queue(
-                    chat_id=chat_id,
-                    message_id=int(progress_message_id),
-                    coalesce_key=ack_key,
-                    text=followup_status['title'],
-                )
-            elif message_id > 0:
-                try:
-                    try:
-                        resp = self.api.send_message(
-                            chat_id=chat_id,
-                            message_thread_id=self._tg_message_thread_id(),
-                            text=followup_status['title'],
-                            reply_to_message_id=int(message_id),
-                            coalesce_key=(ack_key or None),
-                            timeout=10,
-                        )
-                    except TypeError:
-                        resp = self.api.send_message(
-                            chat_id=chat_id,
-                            text=followup_status['title'],
-                            reply_to_message_id=int(message_id),
-                            timeout=10,
-                        )
-                    progress_message_id = int(
-                        ((resp.get('result') or {}) if isinstance(resp, dict) else {}).get('message_id') or 0
-                    )
-                except Exception:
-                    progress_message_id = 0
+        self.handle_text(
+            chat_id=chat_id,
+            message_thread_id=message_thread_id,
+            user_id=user_id,
+            text=answer_text,
+            message_id=0,
+            ack_message_id=origin_ack,
+            skip_history=True,
+            tg_chat=tg_chat,
+            tg_user=tg_user,
+        )
 
-            stop_hb, hb_thread = self._start_heartbeat(
+    def _cb_model(self, cb: _CallbackQuery) -> None:
+        """Per-scope Codex model picker (private owner chat only)."""
+        chat_id = cb.chat_id
+        message_id = cb.message_id
+        if chat_id < 0:
+            self._send_message(
                 chat_id=chat_id,
-                message_thread_id=message_thread_id,
-                ack_message_id=int(progress_message_id or 0),
-                ack_coalesce_key=ack_key,
-                started_ts=started_ts,
-                status=followup_status,
+                text='⛔️ Эта кнопка доступна только в личке.',
+                reply_to_message_id=message_id or None,
+            )
+            return
+        if cb.multi_tenant and not cb.is_owner:
+            self._send_message(
+                chat_id=chat_id,
+                text='⛔️ Эта кнопка доступна только в owner-чате.',
+                reply_to_message_id=message_id or None,
             )
-            followup = {
-                keyboards.CB_CX_SHORTER: 'Сократи предыдущий ответ. Оставь смысл. Формат: 5-8 строк, без воды.',
-                keyboards.CB_CX_PLAN3: 'Сделай план на 3 шага по предыдущему ответу. Каждый шаг: <=10 минут. Добавь 1 микро-шаг (<=2 минуты).',
-                keyboards.CB_CX_STATUS1: 'Сформулируй статус ОДНОЙ строкой по предыдущему ответу (что сделал/что дальше/блокер) — максимально практично.',
-                keyboards.CB_CX_NEXT: 'Назови следующий шаг прямо сейчас (<=10 минут) и микро-шаг (<=2 минуты) по предыдущему ответу.',
-            }[data]
+            return
+
+        raw_model = cb.tail
+        selected_model = '' if not raw_model or raw_model == _MODEL_CB_DEFAULT else raw_model
+        scope_thread_id = int(self._tg_message_thread_id() or 0)
+        self.state.set_last_codex_profile_state(
+            chat_id=chat_id,
+            message_thread_id=scope_thread_id,
+            mode=self.state.last_codex_mode_for(chat_id=chat_id, message_thread_id=scope_thread_id),
+            reasoning=self.state.last_codex_reasoning_for(chat_id=chat_id, message_thread_id=scope_thread_id),
+            model=selected_model,
+        )
+        model_label = selected_model if isinstance(selected_model, str) and selected_model else '<default>'
+        self._send_message(
+            chat_id=chat_id,
+            text=f'✅ Модель для scope {chat_id}:{scope_thread_id} сохранена: {model_label}',
+            reply_to_message_id=message_id or None,
+        )
 
+    def _cb_queue_edit_mode(self, cb: _CallbackQuery) -> None:
+        """Queue UI: enter (queue_edit:) or leave (queue_done:) edit mode and re-render the page."""
+        chat_id = cb.chat_id
+        message_id = cb.message_id
+        page = _safe_int(cb.tail)
+        if self.runtime_queue_edit_set:
             try:
-                wrapped = self._wrap_user_prompt(followup, chat_id=chat_id, tg_chat=tg_chat, tg_user=tg_user)
+                self.runtime_queue_edit_set(cb.prefix == keyboards.CB_QUEUE_EDIT_PREFIX)
+            except Exception:
+                pass
+        text_out, reply_markup_opt = self._render_queue_page(chat_id=chat_id, page=page, page_size=5)
+        self._send_or_edit_message(
+            chat_id=chat_id,
+            text=text_out,
+            ack_message_id=message_id,
+            reply_markup=reply_markup_opt,
+            reply_to_message_id=message_id or None,
+            kind='bot',
+        )
 
-                automation = self.state.last_codex_automation_for(chat_id, message_thread_id=message_thread_id)
-                profile_name = self.state.last_codex_profile_for(chat_id, message_thread_id=message_thread_id)
-                profile_model = self.state.last_codex_model_for(chat_id=chat_id, message_thread_id=message_thread_id)
-                profile_reasoning = self.state.last_codex_reasoning_for(
-                    chat_id=chat_id, message_thread_id=message_thread_id
-                )
-                repo_root, env_policy = self._codex_context(chat_id)
-                session_key = self._codex_session_key(chat_id=chat_id, message_thread_id=message_thread_id)
-                codex_config_overrides: dict[str, object] = {'model_reasoning_effort': profile_reasoning}
-                if profile_model:
-                    codex_config_overrides['model'] = profile_model
-                codex_config_overrides.update(self._codex_mcp_config_overrides(chat_id=chat_id, repo_root=repo_root))
-                answer = self.codex.run_followup_by_profile_name(
-                    prompt=wrapped,
-                    profile_name=profile_name,
-                    chat_id=chat_id,
-                    session_key=session_key,
-                    sandbox_override=self.codex_followup_sandbox,
-                    repo_root=repo_root,
-                    env_policy=env_policy,
-                    config_overrides=codex_config_overrides,
-                )
-                self.state.set_last_codex_run(
-                    chat_id=chat_id,
-                    message_thread_id=message_thread_id,
-                    automation=automation,
-                    profile_name=profile_name,
-                    model=profile_model,
-                    reasoning=profile_reasoning,
-                )
+    def _cb_queue_clear(self, cb: _CallbackQuery) -> None:
+        """Queue UI: drop the main queue and re-render the page."""
+        chat_id = cb.chat_id
+        message_id = cb.message_id
+        page = _safe_int(cb.tail)
+        if self.runtime_queue_drop:
+            try:
+                self.runtime_queue_drop('queue')
+            except Exception:
+                pass
+        text_out, reply_markup_opt = self._render_queue_page(
+            chat_id=chat_id, page=page, page_size=5, notice='🧹 Cleared'
+        )
+        self._send_or_edit_message(
+            chat_id=chat_id,
+            text=text_out,
+            ack_message_id=message_id,
+            reply_markup=reply_markup_opt,
+            reply_to_message_id=message_id or None,
+            kind='bot',
+        )
 
-                stop_hb.set()
+    def _cb_queue_item(self, cb: _CallbackQuery) -> None:
+        """Queue UI: show one queued item."""
+        chat_id = cb.chat_id
+        message_id = cb.message_id
+        # Payload: '<bucket>:<index>:<page>'.
+        bucket, sep1, rest = cb.tail.partition(':')
+        idx_s, sep2, page_s = rest.partition(':')
+        if not (sep1 and sep2) or ':' in page_s:
+            text_out, reply_markup_opt = self._render_queue_page(chat_id=chat_id, page=0, page_size=5)
+        else:
+            bucket = bucket.strip().lower()
+            idx = int(idx_s) if idx_s.isdecimal() else 0
+            page = int(page_s) if page_s.isdecimal() else 0
+            text_out, reply_markup_opt = self._render_queue_item(
+                chat_id=chat_id, bucket=bucket, index=idx, page=page, page_size=5
+            )
+        self._send_or_edit_message(
+            chat_id=chat_id,
+            text=text_out,
+            ack_message_id=message_id,
+            reply_markup=reply_markup_opt,
+            reply_to_message_id=message_id or None,
+            kind='bot',
+        )
+
+    def _cb_queue_action(self, cb: _CallbackQuery) -> None:
+        """Queue UI: apply an item action (edit mode only) and re-render the page."""
+        chat_id = cb.chat_id
+        message_id = cb.message_id
+        # Payload: '<bucket>:<index>:<action>:<page>'.
+        bucket, sep1, rest = cb.tail.partition(':')
+        idx_s, sep2, rest = rest.partition(':')
+        act, sep3, page_s = rest.partition(':')
+        if not (sep1 and sep2 and sep3) or ':' in page_s:
+            text_out, reply_markup_opt = self._render_queue_page(
+                chat_id=chat_id, page=0, page_size=5, notice='⚠️ Bad action'
+            )
+        else:
+            bucket = bucket.strip().lower()
+            idx = int(idx_s) if idx_s.isdecimal() else 0
+            act = act.strip().lower()
+            page = int(page_s) if page_s.isdecimal() else 0
+
+            edit_active = False
+            if self.runtime_queue_edit_active:
                 try:
-                    hb_thread.join(timeout=1.0)
+                    edit_active = bool(self.runtime_queue_edit_active())
                 except Exception:
-                    pass
-                heartbeat_stopped = True
+                    edit_active = False
+
+            notice = ''
+            if not edit_active:
+                notice = '⛔️ Edit mode is OFF'
+            elif not self.runtime_queue_mutate:
+                notice = '⚠️ Mutate not supported'
+            else:
                 try:
-                    heartbeat_stopped = not hb_thread.is_alive()
+                    res = dict(self.runtime_queue_mutate(bucket, act, idx))
                 except Exception:
-                    heartbeat_stopped = True
+                    res = {'ok': False, 'error': 'exception'}
+                if not bool(res.get('ok') or False):
+                    notice = f'⚠️ {res.get("error") or "failed"}'
+                elif not bool(res.get('changed') or False):
+                    notice = 'ℹ️ No-op'
 
-                header = keyboards.describe_callback_data(data) or data
-                cleaned_answer, reply_markup = self._prepare_codex_answer_reply(
-                    chat_id=chat_id,
-                    answer=answer,
-                    payload=followup,
-                    attachments=None,
-                    reply_to=None,
-                    received_ts=0.0,
-                    user_id=user_id,
-                    message_id=message_id or 0,
-                    dangerous=False,
-                )
-                answer_out = f'**{header}**\n{cleaned_answer}'.strip()
+            text_out, reply_markup_opt = self._render_queue_page(chat_id=chat_id, page=page, page_size=5, notice=notice)
+        self._send_or_edit_message(
+            chat_id=chat_id,
+            text=text_out,
+            ack_message_id=message_id,
+            reply_markup=reply_markup_opt,
+            reply_to_message_id=message_id or None,
+            kind='bot',
+        )
 
-                edited = False
-                prefer_edit_delivery = self.state.ux_prefer_edit_delivery(chat_id=chat_id) and heartbeat_stopped
-                if prefer_edit_delivery and int(progress_message_id or 0) > 0:
-                    edited = self._try_edit_codex_answer(
-                        chat_id=chat_id,
-                        message_id=int(progress_message_id),
-                        text=answer_out,
-                        history_text=answer_out,
-                        reply_markup=reply_markup,
-                    )
+    def _cb_queue_page(self, cb: _CallbackQuery) -> None:
+        """Queue UI: pagination."""
+        chat_id = cb.chat_id
+        message_id = cb.message_id
+        page = _safe_int(cb.tail)
+        text_out, reply_markup_opt = self._render_queue_page(chat_id=chat_id, page=page, page_size=5)
+        self._send_or_edit_message(
+            chat_id=chat_id,
+            text=text_out,
+            ack_message_id=message_id,
+            reply_markup=reply_markup_opt,
+            reply_to_message_id=message_id or None,
+            kind='bot',
+        )
 
-                if not edited:
-                    self.state.metric_inc('delivery.answer.chunked')
-                    self._send_chunks(
-                        chat_id=chat_id,
-                        text=answer_out,
-                        reply_markup=reply_markup,
-                        reply_to_message_id=message_id or None,
-                        kind='codex',
-                    )
-                    if heartbeat_stopped:
-                        self._maybe_edit_ack_or_queue(
-                            chat_id=chat_id,
-                            message_id=int(progress_message_id or 0),
-                            coalesce_key=ack_key,
-                            text='✅ Готово. Ответ ниже.',
-                        )
-                else:
-                    self.state.metric_inc('delivery.answer.edited')
-                    if self.state.ux_done_notice_enabled(chat_id=chat_id):
-                        delete_after_seconds = self.state.ux_done_notice_delete_seconds(chat_id=chat_id)
-                        self._send_done_notice(
-                            chat_id=chat_id,
-                            reply_to_message_id=message_id or None,
-                            delete_after_seconds=delete_after_seconds,
-                        )
+    def _cb_dangerous_confirm(self, cb: _CallbackQuery) -> None:
+        """Allow/deny a pending dangerous override (popped once: a second click finds nothing)."""
+        chat_id = cb.chat_id
+        message_thread_id = cb.message_thread_id
+        user_id = cb.user_id
+        message_id = cb.message_id
+        tg_chat = cb.tg_chat
+        tg_user = cb.tg_user
+        allow = cb.prefix == keyboards.CB_DANGER_ALLOW_PREFIX
+        prefer_edit_delivery = self.state.ux_prefer_edit_delivery(chat_id=chat_id)
+        edit_ack_id = message_id if prefer_edit_delivery else 0
+        self.state.metric_inc('dangerous.confirm.click')
+        self.state.metric_inc('dangerous.confirm.allow' if allow else 'dangerous.confirm.deny')
+        rid = cb.tail
+
+        job = self.state.pending_dangerous_confirmation(
+            chat_id=chat_id, message_thread_id=message_thread_id, request_id=rid
+        )
+        rt_id = message_id
+        if job:
+            try:
+                original_user_id = int(job.get('user_id') or 0)
+            except Exception:
+                original_user_id = 0
+            try:
+                original_message_id = int(job.get('message_id') or 0)
+            except Exception:
+                original_message_id = 0
+            rt_id = original_message_id or message_id
+            if original_user_id > 0 and user_id != original_user_id:
+                # Keep the keyboard: the requester can still answer.
+                self._send_message(
+                    chat_id=chat_id, text='Not authorized.', reply_to_message_id=rt_id if rt_id > 0 else None
+                )
                 return
-            finally:
-                stop_hb.set()
-                try:
-                    hb_thread.join(timeout=1.0)
-                except Exception:
-                    pass
+        rt = rt_id if rt_id > 0 else None
 
-        # Unknown callback
-        self._send_message(chat_id=chat_id, text='Не понял кнопку. /help', reply_to_message_id=message_id or None)
+        # Past this point the buttons are spent either way: remove the keyboard once so nobody can click twice.
+        # Synchronously: with edit delivery the replies below edit this same message, and a queued keyboard
+        # edit could land after (and undo) them.
+        if message_id > 0:
+            self._edit_reply_markup(chat_id=chat_id, message_id=message_id, reply_markup=None)
+
+        if not job:
+            # Best-effort cleanup (if it was expired/stale in state).
+            try:
+                self.state.pop_pending_dangerous_confirmation(
+                    chat_id=chat_id, message_thread_id=message_thread_id, request_id=rid
+                )
+            except Exception:
+                pass
+            self._send_or_edit_message(
+                chat_id=chat_id,
+                text='⚠️ Запрос на dangerous уже неактуален (или был обработан). Если всё ещё нужно — отправь исходную команду ещё раз.',
+                ack_message_id=edit_ack_id,
+                reply_to_message_id=rt,
+                kind='bot',
+            )
+            return
+
+        job = self.state.pop_pending_dangerous_confirmation(
+            chat_id=chat_id, message_thread_id=message_thread_id, request_id=rid
+        )
+        if not job:
+            self._send_or_edit_message(
+                chat_id=chat_id,
+                text='⚠️ Запрос на dangerous уже неактуален (или был обработан). Если всё ещё нужно — отправь исходную команду ещё раз.',
+                ack_message_id=edit_ack_id,
+                reply_to_message_id=rt,
+                kind='bot',
+            )
+            return
+
+        payload = str(job.get('payload') or '').strip()
+        if not payload:
+            self._send_or_edit_message(
+                chat_id=chat_id,
+                text='⚠️ Пустой запрос. Отправь исходную команду ещё раз.',
+                ack_message_id=edit_ack_id,
+                reply_to_message_id=rt,
+                kind='bot',
+            )
+            return
+
+        attachments = job.get('attachments')
+        reply_to = job.get('reply_to')
+        job_tg_chat = job.get('tg_chat') if isinstance(job.get('tg_chat'), dict) else None
+        job_tg_user = job.get('tg_user') if isinstance(job.get('tg_user'), dict) else None
+        try:
+            sent_ts = float(job.get('sent_ts') or 0.0)
+        except Exception:
+            sent_ts = 0.0
+
+        if not allow:
+            # Proceed in normal read/write mode: run router+classifier without dangerous.
+            self.state.metric_inc('dangerous.confirm.denied')
+            self.handle_text(
+                chat_id=chat_id,
+                user_id=user_id,
+                text=payload,
+                attachments=list(attachments) if isinstance(attachments, list) else None,
+                reply_to=dict(reply_to) if isinstance(reply_to, dict) else None,
+                message_id=rt_id,
+                received_ts=sent_ts,
+                ack_message_id=message_id,
+                skip_history=True,
+                allow_dangerous=False,
+                tg_chat=job_tg_chat or tg_chat,
+                tg_user=job_tg_user or tg_user,
+            )
+            return
+
+        self._send_or_edit_message(
+            chat_id=chat_id,
+            text='⚠️ Разрешение получено. Запускаю dangerous override…',
+            ack_message_id=edit_ack_id,
+            reply_to_message_id=rt,
+            kind='bot',
+        )
+        self.state.metric_inc('dangerous.confirm.allowed')
+        self.handle_text(
+            chat_id=chat_id,
+            user_id=user_id,
+            text=f'{self.force_danger_prefix}{payload}',
+            attachments=list(attachments) if isinstance(attachments, list) else None,
+            reply_to=dict(reply_to) if isinstance(reply_to, dict) else None,
+            message_id=rt_id,
+            received_ts=sent_ts,
+            ack_message_id=edit_ack_id,
+            skip_history=True,
+            dangerous_confirmed=True,
+            tg_chat=job_tg_chat or tg_chat,
+            tg_user=job_tg_user or tg_user,
+        )
 
     def _prepare_codex_answer_reply(
         self,
@@ -4472,19 +4996,15 @@ class Router:
         message_id: int,
         dangerous: bool,
     ) -> tuple[str, dict[str, Any]]:
-        from . import keyboards
-
         cleaned_answer, _ = _extract_tg_bot_control_block(answer)
         # Group chats should not get global-state buttons (mute/gentle/eod).
-        if int(chat_id) < 0 or (int(self.owner_chat_id or 0) != 0 and not self._is_owner_chat(chat_id)):
+        if int(chat_id) < 0 or not self._owner_chat_allowed(chat_id):
             reply_markup = keyboards.codex_answer_menu_public()
         else:
             reply_markup = keyboards.codex_answer_menu(gentle_active=self.state.is_gentle_active())
         return cleaned_answer, reply_markup
 
     def _render_settings_menu(self, *, chat_id: int) -> tuple[str, dict[str, Any]]:
-        from . import keyboards
-
         prefer_edit_delivery = self.state.ux_prefer_edit_delivery(chat_id=chat_id)
         done_notice_enabled = self.state.ux_done_notice_enabled(chat_id=chat_id)
         done_notice_delete_seconds = self.state.ux_done_notice_delete_seconds(chat_id=chat_id)
@@ -4535,8 +5055,6 @@ class Router:
         )
 
     def _render_admin_menu(self, *, chat_id: int) -> tuple[str, dict[str, Any]]:
-        from . import keyboards
-
         edit_active = False
         if self.runtime_queue_edit_active:
             try:
@@ -4556,8 +5074,6 @@ class Router:
         page_size: int,
         notice: str = '',
     ) -> tuple[str, dict[str, Any] | None]:
-        from . import keyboards
-
         size = max(1, min(20, int(page_size)))
         p_req = max(0, int(page))
         edit_active = False
@@ -4566,106 +5082,72 @@ class Router:
                 edit_active = bool(self.runtime_queue_edit_active())
             except Exception:
                 edit_active = False
-        snap_counts: dict[str, Any] = {}
+
+        def _i(v: Any) -> int:
+            # int() already accepts bool/int/float and whitespace-padded decimal strings.
+            try:
+                return int(v)
+            except (TypeError, ValueError):
+                return 0
+
+        # One snapshot sized for the requested page also carries the counts. A page clamped to the end of a
+        # shorter queue needs fewer rows than requested, so it is covered too.
+        need = (p_req + 1) * size
         snap: dict[str, Any] = {}
         if self.runtime_queue_snapshot:
             try:
-                snap_counts = dict(self.runtime_queue_snapshot(0))
+                if need > _QUEUE_SNAPSHOT_ROWS_MAX:
+                    counts = dict(self.runtime_queue_snapshot(0))
+                    queued = sum(_i(counts.get(k)) for k in ('main_n', 'prio_n', 'paused_n', 'spool_n'))
+                    need = min(need, max(1, (queued + size - 1) // size) * size)
+                snap = dict(self.runtime_queue_snapshot(int(need)))
             except Exception:
-                snap_counts = {}
-
-        def _i(v: object) -> int:
-            if isinstance(v, bool):
-                return int(v)
-            if isinstance(v, int):
-                return int(v)
-            if isinstance(v, float):
-                return int(v)
-            if isinstance(v, str):
-                try:
-                    return int(v.strip() or 0)
-                except Exception:
-                    return 0
-            return 0
-
-        main_n = _i(snap_counts.get('main_n'))
-        prio_n = _i(snap_counts.get('prio_n'))
-        paused_n = _i(snap_counts.get('paused_n'))
-        spool_n = _i(snap_counts.get('spool_n'))
-        spool_trunc = bool(snap_counts.get('spool_truncated') or False)
-        restart_pending = bool(snap_counts.get('restart_pending') or False)
+                snap = {}
+        main_n = _i(snap.get('main_n'))
+        prio_n = _i(snap.get('prio_n'))
+        paused_n = _i(snap.get('paused_n'))
+        spool_n = _i(snap.get('spool_n'))
+        spool_trunc = bool(snap.get('spool_truncated') or False)
+        restart_pending = bool(snap.get('restart_pending') or False)
 
         total = max(0, int(main_n + prio_n + paused_n + spool_n))
         pages = max(1, (total + size - 1) // size)
         p = min(p_req, pages - 1)
-        need = (p + 1) * size
-        if self.runtime_queue_snapshot:
-            try:
-                snap = dict(self.runtime_queue_snapshot(int(need)))
-            except Exception:
-                snap = dict(snap_counts)
 
         start = p * size
         end = start + size
 
-        main_head = snap.get('main_head') or []
-        prio_head = snap.get('prio_head') or []
-        paused_head = snap.get('paused_head') or []
-        spool_head = snap.get('spool_head') or []
-
-        items: list[tuple[str, int, str]] = []
-        if isinstance(prio_head, list):
-            for bi, s in enumerate(prio_head):
-                if isinstance(s, str) and s.strip():
-                    items.append(('prio', int(bi), s.strip()))
-        if isinstance(main_head, list):
-            for bi, s in enumerate(main_head):
-                if isinstance(s, str) and s.strip():
-                    items.append(('main', int(bi), s.strip()))
-        if isinstance(paused_head, list):
-            for bi, s in enumerate(paused_head):
-                if isinstance(s, str) and s.strip():
-                    items.append(('paused', int(bi), s.strip()))
-        if isinstance(spool_head, list):
-            for bi, s in enumerate(spool_head):
-                if isinstance(s, str) and s.strip():
-                    items.append(('spool', int(bi), s.strip()))
-
         in_flight = snap.get('in_flight')
         in_flight_s = str(in_flight or '').strip() if isinstance(in_flight, str) else ''
 
-        lines: list[str] = []
-        lines.append('🧾 Queue (edit)' if edit_active else '🧾 Queue (read-only)')
-        if notice:
-            lines.append(str(notice).strip())
-        if edit_active:
-            lines.append('Mode: EDIT (worker paused)')
-        if in_flight_s:
-            lines.append(f'In flight: {in_flight_s}')
-        lines.append(f'Prio: {prio_n} | Main: {main_n} | Paused: {paused_n}')
-        lines.append(f'Spool: {spool_n}{"+" if spool_trunc else ""}{" (restart_pending)" if restart_pending else ""}')
+        lines = [
+            '🧾 Queue (edit)' if edit_active else '🧾 Queue (read-only)',
+            *([str(notice).strip()] if notice else []),
+            *(['Mode: EDIT (worker paused)'] if edit_active else []),
+            *([f'In flight: {in_flight_s}'] if in_flight_s else []),
+            f'Prio: {prio_n} | Main: {main_n} | Paused: {paused_n}',
+            f'Spool: {spool_n}{"+" if spool_trunc else ""}{" (restart_pending)" if restart_pending else ""}',
+            '',
+        ]
 
         if total <= 0:
-            lines.append('')
             lines.append('Очередь пуста.')
             return ('\n'.join(lines).strip(), keyboards.queue_menu(page=0, pages=1, edit_active=edit_active))
 
-        page_items = items[start:end]
-        lines.append('')
+        page_items = list(itertools.islice(_iter_queue_items(snap), start, end))
+        lines += [
+            f'{start + idx:>3}. [{_QUEUE_BUCKET_MARKS.get(bucket, "?")}] {s}'
+            for idx, (bucket, _, s) in enumerate(page_items, start=1)
+        ]
+        # Per-item buttons exist only in edit mode: read-only pages skip building them altogether.
         item_buttons: list[tuple[str, str]] = []
-        for idx, (bucket, bucket_idx, s) in enumerate(page_items, start=1):
-            prefix = {'prio': 'P', 'main': 'M', 'paused': '⏸', 'spool': 'S'}.get(bucket, '?')
-            lines.append(f'{start + idx:>3}. [{prefix}] {s}')
-            if edit_active:
-                item_buttons.append(
-                    (
-                        str(int(start + idx)),
-                        f'{keyboards.CB_QUEUE_ITEM_PREFIX}{bucket}:{int(bucket_idx)}:{int(p)}',
-                    )
-                )
+        if edit_active:
+            item_buttons = [
+                (str(start + idx), f'{keyboards.CB_QUEUE_ITEM_PREFIX}{bucket}:{bucket_idx}:{p}')
+                for idx, (bucket, bucket_idx, _) in enumerate(page_items, start=1)
+            ]
 
-        lines.append('')
-        lines.append(f'Page: {p + 1}/{pages} (items {start + 1}-{min(total, end)} of {total})')
+        lines += ['', f'Page: {p + 1}/{pages} (items {start + 1}-{min(total, end)} of {total})']
         return (
             '\n'.join(lines).strip(),
             keyboards.queue_menu(page=p, pages=pages, edit_active=edit_active, item_buttons=(item_buttons or None)),
@@ -4680,8 +5162,6 @@ class Router:
         page: int,
         page_size: int,
     ) -> tuple[str, dict[str, Any] | None]:
-        from . import keyboards
-
         b = str(bucket or '').strip().lower()
         i = max(0, int(index))
         p = max(0, int(page))
@@ -4717,16 +5197,14 @@ class Router:
             return self._render_queue_page(chat_id=chat_id, page=p, page_size=size, notice='⚠️ Item not found')
 
         summary = str(head[i]).strip()
-        lines: list[str] = []
-        lines.append('🧾 Queue item')
-        if edit_active:
-            lines.append('Mode: EDIT (worker paused)')
-        lines.append(f'Bucket: {b} | Index: {i + 1}')
-        lines.append('')
-        lines.append(summary)
-        if edit_active and b not in {'main', 'spool'}:
-            lines.append('')
-            lines.append('ℹ️ Read-only bucket (actions disabled)')
+        lines = [
+            '🧾 Queue item',
+            *(['Mode: EDIT (worker paused)'] if edit_active else []),
+            f'Bucket: {b} | Index: {i + 1}',
+            '',
+            summary,
+            *(['', 'ℹ️ Read-only bucket (actions disabled)'] if edit_active and b not in {'main', 'spool'} else []),
+        ]
 
         return (
             '\n'.join(lines).strip(),
@@ -4748,13 +5226,12 @@ class Router:
         parts = text.strip().split()
         raw_cmd = (parts[0] or '').strip()
         cmd = raw_cmd.casefold()
-        if cmd.startswith('/') and '@' in cmd:
-            cmd = cmd.split('@', 1)[0].strip().casefold()
+        if cmd.startswith('/'):
+            # '/help@BotName' -> '/help' (already casefolded; split() left no whitespace to strip).
+            cmd = cmd.partition('@')[0]
         arg = ' '.join(parts[1:]).strip() if len(parts) > 1 else ''
         rt = reply_to_message_id
 
-        from .keyboards import inline_keyboard, help_menu
-
         def reply(
             msg: str,
             *,
@@ -4768,28 +5245,21 @@ class Router:
                 reply_to_message_id=rt,
             )
 
-        multi_tenant = int(self.owner_chat_id or 0) != 0
-        is_owner = self._is_owner_chat(chat_id)
-        owner_user_id = int(self.owner_chat_id or 0) if int(self.owner_chat_id or 0) > 0 else 0
-        is_owner_user = owner_user_id != 0 and int(user_id) == owner_user_id
+        # The owner chat id doubles as the owner's user id when positive (a private chat).
+        owner_int = self._owner_chat_int
+        multi_tenant = owner_int != 0
+        is_owner = multi_tenant and int(chat_id) == owner_int
+        is_owner_user = owner_int > 0 and int(user_id) == owner_int
 
         # Group chats should not have global-state controls (mute/lunch/gentle/etc).
         if int(chat_id) < 0:
-            allowed = {'/start', '/help', '/id', '/whoami', '/status'}
-            if is_owner or is_owner_user:
-                allowed.add('/reminders')
-                allowed.add('/mm-otp')
-                allowed.add('/mm-reset')
+            allowed = _PUBLIC_OWNER_USER_COMMANDS if (is_owner or is_owner_user) else _PUBLIC_COMMANDS
             if cmd not in allowed:
                 reply('⛔️ Эта команда доступна только в личке. /help', reply_markup=None)
                 return
         if multi_tenant and not is_owner:
             # Keep non-owner chats safe: do not allow global-state commands.
-            allowed = {'/start', '/help', '/id', '/whoami', '/status'}
-            if is_owner_user:
-                allowed.add('/reminders')
-                allowed.add('/mm-otp')
-                allowed.add('/mm-reset')
+            allowed = _PUBLIC_OWNER_USER_COMMANDS if is_owner_user else _PUBLIC_COMMANDS
             if cmd not in allowed:
                 reply('⛔️ Эта команда доступна только в owner-чате. /help', reply_markup=None)
                 return
@@ -4871,7 +5341,9 @@ class Router:
                     f'Префикс {self.force_read_prefix} — форсировать режим read-only.\n'
                     f'Префикс {self.force_danger_prefix} — ⚠️ DANGEROUS: запуск Codex с --dangerously-bypass-approvals-and-sandbox --sandbox danger-full-access (без роутера).'
                 ),
-                reply_markup=help_menu(gentle_active=self.state.is_gentle_active()) if int(chat_id) > 0 else None,
+                reply_markup=(
+                    keyboards.help_menu(gentle_active=self.state.is_gentle_active()) if int(chat_id) > 0 else None
+                ),
             )
             return
 
@@ -5076,7 +5548,9 @@ class Router:
             sleep = 'ON' if self.state.is_sleeping(chat_id=chat_id, message_thread_id=scope_thread_id) else 'OFF'
             reply(
                 (f'📌 Статус\n{base}\nGentle: {gentle}\nSnooze: {snooze}\nSleep: {sleep}'),
-                reply_markup=help_menu(gentle_active=self.state.is_gentle_active()) if int(chat_id) > 0 else None,
+                reply_markup=(
+                    keyboards.help_menu(gentle_active=self.state.is_gentle_active()) if int(chat_id) > 0 else None
+                ),
             )
             return
 
@@ -5380,7 +5854,7 @@ class Router:
                     f'{hint}'
                 ),
                 reply_markup=(
-                    help_menu(gentle_active=self.state.is_gentle_active())
+                    keyboards.help_menu(gentle_active=self.state.is_gentle_active())
                     if int(chat_id) > 0 and (not multi_tenant or is_owner)
                     else None
                 ),
@@ -5507,11 +5981,7 @@ class Router:
                 )
                 if isinstance(resp, dict):
                     ack_scheduled = bool(resp.get('ok') is True or resp.get('deferred') is True)
-                    try:
-                        result = resp.get('result') or {}
-                        ack_message_id = int((result.get('message_id') if isinstance(result, dict) else 0) or 0)
-                    except Exception:
-                        ack_message_id = 0
+                    ack_message_id = _extract_message_id(resp)
             except Exception:
                 ack_scheduled = False
                 ack_message_id = 0
@@ -5522,6 +5992,7 @@ class Router:
                     if callable(edit_by_key):
                         try:
                             edit_by_key(chat_id=int(chat_id), coalesce_key=ack_coalesce_key, text=text)
+                            self._forget_edit_by_coalesce_key(chat_id=int(chat_id), coalesce_key=ack_coalesce_key)
                             return
                         except Exception:
                             pass
@@ -5530,6 +6001,7 @@ class Router:
                     if callable(edit):
                         try:
                             edit(chat_id=int(chat_id), message_id=int(ack_message_id), text=text)
+                            self._forget_edit((int(chat_id), int(ack_message_id)))
                             return
                         except Exception:
                             pass
@@ -5640,7 +6112,7 @@ class Router:
             self.state.set_snooze(60 * 60, kind='lunch')
             reply(
                 '🍽️ Ок, пауза на 60 минут. Вернёшься — /back.',
-                reply_markup=help_menu(gentle_active=self.state.is_gentle_active()),
+                reply_markup=keyboards.help_menu(gentle_active=self.state.is_gentle_active()),
             )
             return
 
@@ -5668,7 +6140,7 @@ class Router:
             reply(
                 f'✅ Профиль сохранён: mode={mode}, reasoning={reasoning}.\n'
                 f'Применится к следующему запуску в scope={chat_id}:{scope_thread_id}.',
-                reply_markup=help_menu(gentle_active=self.state.is_gentle_active()),
+                reply_markup=keyboards.help_menu(gentle_active=self.state.is_gentle_active()),
             )
             return
 
@@ -5697,7 +6169,7 @@ class Router:
                     f'- mode: {self.state.last_codex_mode_for(chat_id=chat_id, message_thread_id=scope_thread_id)}\n'
                     f'- reasoning: {self.state.last_codex_reasoning_for(chat_id=chat_id, message_thread_id=scope_thread_id)}\n'
                     f'- model: {scope_model}',
-                    reply_markup=inline_keyboard(menu_rows),
+                    reply_markup=keyboards.inline_keyboard(menu_rows),
                 )
                 return
 
@@ -5710,7 +6182,7 @@ class Router:
             )
             reply(
                 f'✅ Модель для scope {chat_id}:{scope_thread_id} сохранена: {model}',
-                reply_markup=help_menu(gentle_active=self.state.is_gentle_active()),
+                reply_markup=keyboards.help_menu(gentle_active=self.state.is_gentle_active()),
             )
             return
 
@@ -5719,13 +6191,13 @@ class Router:
             if not sec:
                 reply(
                     'Пример: /mute 30m или /mute 2h или /mute 1d',
-                    reply_markup=help_menu(gentle_active=self.state.is_gentle_active()),
+                    reply_markup=keyboards.help_menu(gentle_active=self.state.is_gentle_active()),
                 )
                 return
             self.state.set_snooze(sec, kind='mute')
             reply(
                 f'🔕 Ок. Пауза установлена ({arg}).',
-                reply_markup=help_menu(gentle_active=self.state.is_gentle_active()),
+                reply_markup=keyboards.help_menu(gentle_active=self.state.is_gentle_active()),
             )
             self._maybe_auto_enable_gentle(chat_id=chat_id, reason='auto: multiple mutes')
             return
@@ -5734,7 +6206,7 @@ class Router:
             self.state.clear_snooze()
             reply(
                 '✅ Ок, снова на связи.',
-                reply_markup=help_menu(gentle_active=self.state.is_gentle_active()),
+                reply_markup=keyboards.help_menu(gentle_active=self.state.is_gentle_active()),
             )
             return
 
@@ -5754,7 +6226,7 @@ class Router:
             if int(ack_message_id or 0) <= 0:
                 reply(
                     '🔄 Ок. Перезапущусь после обработки очереди. Новые сообщения сохраню и обработаю после рестарта.',
-                    reply_markup=help_menu(gentle_active=self.state.is_gentle_active()),
+                    reply_markup=keyboards.help_menu(gentle_active=self.state.is_gentle_active()),
                 )
             return
 
@@ -5775,12 +6247,12 @@ class Router:
                 suffix = f' Профили: {", ".join(removed_profiles)}.' if removed_profiles else ''
                 reply(
                     f'♻️ Сбросил Codex-сессию для этого топика (scoped).{suffix}',
-                    reply_markup=help_menu(gentle_active=self.state.is_gentle_active()),
+                    reply_markup=keyboards.help_menu(gentle_active=self.state.is_gentle_active()),
                 )
             else:
                 reply(
                     '⚠️ Не смог сбросить Codex-сессию для этого топика.',
-                    reply_markup=help_menu(gentle_active=self.state.is_gentle_active()),
+                    reply_markup=keyboards.help_menu(gentle_active=self.state.is_gentle_active()),
                 )
             return
 
@@ -5899,7 +6371,7 @@ class Router:
 
         reply(
             'Не понял команду. /help',
-            reply_markup=help_menu(gentle_active=self.state.is_gentle_active()),
+            reply_markup=keyboards.help_menu(gentle_active=self.state.is_gentle_active()),
         )
 
     def _handle_sleep_cmd(
@@ -5910,8 +6382,6 @@ class Router:
         reply_to_message_id: int | None = None,
         ack_message_id: int = 0,
     ) -> None:
-        from .keyboards import help_menu
-
         rt = reply_to_message_id
         thread_id = int(self._tg_message_thread_id() or 0)
         arg = (arg or '').strip().lower()
@@ -5926,7 +6396,7 @@ class Router:
                 chat_id=chat_id,
                 text=text,
                 ack_message_id=ack_message_id,
-                reply_markup=help_menu(gentle_active=self.state.is_gentle_active()),
+                reply_markup=keyboards.help_menu(gentle_active=self.state.is_gentle_active()),
                 reply_to_message_id=rt,
             )
             return
@@ -5937,7 +6407,7 @@ class Router:
                 chat_id=chat_id,
                 text='😴 Sleep: OFF.',
                 ack_message_id=ack_message_id,
-                reply_markup=help_menu(gentle_active=self.state.is_gentle_active()),
+                reply_markup=keyboards.help_menu(gentle_active=self.state.is_gentle_active()),
                 reply_to_message_id=rt,
             )
             return
@@ -5948,7 +6418,7 @@ class Router:
                 chat_id=chat_id,
                 text='Неверный формат времени. Пример: /sleep 23:45 или /sleep 0.',
                 ack_message_id=ack_message_id,
-                reply_markup=help_menu(gentle_active=self.state.is_gentle_active()),
+                reply_markup=keyboards.help_menu(gentle_active=self.state.is_gentle_active()),
                 reply_to_message_id=rt,
             )
             return
@@ -5958,7 +6428,7 @@ class Router:
             chat_id=chat_id,
             text=f'😴 Ок. Sleep установлен до {_fmt_dt(until_ts)}.',
             ack_message_id=ack_message_id,
-            reply_markup=help_menu(gentle_active=self.state.is_gentle_active()),
+            reply_markup=keyboards.help_menu(gentle_active=self.state.is_gentle_active()),
             reply_to_message_id=rt,
         )
 
@@ -5971,7 +6441,6 @@ class Router:
         ack_message_id: int = 0,
     ) -> None:
         arg = (arg or '').strip().lower()
-        from .keyboards import help_menu
 
         rt = reply_to_message_id
 
@@ -5983,7 +6452,7 @@ class Router:
                     chat_id=chat_id,
                     text='▶️ Щадящий режим выключен.',
                     ack_message_id=ack_message_id,
-                    reply_markup=help_menu(gentle_active=self.state.is_gentle_active()),
+                    reply_markup=keyboards.help_menu(gentle_active=self.state.is_gentle_active()),
                     reply_to_message_id=rt,
                 )
             else:
@@ -5994,7 +6463,7 @@ class Router:
                     chat_id=chat_id,
                     text=f'🫶 Щадящий режим включён на {self.gentle_default_minutes}м.',
                     ack_message_id=ack_message_id,
-                    reply_markup=help_menu(gentle_active=self.state.is_gentle_active()),
+                    reply_markup=keyboards.help_menu(gentle_active=self.state.is_gentle_active()),
                     reply_to_message_id=rt,
                 )
             return
@@ -6010,7 +6479,7 @@ class Router:
                 chat_id=chat_id,
                 text=f'🫶 Щадящий режим включён ({max(1, sec // 60)}м).',
                 ack_message_id=ack_message_id,
-                reply_markup=help_menu(gentle_active=self.state.is_gentle_active()),
+                reply_markup=keyboards.help_menu(gentle_active=self.state.is_gentle_active()),
                 reply_to_message_id=rt,
             )
             return
@@ -6021,7 +6490,7 @@ class Router:
                 chat_id=chat_id,
                 text='▶️ Щадящий режим выключен.',
                 ack_message_id=ack_message_id,
-                reply_markup=help_menu(gentle_active=self.state.is_gentle_active()),
+                reply_markup=keyboards.help_menu(gentle_active=self.state.is_gentle_active()),
                 reply_to_message_id=rt,
             )
             return
@@ -6033,7 +6502,7 @@ class Router:
                 chat_id=chat_id,
                 text=f'🫶 Щадящий режим включён ({max(1, sec2 // 60)}м).',
                 ack_message_id=ack_message_id,
-                reply_markup=help_menu(gentle_active=self.state.is_gentle_active()),
+                reply_markup=keyboards.help_menu(gentle_active=self.state.is_gentle_active()),
                 reply_to_message_id=rt,
             )
             return
@@ -6042,7 +6511,7 @@ class Router:
             chat_id=chat_id,
             text='Пример: /gentle on, /gentle off, /gentle 4h',
             ack_message_id=ack_message_id,
-            reply_markup=help_menu(gentle_active=self.state.is_gentle_active()),
+            reply_markup=keyboards.help_menu(gentle_active=self.state.is_gentle_active()),
             reply_to_message_id=rt,
         )
 
@@ -6059,12 +6528,11 @@ class Router:
         if self.state.is_gentle_active():
             return
         self.state.enable_gentle(seconds=int(self.gentle_default_minutes) * 60, reason=reason, extend=True)
-        from .keyboards import help_menu
 
         self._send_message(
             chat_id=chat_id,
             text=f'🫶 Я вижу много /mute. Включил щадящий режим на {self.gentle_default_minutes}м (меньше пингов).\nВыключить: /gentle off',
-            reply_markup=help_menu(gentle_active=self.state.is_gentle_active()),
+            reply_markup=keyboards.help_menu(gentle_active=self.state.is_gentle_active()),
             kind='gentle_auto',
         )
 
@@ -6223,14 +6691,14 @@ class Router:
 
         repo_root, env_policy = self._codex_context(chat_id)
         self.state.metric_inc('router.classify.calls')
-        t0 = time.time()
+        t0 = time.monotonic()
         raw = self.codex.classify(
             prompt=classifier_prompt,
             repo_root=repo_root,
             env_policy=env_policy,
             config_overrides={'model_reasoning_effort': 'low'},
         )
-        self.state.metric_observe_ms('router.classify', (time.time() - t0) * 1000.0)
+        self.state.metric_observe_ms('router.classify', (time.monotonic() - t0) * 1000.0)
         if isinstance(raw, str) and raw.lstrip().startswith('[codex error]'):
             self.state.metric_inc('router.classify.codex_error')
         obj = _extract_json_object(raw)
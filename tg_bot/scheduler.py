@@ -4,7 +4,7 @@ import time
 from collections import deque
 from collections.abc import Callable
 from dataclasses import dataclass
-from threading import Condition, Lock
+from threading import Condition, Lock, Thread
 from typing import Generic, Protocol, TypeVar
 
 
@@ -163,6 +163,15 @@ class ParallelScheduler(Generic[T]):
                     n += 1
             return n
 
+    def has_callback(self, *, chat_id: int, message_thread_id: int = 0, data: str) -> bool:
+        """True if a callback with this `data` is queued or running in the scope."""
+        scope = (int(chat_id), int(message_thread_id or 0))
+        with self._lock:
+            running = self._running.get(scope)
+            items = [running.item] if running is not None else []
+            items.extend(x for x in (*self._prio, *self._main, *self._paused) if x.scope == scope)
+            return any(self._is_callback(x.event) and str(x.event.text or '') == data for x in items)
+
     def _apply_pause_barrier(
         self,
         *,
@@ -373,3 +382,46 @@ class ParallelScheduler(Generic[T]):
                 self._cv.notify_all()
 
             return {'ok': True, 'changed': bool(changed), 'n': len(self._main)}
+
+
+class ScopeLanes:
+    """Run callables in per-scope FIFO lanes: ordered within a scope, concurrent across scopes.
+
+    Each busy scope gets one short-lived daemon thread that drains its lane and exits when it is empty,
+    so an idle bot holds no extra threads.
+    """
+
+    def __init__(self, *, name: str = 'tg-lane') -> None:
+        self._name = str(name or 'tg-lane')
+        self._lock = Lock()
+        self._idle = Condition(self._lock)
+        self._lanes: dict[Scope, deque[Callable[[], None]]] = {}
+
+    def submit(self, fn: Callable[[], None], *, chat_id: int, message_thread_id: int = 0) -> None:
+        scope = (int(chat_id), int(message_thread_id or 0))
+        with self._lock:
+            lane = self._lanes.get(scope)
+            if lane is not None:
+                lane.append(fn)
+                return
+            self._lanes[scope] = deque((fn,))
+        Thread(target=self._drain, args=(scope,), name=self._name, daemon=True).start()
+
+    def join(self, *, timeout: float | None = None) -> bool:
+        """Wait until every lane has drained (including callables submitted meanwhile); False on timeout."""
+        with self._idle:
+            return self._idle.wait_for(lambda: not self._lanes, timeout=timeout)
+
+    def _drain(self, scope: Scope) -> None:
+        while True:
+            with self._lock:
+                lane = self._lanes.get(scope)
+                if not lane:
+                    self._lanes.pop(scope, None)
+                    self._idle.notify_all()
+                    return
+                fn = lane.popleft()
+            try:
+                fn()
+            except Exception:
+                pass
@@ -5,7 +5,7 @@ import os
 import time
 from dataclasses import dataclass, field
 from pathlib import Path
-from threading import Lock
+from threading import Condition, Event, Lock, Thread
 from typing import Any
 
 
@@ -66,6 +66,29 @@ def _normalize_codex_reasoning(raw: object) -> str:
     return v if v in {'low', 'medium', 'high', 'xhigh'} else ''
 
 
+def _voice_route_choice(entry: dict[str, Any] | None) -> str | None:
+    if not entry:
+        return None
+    ch = entry.get('choice')
+    if isinstance(ch, str) and ch.strip():
+        out = ch.strip().lower()
+        return out if out in {'read', 'write', 'danger', 'none'} else None
+    return None
+
+
+@dataclass(frozen=True)
+class ChatSnapshot:
+    """Point-in-time view of per-scope routing state (see `BotState.snapshot_for_chat`)."""
+
+    waiting_for_user: dict[str, Any] | None
+    collect_status: str
+    pending_voice_route: dict[str, Any] | None
+
+    @property
+    def voice_route_choice(self) -> str | None:
+        return _voice_route_choice(self.pending_voice_route)
+
+
 @dataclass
 class BotState:
     """Persistent bot state (JSON file).
@@ -81,6 +104,14 @@ class BotState:
 
     path: Path
     lock: Lock = field(default_factory=Lock)
+    # Wakes up handlers blocked in `wait_voice_route_choice` (in-memory only, not persisted).
+    voice_route_cond: Condition = field(default_factory=Condition, repr=False, compare=False)
+    # Write-behind for `append_history`: with a delay > 0 a daemon thread coalesces history saves (started lazily on
+    # the first append); 0 saves synchronously. In-memory only, not persisted.
+    history_flush_delay_seconds: float = field(default=0.0, repr=False, compare=False)
+    _history_dirty: Event = field(default_factory=Event, init=False, repr=False, compare=False)
+    _history_flusher: Thread | None = field(default=None, init=False, repr=False, compare=False)
+    _history_stop: Event = field(default_factory=Event, init=False, repr=False, compare=False)
 
     tg_offset: int = 0
 
@@ -2048,6 +2079,51 @@ class BotState:
                     continue
         return ''
 
+    def resolve_ack_message_id(self, *, chat_id: int, coalesce_key: str, fallback_message_id: int = 0) -> int:
+        """Resolve the ack message_id for `coalesce_key` in one pass over the coalesce-key map.
+
+        The bound message_id wins; `fallback_message_id` (from the event/job) is used only if it is not bound
+        to a different key. Bumps `delivery.ack.mismatch` / `delivery.ack.stale`.
+        """
+        ck = str(coalesce_key or '').strip()[:64]
+        try:
+            fallback = int(fallback_message_id or 0)
+        except Exception:
+            fallback = 0
+        try:
+            cid = int(chat_id)
+        except Exception:
+            cid = 0
+        if not ck or cid == 0:
+            return max(0, fallback)
+
+        bound = 0
+        other_key = ''
+        with self.lock:
+            mapping = self.tg_message_id_by_coalesce_key_by_chat.get(str(cid))
+            if isinstance(mapping, dict) and mapping:
+                try:
+                    bound = int(mapping.get(ck) or 0)
+                except Exception:
+                    bound = 0
+                if bound <= 0 and fallback > 0:
+                    for k, mapped_mid in mapping.items():
+                        try:
+                            if int(mapped_mid or 0) == fallback:
+                                other_key = str(k or '').strip()[:64]
+                                break
+                        except Exception:
+                            continue
+
+        if bound > 0:
+            if fallback > 0 and bound != fallback:
+                self.metric_inc('delivery.ack.mismatch')
+            return bound
+        if other_key and other_key != ck:
+            self.metric_inc('delivery.ack.stale')
+            return 0
+        return max(0, fallback)
+
     def tg_bind_message_id_for_coalesce_key(
         self, *, chat_id: int, coalesce_key: str, message_id: int, max_keys_per_chat: int = 200
     ) -> None:
@@ -2200,7 +2276,8 @@ class BotState:
             if not job:
                 per_chat.pop(rid, None)
             else:
-                per_chat[rid] = dict(job)
+                # Callers hand over a freshly built job: store it without another copy.
+                per_chat[rid] = job
 
             # Prune expired and keep last N by created_ts (best-effort).
             pruned: dict[str, dict[str, Any]] = {}
@@ -2220,7 +2297,7 @@ class BotState:
                     created = float(v.get('created_ts') or 0.0)
                 except Exception:
                     created = 0.0
-                items.append((created, k.strip()[:32], dict(v)))
+                items.append((created, k.strip()[:32], v))
             items.sort(key=lambda t: t[0], reverse=True)
             for _, k, v in items[: max(0, int(max_per_chat or 0)) or 20]:
                 pruned[k] = v
@@ -2379,6 +2456,23 @@ class BotState:
             else:
                 self.pending_voice_routes_by_scope.pop(scope_key, None)
         self.save()
+        with self.voice_route_cond:
+            self.voice_route_cond.notify_all()
+
+    def wait_voice_route_choice(
+        self, *, chat_id: int, message_thread_id: int = 0, voice_message_id: int, timeout_seconds: float
+    ) -> str | None:
+        """Block until a voice-route choice is selected (or timeout); return it like `pending_voice_route_choice`."""
+        deadline = _now_ts() + max(0.0, float(timeout_seconds or 0.0))
+        with self.voice_route_cond:
+            while True:
+                choice = self.pending_voice_route_choice(
+                    chat_id=chat_id, message_thread_id=message_thread_id, voice_message_id=voice_message_id
+                )
+                remaining = deadline - _now_ts()
+                if choice is not None or remaining <= 0:
+                    return choice
+                self.voice_route_cond.wait(timeout=remaining)
 
     def pending_voice_route(
         self, *, chat_id: int, message_thread_id: int = 0, voice_message_id: int
@@ -2414,13 +2508,7 @@ class BotState:
         entry = self.pending_voice_route(
             chat_id=chat_id, message_thread_id=message_thread_id, voice_message_id=voice_message_id
         )
-        if not entry:
-            return None
-        ch = entry.get('choice')
-        if isinstance(ch, str) and ch.strip():
-            out = ch.strip().lower()
-            return out if out in {'read', 'write', 'danger', 'none'} else None
-        return None
+        return _voice_route_choice(entry)
 
     def pop_pending_voice_route(
         self, *, chat_id: int, message_thread_id: int = 0, voice_message_id: int
@@ -2628,6 +2716,11 @@ class BotState:
         with self.lock:
             return float(self.last_user_msg_ts_by_chat.get(key) or 0.0)
 
+    def ping_pending(self) -> bool:
+        """True while a watcher ping escalation is armed (cleared by `mark_user_activity`)."""
+        with self.lock:
+            return self.last_ping_stage > 0 or self.last_ping_ts > 0
+
     def clear_ping_state(self) -> None:
         """Clear only ping/escalation state (does not mark user as active)."""
         with self.lock:
@@ -3098,8 +3191,44 @@ class BotState:
             self.history.append(item)
             if max_events > 0 and len(self.history) > max_events:
                 self.history = self.history[-max_events:]
+            write_behind = float(self.history_flush_delay_seconds) > 0 and not self._history_stop.is_set()
+            if write_behind and self._history_flusher is None:
+                self._history_flusher = Thread(target=self._history_flush_loop, name='state-history-flush', daemon=True)
+                self._history_flusher.start()
+        if not write_behind:
+            # No flusher (disabled or already closed): persist right away.
+            self.save()
+            return
+        # Persisted by the write-behind flusher: several events per turn collapse into one save.
+        self._history_dirty.set()
+
+    def _history_flush_loop(self) -> None:
+        while not self._history_stop.is_set():
+            self._history_dirty.wait()
+            # `close()` cuts the coalescing delay short and does the final save itself.
+            if self._history_stop.wait(max(0.0, float(self.history_flush_delay_seconds))):
+                return
+            self._history_dirty.clear()
+            try:
+                self.save()
+            except Exception:
+                pass
+
+    def flush(self) -> None:
+        """Persist pending write-behind updates (history) synchronously."""
+        self._history_dirty.clear()
         self.save()
 
+    def close(self) -> None:
+        """Stop the history flusher and persist what it had pending; later appends are saved synchronously."""
+        with self.lock:
+            self._history_stop.set()
+            flusher = self._history_flusher
+        self._history_dirty.set()
+        if flusher is not None:
+            flusher.join(timeout=5.0)
+        self.flush()
+
     def record_pending_followup(
         self,
         *,
@@ -3151,14 +3280,51 @@ class BotState:
     ) -> str:
         sk = _scope_key(chat_id=int(chat_id), message_thread_id=int(message_thread_id or 0))
         with self.lock:
-            if isinstance(self.collect_active.get(sk), dict):
-                return 'active'
-            if (self.collect_pending.get(sk) or []):
-                return 'pending'
-            if (self.collect_deferred.get(sk) or []):
-                return 'deferred'
+            return self._collect_status_locked(sk)
+
+    def collect_pending_count(self, *, chat_id: int, message_thread_id: int = 0) -> int:
+        sk = _scope_key(chat_id=int(chat_id), message_thread_id=int(message_thread_id or 0))
+        with self.lock:
+            items = self.collect_pending.get(sk)
+            return len(items) if isinstance(items, list) else 0
+
+    def _collect_status_locked(self, sk: str) -> str:
+        if isinstance(self.collect_active.get(sk), dict):
+            return 'active'
+        if (self.collect_pending.get(sk) or []):
+            return 'pending'
+        if (self.collect_deferred.get(sk) or []):
+            return 'deferred'
         return 'idle'
 
+    def snapshot_for_chat(self, *, chat_id: int, message_thread_id: int = 0, voice_message_id: int = 0) -> ChatSnapshot:
+        """Read waiting/collect/voice-route state for one scope under a single lock acquisition."""
+        sk = _scope_key(chat_id=int(chat_id), message_thread_id=int(message_thread_id or 0))
+        mid = int(voice_message_id or 0)
+        now = _now_ts()
+        with self.lock:
+            waiting = self.waiting_for_user_by_scope.get(sk)
+            collect_status = self._collect_status_locked(sk)
+            voice = (self.pending_voice_routes_by_scope.get(sk) or {}).get(str(mid)) if mid > 0 else None
+        if not isinstance(waiting, dict) or not waiting:
+            waiting = None
+        if not isinstance(voice, dict) or not voice:
+            voice = None
+        if voice is not None:
+            try:
+                exp = float(voice.get('expires_ts') or 0.0)
+            except Exception:
+                exp = 0.0
+            if exp > 0 and exp <= now:
+                # Best-effort prune (same as `pending_voice_route`).
+                self.pop_pending_voice_route(chat_id=chat_id, message_thread_id=message_thread_id, voice_message_id=mid)
+                voice = None
+        return ChatSnapshot(
+            waiting_for_user=(dict(waiting) if waiting is not None else None),
+            collect_status=collect_status,
+            pending_voice_route=(dict(voice) if voice is not None else None),
+        )
+
     def collect_append(
         self,
         *,
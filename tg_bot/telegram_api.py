@@ -2,6 +2,7 @@ from __future__ import annotations
 
 import json
 import os
+import random
 import re
 import shutil
 import time
@@ -17,6 +18,102 @@ from uuid import uuid4
 
 from .state import BotState
 
+# Telegram's `parameters.retry_after` hint (seconds), as found in 429 error payloads.
+_RETRY_AFTER_RE = re.compile(r'[\'"]retry_after[\'"]\s*:\s*(\d+)')
+# Only new messages are paced (and may wait for a slot). Edits, callback answers and the like are
+# latency-sensitive: they never sleep, they only fail fast while Telegram's 429 `retry_after` is running.
+_PACED_METHODS = frozenset({'sendMessage', 'sendDocument', 'sendMediaGroup'})
+
+
+class _TokenBucket:
+    """Thread-safe token bucket: `reserve()` books one token and returns how long the caller should wait."""
+
+    def __init__(self, *, rate: float, capacity: float) -> None:
+        self.rate = float(rate)
+        self.capacity = float(max(1.0, capacity))
+        self.tokens = self.capacity
+        self.ts = time.monotonic()
+        self.blocked_until = 0.0
+        self.lock = Lock()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.ts) * self.rate)
+        self.ts = now
+
+    def reserve(self) -> float:
+        with self.lock:
+            self._refill(time.monotonic())
+            # Tokens may go negative: concurrent callers queue up behind each other instead of stampeding.
+            self.tokens -= 1.0
+            return 0.0 if self.tokens >= 0 else (-self.tokens / self.rate)
+
+    def penalize(self, seconds: float) -> None:
+        with self.lock:
+            self._refill(time.monotonic())
+            self.tokens = min(self.tokens, 0.0) - float(seconds) * self.rate
+            self.blocked_until = max(self.blocked_until, self.ts + float(seconds))
+
+    def blocked_for(self) -> float:
+        with self.lock:
+            return max(0.0, self.blocked_until - time.monotonic())
+
+    def is_idle(self) -> bool:
+        with self.lock:
+            self._refill(time.monotonic())
+            return self.tokens >= self.capacity
+
+
+class _TelegramRateLimiter:
+    """Bot-wide + per-chat outgoing request pacing (Telegram: ~30 msg/s overall, ~1 msg/s per chat)."""
+
+    _MAX_IDLE_CHAT_BUCKETS = 1024
+
+    def __init__(self, *, per_second: float, per_chat_per_second: float, per_chat_burst: float = 3.0) -> None:
+        self._global = _TokenBucket(rate=per_second, capacity=per_second) if per_second > 0 else None
+        self._per_chat_per_second = float(per_chat_per_second)
+        self._per_chat_burst = float(per_chat_burst)
+        self._chats: dict[object, _TokenBucket] = {}
+        self._lock = Lock()
+
+    def _chat_bucket(self, chat_id: object) -> _TokenBucket | None:
+        if chat_id is None or self._per_chat_per_second <= 0:
+            return None
+        # Multipart uploads carry chat_id as a form string: key numeric ids as int so a chat has one bucket.
+        try:
+            chat_id = int(chat_id)  # type: ignore[call-overload]
+        except (TypeError, ValueError):
+            pass
+        with self._lock:
+            bucket = self._chats.get(chat_id)
+            if bucket is None:
+                if len(self._chats) >= self._MAX_IDLE_CHAT_BUCKETS:
+                    # Full buckets carry no state: dropping them is equivalent to recreating them later.
+                    self._chats = {k: b for k, b in self._chats.items() if not b.is_idle()}
+                bucket = _TokenBucket(rate=self._per_chat_per_second, capacity=self._per_chat_burst)
+                self._chats[chat_id] = bucket
+            return bucket
+
+    def wait(self, chat_id: object) -> None:
+        delay = self._global.reserve() if self._global is not None else 0.0
+        bucket = self._chat_bucket(chat_id)
+        if bucket is not None:
+            delay = max(delay, bucket.reserve())
+        if delay > 0:
+            time.sleep(delay)
+
+    def blocked_for(self, chat_id: object) -> float:
+        """Seconds left of a 429 pause that applies to `chat_id` (0.0 if none); never waits."""
+        blocked = self._global.blocked_for() if self._global is not None else 0.0
+        bucket = self._chat_bucket(chat_id)
+        if bucket is not None:
+            blocked = max(blocked, bucket.blocked_for())
+        return blocked
+
+    def penalize(self, chat_id: object, seconds: float) -> None:
+        bucket = self._chat_bucket(chat_id) or self._global
+        if bucket is not None and seconds > 0:
+            bucket.penalize(seconds)
+
 
 @dataclass
 class _TelegramEndpointState:
@@ -33,14 +130,26 @@ class TelegramAPI:
     prefer_local: bool = True
     local_probe_seconds: int = 300
     log_path: Path | None = None
+    # Outgoing request pacing; 0 disables the corresponding limit.
+    rate_limit_per_second: float = 25.0
+    rate_limit_per_chat_per_second: float = 1.0
 
     _endpoint: _TelegramEndpointState = field(
         default_factory=_TelegramEndpointState, init=False, repr=False, compare=False
     )
+    _limiter: _TelegramRateLimiter = field(init=False, repr=False, compare=False)
 
     def __post_init__(self) -> None:
         object.__setattr__(self, 'local_root_url', self._normalize_root_url(self.local_root_url))
         object.__setattr__(self, 'remote_root_url', self._normalize_root_url(self.remote_root_url))
+        object.__setattr__(
+            self,
+            '_limiter',
+            _TelegramRateLimiter(
+                per_second=float(self.rate_limit_per_second or 0.0),
+                per_chat_per_second=float(self.rate_limit_per_chat_per_second or 0.0),
+            ),
+        )
 
         with self._endpoint.lock:
             if self.prefer_local and self.local_root_url:
@@ -145,6 +254,27 @@ class TelegramAPI:
         if switched:
             self._log_endpoint('Local Bot API is back; switched to local')
 
+    def _note_rate_limited(self, e: RuntimeError, *, chat_id: object) -> None:
+        msg = str(e)
+        if not msg.startswith('Telegram HTTPError 429'):
+            return
+        m = _RETRY_AFTER_RE.search(msg)
+        # Pause the chat (or the whole bot for chat-less calls) for Telegram's hint, so queued sends don't pile on.
+        self._limiter.penalize(chat_id, float(m.group(1)) if m else 1.0)
+
+    def _pace(self, method: str, chat_id: object) -> None:
+        if method in _PACED_METHODS:
+            self._limiter.wait(chat_id)
+            return
+        blocked = self._limiter.blocked_for(chat_id)
+        if blocked > 0:
+            # Shaped like Telegram's own 429 so callers defer it (outbox backoff honours retry_after).
+            retry_after = int(blocked) + 1
+            raise RuntimeError(
+                f'Telegram HTTPError 429: {{"ok":false,"description":"paused locally",'
+                f'"parameters":{{"retry_after":{retry_after}}}}}'
+            )
+
     def _request_json_once(self, *, base_url: str, method: str, params: dict[str, Any], timeout: int) -> dict[str, Any]:
         url = base_url + method
         data = None
@@ -194,10 +324,15 @@ class TelegramAPI:
 
         self._maybe_probe_local()
 
+        chat_id = params.get('chat_id')
+        if chat_id is not None:  # chat-less calls (getUpdates, answerCallbackQuery, ...) are never held back
+            self._pace(method, chat_id)
+
         base_url = self.base_url
         try:
             return self._request_json_once(base_url=base_url, method=method, params=params, timeout=timeout)
         except RuntimeError as e:
+            self._note_rate_limited(e, chat_id=chat_id)
             if (
                 self.local_root_url
                 and self.prefer_local
@@ -219,12 +354,16 @@ class TelegramAPI:
     ) -> dict[str, Any]:
         self._maybe_probe_local()
 
+        chat_id = (fields or {}).get('chat_id')
+        self._pace(method, chat_id)
+
         base_url = self.base_url
         try:
             return self._request_multipart_once(
                 base_url=base_url, method=method, fields=fields, files=files, timeout=timeout
             )
         except RuntimeError as e:
+            self._note_rate_limited(e, chat_id=chat_id)
             if (
                 self.local_root_url
                 and self.prefer_local
@@ -916,11 +1055,17 @@ class TelegramDeliveryAPI:
             },
         )
 
-    def _backoff(self, attempts: int) -> float:
-        # 2,4,8... up to max; then every max seconds.
+    def _backoff(self, attempts: int, error: Exception | None = None) -> float:
+        # 2,4,8... up to max; then every max seconds. Jittered (50-100%) so queued ops don't retry in lockstep.
         a = max(1, int(attempts))
-        base = self._backoff_base_seconds * (2.0 ** float(a - 1))
-        return float(min(self._backoff_max_seconds, max(0.5, base)))
+        base = min(self._backoff_max_seconds, self._backoff_base_seconds * (2.0 ** float(a - 1)))
+        delay = base * random.uniform(0.5, 1.0)
+        if error is not None:
+            # 429 responses carry Telegram's own hint: never retry before `parameters.retry_after`.
+            m = _RETRY_AFTER_RE.search(str(error))
+            if m:
+                delay = max(delay, float(m.group(1)))
+        return float(max(0.5, delay))
 
     def _is_retryable_error(self, e: Exception) -> bool:
         s = str(e)
@@ -968,7 +1113,7 @@ class TelegramDeliveryAPI:
             'params': dict(params),
             'created_ts': float(now),
             'attempts': int(attempts),
-            'next_attempt_ts': float(now + self._backoff(attempts)),
+            'next_attempt_ts': float(now + self._backoff(attempts, error)),
             'last_error': str(error)[:400],
         }
         if coalesce_key:
@@ -1712,7 +1857,7 @@ class TelegramDeliveryAPI:
                     except Exception as e:
                         attempts = int(item.get('attempts') or 0) + 1
                         item['attempts'] = attempts
-                        item['next_attempt_ts'] = float(now + self._backoff(attempts))
+                        item['next_attempt_ts'] = float(now + self._backoff(attempts, e))
                         item['last_error'] = str(e)[:400]
                         remaining.append(item)
                         changed = True
@@ -1973,7 +2118,7 @@ class TelegramDeliveryAPI:
                     if self._is_retryable_error(e):
                         attempts = int(item.get('attempts') or 0) + 1
                         item['attempts'] = attempts
-                        item['next_attempt_ts'] = float(now + self._backoff(attempts))
+                        item['next_attempt_ts'] = float(now + self._backoff(attempts, e))
                         item['last_error'] = str(e)[:400]
                         remaining.append(item)
                         changed = True
@@ -2043,7 +2188,7 @@ class TelegramDeliveryAPI:
                                 if self._is_retryable_error(send_e):
                                     attempts = int(item.get('attempts') or 0) + 1
                                     item['attempts'] = attempts
-                                    item['next_attempt_ts'] = float(now + self._backoff(attempts))
+                                    item['next_attempt_ts'] = float(now + self._backoff(attempts, send_e))
                                     item['last_error'] = str(send_e)[:400]
                                     item['op'] = 'send_message'
                                     item['params'] = send_params
@@ -22,3 +22,11 @@ class TestAdminUI(unittest.TestCase):
         for d in btn_data:
             if isinstance(d, str):
                 self.assertLessEqual(len(d.encode('utf-8')), 64)
+
+    def test_static_menus_are_memoized_per_gentle_flag(self) -> None:
+        self.assertIs(keyboards.help_menu(gentle_active=True), keyboards.help_menu(gentle_active=True))
+        self.assertIsNot(keyboards.help_menu(gentle_active=True), keyboards.help_menu(gentle_active=False))
+        self.assertIs(
+            keyboards.codex_answer_menu(gentle_active=False), keyboards.codex_answer_menu(gentle_active=False)
+        )
+        self.assertIs(keyboards.codex_answer_menu_public(), keyboards.codex_answer_menu_public())
@@ -0,0 +1,42 @@
+import unittest
+
+from tg_bot import keyboards
+from tg_bot.app import Event, _callback_is_duplicate
+from tg_bot.scheduler import ParallelScheduler
+
+
+def _cb(data: str, *, chat_id: int = 1) -> Event:
+    return Event(kind='callback', chat_id=chat_id, chat_type='private', user_id=1, text=data, message_id=7)
+
+
+class TestCallbackIsDuplicate(unittest.TestCase):
+    def test_repeat_press_is_duplicate_while_queued_or_running(self) -> None:
+        scheduler = ParallelScheduler(max_parallel_jobs=1, summarize=lambda ev: str(getattr(ev, 'text', '')))
+
+        def _dup(data: str, *, chat_id: int = 1) -> bool:
+            return _callback_is_duplicate(scheduler=scheduler, chat_id=chat_id, message_thread_id=0, data=data)
+
+        self.assertFalse(_dup(keyboards.CB_SUMMARY))
+        scheduler.enqueue(_cb(keyboards.CB_SUMMARY))
+        self.assertTrue(_dup(keyboards.CB_SUMMARY))
+
+        # The first press is taken by the worker; a tap arriving mid-run is still a duplicate.
+        self.assertIsNotNone(scheduler.try_dispatch_next(pause_active=False, pause_ts=0.0))
+        self.assertTrue(_dup(keyboards.CB_SUMMARY))
+        self.assertFalse(_dup(keyboards.CB_CX_NEXT))
+        self.assertFalse(_dup(keyboards.CB_SUMMARY, chat_id=2))
+
+        scheduler.mark_done(chat_id=1)
+        self.assertFalse(_dup(keyboards.CB_SUMMARY))
+
+    def test_cheap_buttons_and_text_events_are_not_debounced(self) -> None:
+        scheduler = ParallelScheduler(max_parallel_jobs=1, summarize=lambda ev: str(getattr(ev, 'text', '')))
+        scheduler.enqueue(_cb(keyboards.CB_EOD))
+        scheduler.enqueue(Event(kind='text', chat_id=1, chat_type='private', user_id=1, text=keyboards.CB_CX_NEXT))
+
+        self.assertFalse(
+            _callback_is_duplicate(scheduler=scheduler, chat_id=1, message_thread_id=0, data=keyboards.CB_EOD)
+        )
+        self.assertFalse(
+            _callback_is_duplicate(scheduler=scheduler, chat_id=1, message_thread_id=0, data=keyboards.CB_CX_NEXT)
+        )
@@ -126,3 +126,14 @@ class TestCodexRunnerCmd(unittest.TestCase):
             self.assertEqual(runner._normalize_session_key(chat_id=123, session_key=' abc '), 'abc')
             self.assertEqual(runner._normalize_session_key(chat_id=123, session_key=''), '123')
             self.assertIsNone(runner._normalize_session_key(chat_id=None, session_key=''))
+
+    def test_log_note_creates_missing_log_dir(self) -> None:
+        with tempfile.TemporaryDirectory() as td:
+            root = Path(td)
+            runner = self._mk_runner(root=root)
+            runner.log_path = root / 'logs' / 'nested' / 'codex.log'
+            runner.log_note('first')
+            runner.log_note('second')
+            lines = runner.log_path.read_text(encoding='utf-8').splitlines()
+            self.assertEqual(len(lines), 2)
+            self.assertTrue(lines[0].endswith('NOTE: first'))
@@ -1,5 +1,6 @@
 import re
 import tempfile
+import threading
 import unittest
 from pathlib import Path
 from typing import Any
@@ -14,6 +15,8 @@ class _FakeAPI:
         self.sends: list[dict[str, Any]] = []
         self.edits: list[dict[str, Any]] = []
         self.reply_markup_edits: list[dict[str, Any]] = []
+        # ('text' | 'markup', message_id) in call order.
+        self.edit_order: list[tuple[str, int]] = []
         self.chunks: list[dict[str, Any]] = []
         self._next_message_id = 100
 
@@ -56,6 +59,7 @@ class _FakeAPI:
         parse_mode: str | None = None,
         reply_markup: dict[str, Any] | None = None,
     ) -> None:
+        self.edit_order.append(('text', int(message_id)))
         self.edits.append(
             {
                 'chat_id': int(chat_id),
@@ -69,6 +73,7 @@ class _FakeAPI:
     def edit_message_reply_markup(
         self, *, chat_id: int, message_id: int, reply_markup: dict[str, Any] | None = None
     ) -> None:
+        self.edit_order.append(('markup', int(message_id)))
         self.reply_markup_edits.append(
             {'chat_id': int(chat_id), 'message_id': int(message_id), 'reply_markup': reply_markup}
         )
@@ -272,6 +277,9 @@ class TestRouterCallbackEditDelivery(unittest.TestCase):
             self.assertEqual(api.sends, [])
             self.assertTrue(any(int(e.get('message_id') or 0) == 777 for e in api.edits))
             self.assertTrue(any('OK' in str(e.get('text') or '') for e in api.edits))
+            # The keyboard goes before the status/answer edits of the same message, never after them.
+            self.assertEqual(api.edit_order[0], ('markup', 777))
+            self.assertEqual([op for op in api.edit_order if op[0] == 'markup'], [('markup', 777)])
 
     def test_dangerous_confirm_no_edits_message_when_delivery_edit(self) -> None:
         with tempfile.TemporaryDirectory() as td:
@@ -311,3 +319,115 @@ class TestRouterCallbackEditDelivery(unittest.TestCase):
             self.assertEqual(api.sends, [])
             self.assertTrue(any(int(e.get('message_id') or 0) == 777 for e in api.edits))
             self.assertTrue(any('OK' in str(e.get('text') or '') for e in api.edits))
+
+    def test_dangerous_confirm_double_click_runs_once(self) -> None:
+        with tempfile.TemporaryDirectory() as td:
+            state_path = Path(td) / 'state.json'
+            state_path.write_text('{}', encoding='utf-8')
+            st = BotState(path=state_path)
+            st.load()
+
+            rid = 'dbl789'
+            st.set_pending_dangerous_confirmation(
+                chat_id=1,
+                request_id=rid,
+                job={
+                    'payload': 'do stuff',
+                    'user_id': 1,
+                    'message_id': 555,
+                    'sent_ts': 0.0,
+                    'created_ts': 0.0,
+                    'expires_ts': 10**12,
+                },
+                max_per_chat=1,
+            )
+
+            runs: list[str] = []
+
+            class _CountingRunner(_FakeCodexRunner):
+                def run_dangerous_with_progress(self, *_: Any, **__: Any) -> str:
+                    runs.append('danger')
+                    return 'OK'
+
+            api = _FakeAPI()
+            router = _mk_router(api=api, state=st, codex=_CountingRunner(answer='OK'), repo_root=Path(td))  # type: ignore[arg-type]
+
+            gate = threading.Barrier(2)
+
+            def _click() -> None:
+                gate.wait(timeout=2.0)
+                router.handle_callback(
+                    chat_id=1,
+                    user_id=1,
+                    data=f'{keyboards.CB_DANGER_ALLOW_PREFIX}{rid}',
+                    callback_query_id='cb',
+                    message_id=777,
+                )
+
+            threads = [threading.Thread(target=_click) for _ in range(2)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join(timeout=10.0)
+
+            self.assertEqual(runs, ['danger'])
+
+    def test_dangerous_confirm_removes_keyboard_once_and_keeps_it_for_wrong_user(self) -> None:
+        with tempfile.TemporaryDirectory() as td:
+            state_path = Path(td) / 'state.json'
+            state_path.write_text('{}', encoding='utf-8')
+            st = BotState(path=state_path)
+            st.load()
+
+            rid = 'kb0001'
+            st.set_pending_dangerous_confirmation(
+                chat_id=1,
+                request_id=rid,
+                job={
+                    'payload': 'do stuff',
+                    'user_id': 1,
+                    'message_id': 555,
+                    'sent_ts': 0.0,
+                    'created_ts': 0.0,
+                    'expires_ts': 10**12,
+                },
+                max_per_chat=1,
+            )
+
+            api = _FakeAPI()
+            router = _mk_router(api=api, state=st, codex=_FakeCodexRunner(answer='OK'), repo_root=Path(td))  # type: ignore[arg-type]
+
+            def _click(user_id: int) -> None:
+                router.handle_callback(
+                    chat_id=1,
+                    user_id=user_id,
+                    data=f'{keyboards.CB_DANGER_ALLOW_PREFIX}{rid}',
+                    callback_query_id='cb',
+                    message_id=777,
+                )
+
+            _click(2)
+            self.assertEqual(api.reply_markup_edits, [])
+
+            _click(1)
+            self.assertEqual(api.reply_markup_edits, [{'chat_id': 1, 'message_id': 777, 'reply_markup': None}])
+
+    def test_exact_callbacks_dispatch_through_handler_table(self) -> None:
+        with tempfile.TemporaryDirectory() as td:
+            state_path = Path(td) / 'state.json'
+            state_path.write_text('{}', encoding='utf-8')
+            st = BotState(path=state_path)
+            st.load()
+
+            api = _FakeAPI()
+            router = _mk_router(api=api, state=st, codex=_FakeCodexRunner(answer='OK'), repo_root=Path(td))  # type: ignore[arg-type]
+
+            def _click(data: str) -> str:
+                router.handle_callback(chat_id=1, user_id=1, data=data, callback_query_id='cb', message_id=777)
+                return api.sends[-1]['text']
+
+            self.assertIn('Пауза 30м', _click(keyboards.CB_MUTE_30M))
+            self.assertTrue(st.is_snoozed())
+            self.assertIn('на связи', _click(keyboards.CB_ACK))
+            self.assertFalse(st.is_snoozed())
+            self.assertIn('Не понял кнопку', _click('no-such-button'))
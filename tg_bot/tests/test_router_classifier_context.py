@@ -1,6 +1,10 @@
 import unittest
 
-from tg_bot.router import _build_classifier_payload, _reminder_reply_write_hint
+from tg_bot.router import (
+    _build_classifier_payload,
+    _heuristic_dangerous_reason,
+    _reminder_reply_write_hint,
+)
 
 
 class TestRouterClassifierContext(unittest.TestCase):
@@ -28,3 +32,10 @@ class TestRouterClassifierContext(unittest.TestCase):
         reply_to = {'text': '⏰ 15:00: Something'}
         self.assertFalse(_reminder_reply_write_hint(user_text='спасибо', reply_to=reply_to))
         self.assertFalse(_reminder_reply_write_hint(user_text='перенеси на 17:00', reply_to={'text': 'not a reminder'}))
+
+    def test_heuristic_dangerous_reason_keeps_check_order(self) -> None:
+        self.assertIsNone(_heuristic_dangerous_reason('поправь опечатку в README'))
+        self.assertIsNone(_heuristic_dangerous_reason('как работает кэш?'))
+        self.assertEqual(_heuristic_dangerous_reason('как сделать git push?'), 'git (нужна сеть)')
+        # Both "curl" and a path outside the repo match: the earlier check wins, not the leftmost match.
+        self.assertEqual(_heuristic_dangerous_reason('cat /etc/hosts и curl'), 'скачивание из сети')
@@ -0,0 +1,130 @@
+import re
+import tempfile
+import threading
+import unittest
+from pathlib import Path
+from typing import Any
+
+from tg_bot.router import Router
+from tg_bot.state import BotState
+
+
+class _FakeAPI:
+    def __init__(self) -> None:
+        self.edits: list[dict[str, Any]] = []
+        self.markup_edits: list[dict[str, Any]] = []
+        self.markup_gate = threading.Event()
+        self.markup_gate.set()
+
+    def edit_message_reply_markup(self, **kwargs: Any) -> None:
+        self.markup_gate.wait(2.0)
+        self.markup_edits.append(dict(kwargs))
+
+    def edit_message_text(self, **kwargs: Any) -> dict[str, Any]:
+        self.edits.append(dict(kwargs))
+        return {'ok': True, 'result': {'message_id': int(kwargs.get('message_id') or 0)}}
+
+    def edit_message_text_by_coalesce_key(self, **kwargs: Any) -> dict[str, Any]:
+        self.edits.append(dict(kwargs))
+        return {'ok': True}
+
+
+def _mk_router(state: BotState, api: _FakeAPI) -> Router:
+    return Router(
+        api=api,  # type: ignore[arg-type]
+        state=state,
+        codex=object(),  # type: ignore[arg-type]
+        watcher=object(),  # type: ignore[arg-type]
+        workspaces=object(),  # type: ignore[arg-type]
+        owner_chat_id=1,
+        router_mode='heuristic',
+        min_profile='read',
+        force_write_prefix='!',
+        force_read_prefix='?',
+        force_danger_prefix='∆',
+        confidence_threshold=0.5,
+        debug=False,
+        dangerous_auto=False,
+        tg_typing_enabled=False,
+        tg_typing_interval_seconds=10,
+        tg_progress_edit_enabled=False,
+        tg_progress_edit_interval_seconds=10,
+        tg_codex_parse_mode='HTML',
+        fallback_patterns=re.compile(r'$^'),
+        gentle_default_minutes=60,
+        gentle_auto_mute_window_minutes=60,
+        gentle_auto_mute_count=3,
+        history_max_events=50,
+        history_context_limit=10,
+        history_entry_max_chars=400,
+        codex_followup_sandbox='read-only',
+    )
+
+
+class TestRouterEditDedup(unittest.TestCase):
+    def test_identical_edit_is_skipped(self) -> None:
+        with tempfile.TemporaryDirectory() as td:
+            state_path = Path(td) / 'state.json'
+            state_path.write_text('{}', encoding='utf-8')
+            st = BotState(path=state_path)
+            st.load()
+            api = _FakeAPI()
+            router = _mk_router(st, api)
+
+            self.assertTrue(router._try_edit_codex_answer(chat_id=1, message_id=10, text='**done**'))
+            self.assertTrue(router._try_edit_codex_answer(chat_id=1, message_id=10, text='**done**'))
+            self.assertEqual(len(api.edits), 1)
+
+            kb = {'inline_keyboard': [[{'text': 'ok', 'callback_data': 'x'}]]}
+            self.assertTrue(router._try_edit_codex_answer(chat_id=1, message_id=10, text='**done**', reply_markup=kb))
+            self.assertTrue(router._try_edit_codex_answer(chat_id=1, message_id=11, text='**done**'))
+            self.assertEqual(len(api.edits), 3)
+
+    def test_repeated_status_edit_is_skipped(self) -> None:
+        with tempfile.TemporaryDirectory() as td:
+            state_path = Path(td) / 'state.json'
+            state_path.write_text('{}', encoding='utf-8')
+            st = BotState(path=state_path)
+            st.load()
+            api = _FakeAPI()
+            router = _mk_router(st, api)
+
+            router._maybe_edit_ack(chat_id=1, message_id=5, text='⏳ working')
+            router._maybe_edit_ack(chat_id=1, message_id=5, text='⏳ working')
+            router._maybe_edit_ack(chat_id=1, message_id=5, text='✅ done')
+            self.assertEqual([e['text'] for e in api.edits], ['⏳ working', '✅ done'])
+
+    def test_edit_by_coalesce_key_invalidates_fingerprint(self) -> None:
+        with tempfile.TemporaryDirectory() as td:
+            state_path = Path(td) / 'state.json'
+            state_path.write_text('{}', encoding='utf-8')
+            st = BotState(path=state_path)
+            st.load()
+            st.tg_bind_message_id_for_coalesce_key(chat_id=1, coalesce_key='ack:1:3', message_id=5)
+            api = _FakeAPI()
+            router = _mk_router(st, api)
+
+            router._maybe_edit_ack(chat_id=1, message_id=5, text='⏳ working')
+            # The same message edited through its coalesce key: the remembered text is no longer on screen.
+            router._maybe_edit_ack_or_queue(chat_id=1, message_id=0, coalesce_key='ack:1:3', text='🕓 queued')
+            router._maybe_edit_ack(chat_id=1, message_id=5, text='⏳ working')
+            self.assertEqual([e['text'] for e in api.edits], ['⏳ working', '🕓 queued', '⏳ working'])
+
+    def test_keyboard_edit_invalidates_fingerprint_stored_while_queued(self) -> None:
+        with tempfile.TemporaryDirectory() as td:
+            state_path = Path(td) / 'state.json'
+            state_path.write_text('{}', encoding='utf-8')
+            st = BotState(path=state_path)
+            st.load()
+            api = _FakeAPI()
+            router = _mk_router(st, api)
+
+            api.markup_gate.clear()
+            router._edit_reply_markup_async(chat_id=1, message_id=10, reply_markup=None)
+            # A re-render lands while the keyboard edit is still pending: its fingerprint must not survive it.
+            router._remember_edit((1, 10), b'rerender')
+            api.markup_gate.set()
+            router._markup_lanes.join(timeout=2.0)
+
+            self.assertEqual(len(api.markup_edits), 1)
+            self.assertFalse(router._edit_is_unchanged((1, 10), b'rerender'))
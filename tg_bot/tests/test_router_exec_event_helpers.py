@@ -0,0 +1,41 @@
+import unittest
+
+from tg_bot.router import (
+    _detail_from_args,
+    _detail_from_tool_input,
+    _exit_code_from_output,
+    _exit_code_from_tool_output,
+    _fmt_elapsed,
+    _short,
+)
+
+
+class TestRouterExecEventHelpers(unittest.TestCase):
+    def test_fmt_elapsed(self) -> None:
+        self.assertEqual(_fmt_elapsed(100.0, 95.0), '+0:05')
+        self.assertEqual(_fmt_elapsed(3725.0, 0.0), '+1:02:05')
+        self.assertEqual(_fmt_elapsed(0.0, 10.0), '+0:00')
+
+    def test_short(self) -> None:
+        self.assertEqual(_short('  ls -la  ', 60), 'ls -la')
+        self.assertEqual(_short('a\nb', 60), 'a b')
+        self.assertEqual(_short('a\r\nb\tc\n', 60), 'a  b c')
+        self.assertEqual(_short('abcdef', 4), 'abc…')
+        self.assertEqual(_short('', 10), '')
+
+    def test_exit_codes(self) -> None:
+        self.assertEqual(_exit_code_from_output('Exit code: 2\nWall time: 1s'), 2)
+        self.assertIsNone(_exit_code_from_output('no code here'))
+        self.assertEqual(_exit_code_from_tool_output('{"output": "x", "metadata": {"exit_code": 1}}'), 1)
+        self.assertEqual(_exit_code_from_tool_output({'metadata': {'exit_code': '0'}}), 0)
+        self.assertIsNone(_exit_code_from_tool_output('{"output": "x"}'))
+
+    def test_details(self) -> None:
+        self.assertEqual(_detail_from_args('shell_command', '{"command": "git status"}'), 'git status')
+        self.assertEqual(_detail_from_args('shell_command', None), '')
+        self.assertEqual(_detail_from_args('view_image', '{"path": "a.png"}'), "path='a.png'")
+        big = _detail_from_args('write', {'path': 'x.txt', 'content': 'y' * 10_000, 'mode': 'w'})
+        self.assertTrue(big.startswith("path='x.txt', content='yyy"))
+        self.assertLessEqual(len(big), 140)
+        patch = '*** Begin Patch\n*** Update File: a.py\n*** Add File: b.py\n*** End Patch'
+        self.assertEqual(_detail_from_tool_input('apply_patch', patch), 'a.py (+1)')
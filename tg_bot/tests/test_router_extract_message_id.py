@@ -0,0 +1,12 @@
+import unittest
+
+from tg_bot.router import _extract_message_id
+
+
+class TestExtractMessageId(unittest.TestCase):
+    def test_sent_message_id_is_returned(self) -> None:
+        self.assertEqual(_extract_message_id({'ok': True, 'result': {'message_id': 42}}), 42)
+
+    def test_missing_or_malformed_responses_yield_zero(self) -> None:
+        for resp in (None, {}, {'ok': False}, {'result': None}, {'result': True}, {'result': {'message_id': None}}):
+            self.assertEqual(_extract_message_id(resp), 0, resp)
@@ -0,0 +1,93 @@
+import threading
+import time
+import unittest
+
+from tg_bot.router import _HEARTBEAT_IO_WORKERS, _HeartbeatScheduler
+
+
+class TestHeartbeatScheduler(unittest.TestCase):
+    def test_heartbeats_share_one_thread_and_stop_cleanly(self) -> None:
+        sched = _HeartbeatScheduler(tick_seconds=0.01)
+        seen: dict[str, set[str]] = {'a': set(), 'b': set()}
+        counts = {'a': 0, 'b': 0}
+
+        def _tick(tag: str):
+            def tick(now_ts: float) -> None:
+                seen[tag].add(threading.current_thread().name)
+                counts[tag] += 1
+
+            return tick
+
+        stop_a, hb_a = sched.register(_tick('a'))
+        stop_b, hb_b = sched.register(_tick('b'))
+
+        deadline = time.monotonic() + 2.0
+        while time.monotonic() < deadline and (counts['a'] < 3 or counts['b'] < 3):
+            time.sleep(0.01)
+        self.assertGreaterEqual(counts['a'], 3)
+        self.assertGreaterEqual(counts['b'], 3)
+        self.assertEqual(seen['a'], {'tg-heartbeat'})
+        self.assertEqual(seen['a'], seen['b'])
+
+        stop_a.set()
+        hb_a.join(timeout=1.0)
+        self.assertFalse(hb_a.is_alive())
+        frozen = counts['a']
+        time.sleep(0.05)
+        self.assertEqual(counts['a'], frozen)
+
+        stop_b.set()
+        hb_b.join(timeout=1.0)
+        deadline = time.monotonic() + 2.0
+        while time.monotonic() < deadline and sched._thread is not None:
+            time.sleep(0.01)
+        self.assertIsNone(sched._thread)
+
+    def test_join_on_idle_heartbeat_does_not_wait_for_timeout(self) -> None:
+        sched = _HeartbeatScheduler(tick_seconds=10.0)
+        stop, hb = sched.register(lambda now_ts: None)
+        stop.set()
+        t0 = time.monotonic()
+        hb.join(timeout=1.0)
+        self.assertLess(time.monotonic() - t0, 0.5)
+        self.assertFalse(hb.is_alive())
+
+    def test_blocked_io_in_one_chat_does_not_stall_other_heartbeats(self) -> None:
+        sched = _HeartbeatScheduler(tick_seconds=0.01)
+        release = threading.Event()
+        slow_calls: list[str] = []
+        fast_calls: list[threading.Thread] = []
+
+        def slow_tick(now_ts: float):
+            def io() -> None:
+                slow_calls.append(threading.current_thread().name)
+                release.wait(2.0)
+
+            return io
+
+        def fast_tick(now_ts: float):
+            return lambda: fast_calls.append(threading.current_thread())
+
+        stop_slow, hb_slow = sched.register(slow_tick)
+        stop_fast, hb_fast = sched.register(fast_tick)
+
+        deadline = time.monotonic() + 2.0
+        while time.monotonic() < deadline and len(fast_calls) < 10:
+            time.sleep(0.01)
+        self.assertGreaterEqual(len(fast_calls), 10)
+        self.assertEqual({t.name for t in fast_calls}, {'tg-heartbeat-io'})
+        # Rounds reuse the persistent I/O workers instead of starting a thread per call.
+        self.assertLessEqual(len(set(fast_calls)), _HEARTBEAT_IO_WORKERS)
+        # The stuck chat skips rounds instead of queueing more I/O behind the blocked call.
+        self.assertEqual(len(slow_calls), 1)
+
+        stop_slow.set()
+        hb_slow.join(timeout=0.05)
+        self.assertTrue(hb_slow.is_alive())
+        release.set()
+        hb_slow.join(timeout=1.0)
+        self.assertFalse(hb_slow.is_alive())
+
+        stop_fast.set()
+        hb_fast.join(timeout=1.0)
+        self.assertFalse(hb_fast.is_alive())
@@ -0,0 +1,19 @@
+import unittest
+
+from tg_bot.router import _md_is_safe
+
+
+class TestRouterMdIsSafe(unittest.TestCase):
+    def test_balanced_markup_is_safe(self) -> None:
+        self.assertTrue(_md_is_safe('plain text'))
+        self.assertTrue(_md_is_safe('*bold* and _italic_ and `code`'))
+        self.assertTrue(_md_is_safe('```\nprint(a_b * c)\n```'))
+        self.assertTrue(_md_is_safe('see [docs](https://example.com/a_b)'))
+        self.assertTrue(_md_is_safe('snake\\_case'))
+
+    def test_unbalanced_markup_is_unsafe(self) -> None:
+        self.assertFalse(_md_is_safe('snake_case'))
+        self.assertFalse(_md_is_safe('2 * 3'))
+        self.assertFalse(_md_is_safe('`unterminated'))
+        self.assertFalse(_md_is_safe('[1] footnote'))
+        self.assertFalse(_md_is_safe('*bold _nested_*'))
@@ -424,6 +424,143 @@ class TestRouterQueueCallbacks(unittest.TestCase):
             self.assertIn('spool text', text)
             self.assertNotIn('Очередь пуста', text)
 
+    def test_queue_page_takes_one_snapshot_sized_for_the_page(self) -> None:
+        with tempfile.TemporaryDirectory() as td:
+            state_path = Path(td) / 'state.json'
+            state_path.write_text('{}', encoding='utf-8')
+            st = BotState(path=state_path)
+            st.load()
+
+            calls: list[int] = []
+            queue: list[str] = []
+
+            def snapshot(max_items: int) -> dict[str, Any]:
+                # Like the real provider: heads are capped at max_items (empty for max_items=0).
+                calls.append(int(max_items))
+                return {'main_n': len(queue), 'prio_n': 0, 'paused_n': 0, 'main_head': queue[: max(0, max_items)]}
+
+            api = _FakeAPI()
+            router = _mk_router(
+                api=api,
+                state=st,
+                snapshot=snapshot,
+                drop=lambda _: {},
+                mutate=lambda *_: {'ok': False, 'error': 'not_used'},
+                edit_active=lambda: False,
+                edit_set=lambda _: None,
+            )
+
+            router.handle_callback(chat_id=1, user_id=1, data='queue:0', callback_query_id='cb', message_id=10)
+            self.assertEqual(calls, [5])
+            self.assertIn('Очередь пуста', api.edits[-1]['text'])
+
+            queue.extend('abcdefg')
+            calls.clear()
+            router.handle_callback(chat_id=1, user_id=1, data='queue:1', callback_query_id='cb', message_id=10)
+            self.assertEqual(calls, [10])
+            self.assertIn('  6. [M] f', api.edits[-1]['text'])
+
+            # A stale page past the end is clamped to the last page, rendered from the same snapshot.
+            queue.pop()
+            calls.clear()
+            router.handle_callback(chat_id=1, user_id=1, data='queue:9', callback_query_id='cb', message_id=10)
+            self.assertEqual(calls, [50])
+            self.assertIn('  6. [M] f', api.edits[-1]['text'])
+            self.assertNotIn('[M] g', api.edits[-1]['text'])
+
+            # A huge page number sizes the snapshot by the real queue length, not by the callback data.
+            calls.clear()
+            router.handle_callback(chat_id=1, user_id=1, data='queue:999999', callback_query_id='cb', message_id=10)
+            self.assertEqual(calls, [0, 10])
+            self.assertIn('  6. [M] f', api.edits[-1]['text'])
+
+    def test_repeated_page_click_does_not_re_edit_unchanged_message(self) -> None:
+        with tempfile.TemporaryDirectory() as td:
+            state_path = Path(td) / 'state.json'
+            state_path.write_text('{}', encoding='utf-8')
+            st = BotState(path=state_path)
+            st.load()
+
+            api = _FakeAPI()
+            router = _mk_router(
+                api=api,
+                state=st,
+                snapshot=lambda _: {'main_n': 0, 'prio_n': 0, 'paused_n': 0},
+                drop=lambda _: {},
+                mutate=lambda *_: {'ok': False, 'error': 'not_used'},
+                edit_active=lambda: False,
+                edit_set=lambda _: None,
+            )
+
+            for _ in range(3):
+                router.handle_callback(chat_id=1, user_id=1, data='queue:0', callback_query_id='cb', message_id=10)
+            self.assertEqual(len(api.edits), 1)
+            self.assertEqual(api.sends, [])
+
+    def test_click_burst_marks_user_activity_once(self) -> None:
+        with tempfile.TemporaryDirectory() as td:
+            state_path = Path(td) / 'state.json'
+            state_path.write_text('{}', encoding='utf-8')
+            st = BotState(path=state_path)
+            st.load()
+            marks: list[int] = []
+            mark_user_activity = st.mark_user_activity
+
+            def _mark(**kwargs: Any) -> None:
+                marks.append(int(kwargs['user_id']))
+                mark_user_activity(**kwargs)
+
+            st.mark_user_activity = _mark  # type: ignore[method-assign]
+
+            api = _FakeAPI()
+            router = _mk_router(
+                api=api,
+                state=st,
+                snapshot=lambda _: {'main_n': 0, 'prio_n': 0, 'paused_n': 0},
+                drop=lambda _: {},
+                mutate=lambda *_: {'ok': False, 'error': 'not_used'},
+                edit_active=lambda: False,
+                edit_set=lambda _: None,
+            )
+
+            for page in range(3):
+                router.handle_callback(
+                    chat_id=1, user_id=1, data=f'queue:{page}', callback_query_id='cb', message_id=10
+                )
+            self.assertEqual(marks, [1])
+            self.assertGreater(st.last_user_msg_ts_for_chat(chat_id=1), 0.0)
+
+            # A watcher ping since the last mark: the next click must disarm it despite the throttle.
+            with st.lock:
+                st.last_ping_stage = 1
+                st.last_ping_ts = 123.0
+            router.handle_callback(chat_id=1, user_id=1, data='queue:0', callback_query_id='cb', message_id=10)
+            self.assertEqual(marks, [1, 1])
+            self.assertFalse(st.ping_pending())
+
+    def test_queue_navigation_clicks_skip_history(self) -> None:
+        with tempfile.TemporaryDirectory() as td:
+            state_path = Path(td) / 'state.json'
+            state_path.write_text('{}', encoding='utf-8')
+            st = BotState(path=state_path)
+            st.load()
+
+            api = _FakeAPI()
+            router = _mk_router(
+                api=api,
+                state=st,
+                snapshot=lambda _: {'main_n': 0, 'prio_n': 0, 'paused_n': 0},
+                drop=lambda _: {},
+                mutate=lambda *_: {'ok': False, 'error': 'not_used'},
+                edit_active=lambda: False,
+                edit_set=lambda _: None,
+            )
+
+            for data in ('queue:0', 'queue:1', 'queue_edit:0', 'queue_done:0'):
+                router.handle_callback(chat_id=1, user_id=1, data=data, callback_query_id='cb', message_id=10)
+            self.assertEqual([h for h in st.history if h.get('kind') == 'button'], [])
+            self.assertEqual(st.metrics_snapshot().get('history.button.skipped'), 4)
+
     def test_queue_item_spool_renders_in_edit_mode(self) -> None:
         with tempfile.TemporaryDirectory() as td:
             state_path = Path(td) / 'state.json'
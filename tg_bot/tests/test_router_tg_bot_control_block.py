@@ -0,0 +1,25 @@
+import unittest
+
+from tg_bot.router import _TG_BOT_MENTION_RE, _extract_tg_bot_control_block
+
+
+class TestRouterTgBotControlBlock(unittest.TestCase):
+    def test_plain_text_is_returned_unchanged(self) -> None:
+        self.assertEqual(_extract_tg_bot_control_block('hello\nworld'), ('hello\nworld', None))
+
+    def test_fenced_block_is_stripped(self) -> None:
+        text, ctrl = _extract_tg_bot_control_block('Готово.\n```tg_bot\n{"dangerous_confirm": true}\n```\n')
+        self.assertEqual(text, 'Готово.')
+        self.assertIsNotNone(ctrl)
+        assert ctrl is not None
+        self.assertTrue(ctrl.get('dangerous_confirm'))
+
+    def test_trailing_raw_json_is_stripped(self) -> None:
+        text, ctrl = _extract_tg_bot_control_block('Готово.\ntg_bot\n{"dangerous_confirm": true}')
+        self.assertEqual(text, 'Готово.')
+        self.assertIsNotNone(ctrl)
+
+    def test_mention_gate_matches_every_tag_spelling(self) -> None:
+        for tag in ('tg_bot', 'tg-bot', 'tgctl', 'tg_bot_ctl'):
+            self.assertIsNotNone(_TG_BOT_MENTION_RE.search(f'ok\n```{tag}\n{{}}\n```'), tag)
+        self.assertIsNone(_TG_BOT_MENTION_RE.search('plain progress text'))
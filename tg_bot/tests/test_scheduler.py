@@ -1,7 +1,9 @@
+import threading
+import time
 import unittest
 from dataclasses import dataclass
 
-from tg_bot.scheduler import ParallelScheduler
+from tg_bot.scheduler import ParallelScheduler, ScopeLanes
 
 
 @dataclass(frozen=True)
@@ -126,3 +128,31 @@ class TestParallelScheduler(unittest.TestCase):
         self.assertTrue(s.mutate_main(action='del', index=1)['ok'])
         snap3 = s.snapshot(max_items=10)
         self.assertEqual([x.split(': ', 1)[-1] for x in snap3['main_head']], ['c', 'b'])
+
+
+class TestScopeLanes(unittest.TestCase):
+    def test_slow_scope_does_not_block_other_scopes(self) -> None:
+        lanes = ScopeLanes(name='test-lane')
+        release = threading.Event()
+        done: list[str] = []
+        done_lock = threading.Lock()
+
+        def _job(tag: str, *, block: bool = False) -> None:
+            if block:
+                release.wait(timeout=5.0)
+            with done_lock:
+                done.append(tag)
+
+        lanes.submit(lambda: _job('a1', block=True), chat_id=1)
+        lanes.submit(lambda: _job('a2'), chat_id=1)
+        lanes.submit(lambda: _job('b1'), chat_id=2)
+
+        deadline = time.monotonic() + 2.0
+        while time.monotonic() < deadline and 'b1' not in done:
+            time.sleep(0.01)
+        self.assertEqual(done, ['b1'])
+
+        self.assertFalse(lanes.join(timeout=0.05))
+        release.set()
+        self.assertTrue(lanes.join(timeout=2.0))
+        self.assertEqual(done, ['b1', 'a1', 'a2'])
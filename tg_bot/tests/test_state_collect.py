@@ -97,6 +97,8 @@ class TestCollectStateSlice(unittest.TestCase):
 
             self.assertEqual(st.status(chat_id=1, message_thread_id=0), 'pending')
             self.assertEqual(st.status(chat_id=1, message_thread_id=1), 'pending')
+            self.assertEqual(st.collect_pending_count(chat_id=1, message_thread_id=0), 1)
+            self.assertEqual(st.collect_pending_count(chat_id=1, message_thread_id=5), 0)
 
             first = st.start(chat_id=1, message_thread_id=0)
             self.assertIsNotNone(first)
@@ -104,6 +106,31 @@ class TestCollectStateSlice(unittest.TestCase):
             self.assertEqual(st.status(chat_id=1, message_thread_id=0), 'active')
             self.assertEqual(st.status(chat_id=1, message_thread_id=1), 'pending')
 
+    def test_snapshot_for_chat_reads_scope_state(self) -> None:
+        with tempfile.TemporaryDirectory() as td:
+            state_path = Path(td) / 'state.json'
+            state_path.write_text('{}', encoding='utf-8')
+
+            st = BotState(path=state_path)
+            st.load()
+            st.append(chat_id=1, message_thread_id=2, item={'id': 'p1'})
+            st.set_waiting_for_user(chat_id=1, message_thread_id=2, job={'question': 'q?'})
+            st.init_pending_voice_route(chat_id=1, message_thread_id=2, voice_message_id=10, ttl_seconds=60)
+            st.set_voice_route_choice(
+                chat_id=1, message_thread_id=2, voice_message_id=10, choice='read', ttl_seconds=60
+            )
+
+            snap = st.snapshot_for_chat(chat_id=1, message_thread_id=2, voice_message_id=10)
+            self.assertEqual(snap.collect_status, 'pending')
+            self.assertEqual((snap.waiting_for_user or {}).get('question'), 'q?')
+            self.assertIsNotNone(snap.pending_voice_route)
+            self.assertEqual(snap.voice_route_choice, 'read')
+
+            other = st.snapshot_for_chat(chat_id=1, message_thread_id=0)
+            self.assertEqual(other.collect_status, 'idle')
+            self.assertIsNone(other.waiting_for_user)
+            self.assertIsNone(other.pending_voice_route)
+
     def test_collect_start_cleans_dirty_pending_to_idle_and_persists(self) -> None:
         with tempfile.TemporaryDirectory() as td:
             state_path = Path(td) / 'state.json'
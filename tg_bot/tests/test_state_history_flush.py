@@ -0,0 +1,89 @@
+import contextlib
+import tempfile
+import time
+import unittest
+from pathlib import Path
+
+from tg_bot.state import BotState
+
+
+class TestStateHistoryFlush(unittest.TestCase):
+    def test_append_history_is_written_behind(self) -> None:
+        with tempfile.TemporaryDirectory() as td, contextlib.ExitStack() as stack:
+            state_path = Path(td) / 'state.json'
+            state_path.write_text('{}', encoding='utf-8')
+
+            st = BotState(path=state_path, history_flush_delay_seconds=0.05)
+            st.load()
+            stack.callback(st.close)
+            st.append_history(role='user', kind='text', text='one', chat_id=1)
+            st.append_history(role='bot', kind='text', text='two', chat_id=1)
+
+            # In-memory view is updated synchronously.
+            self.assertEqual([h['text'] for h in st.history], ['one', 'two'])
+
+            deadline = time.monotonic() + 2.0
+            persisted: list[str] = []
+            while time.monotonic() < deadline:
+                st2 = BotState(path=state_path)
+                st2.load()
+                persisted = [h['text'] for h in st2.history]
+                if persisted == ['one', 'two']:
+                    break
+                time.sleep(0.02)
+            self.assertEqual(persisted, ['one', 'two'])
+
+    def test_flush_persists_pending_history(self) -> None:
+        with tempfile.TemporaryDirectory() as td, contextlib.ExitStack() as stack:
+            state_path = Path(td) / 'state.json'
+            state_path.write_text('{}', encoding='utf-8')
+
+            st = BotState(path=state_path, history_flush_delay_seconds=60.0)
+            st.load()
+            stack.callback(st.close)
+            st.append_history(role='user', kind='text', text='hello', chat_id=1)
+            st.flush()
+
+            st2 = BotState(path=state_path)
+            st2.load()
+            self.assertEqual([h['text'] for h in st2.history], ['hello'])
+
+    def test_close_stops_flusher_and_saves_pending_history(self) -> None:
+        with tempfile.TemporaryDirectory() as td:
+            state_path = Path(td) / 'state.json'
+            state_path.write_text('{}', encoding='utf-8')
+
+            st = BotState(path=state_path, history_flush_delay_seconds=60.0)
+            st.load()
+            st.append_history(role='user', kind='text', text='bye', chat_id=1)
+            flusher = st._history_flusher
+            assert flusher is not None
+
+            t0 = time.monotonic()
+            st.close()
+            self.assertLess(time.monotonic() - t0, 1.0)
+            self.assertFalse(flusher.is_alive())
+
+            st2 = BotState(path=state_path)
+            st2.load()
+            self.assertEqual([h['text'] for h in st2.history], ['bye'])
+
+            # With the flusher gone, later appends are saved right away instead of being buffered forever.
+            st.append_history(role='bot', kind='text', text='late', chat_id=1)
+            st3 = BotState(path=state_path)
+            st3.load()
+            self.assertEqual([h['text'] for h in st3.history], ['bye', 'late'])
+
+    def test_append_history_saves_synchronously_without_delay(self) -> None:
+        with tempfile.TemporaryDirectory() as td:
+            state_path = Path(td) / 'state.json'
+            state_path.write_text('{}', encoding='utf-8')
+
+            st = BotState(path=state_path)
+            st.load()
+            st.append_history(role='user', kind='text', text='now', chat_id=1)
+            self.assertIsNone(st._history_flusher)
+
+            st2 = BotState(path=state_path)
+            st2.load()
+            self.assertEqual([h['text'] for h in st2.history], ['now'])
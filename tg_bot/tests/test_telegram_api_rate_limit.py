@@ -0,0 +1,61 @@
+import unittest
+from unittest.mock import patch
+
+from tg_bot.telegram_api import TelegramAPI, _TelegramRateLimiter, _TokenBucket
+
+
+class TestTelegramApiRateLimit(unittest.TestCase):
+    def test_token_bucket_allows_burst_then_asks_to_wait(self) -> None:
+        bucket = _TokenBucket(rate=1.0, capacity=3)
+        self.assertEqual([bucket.reserve() for _ in range(3)], [0.0, 0.0, 0.0])
+        self.assertGreater(bucket.reserve(), 0.9)
+
+    def test_penalize_delays_next_reservation(self) -> None:
+        bucket = _TokenBucket(rate=10.0, capacity=10)
+        bucket.penalize(5.0)
+        self.assertGreater(bucket.reserve(), 4.9)
+
+    def test_per_chat_limit_is_isolated(self) -> None:
+        limiter = _TelegramRateLimiter(per_second=0.0, per_chat_per_second=1.0, per_chat_burst=1.0)
+        with patch('tg_bot.telegram_api.time.sleep') as sleep:
+            limiter.wait(1)
+            limiter.wait(2)
+            sleep.assert_not_called()
+            limiter.wait(1)
+            sleep.assert_called_once()
+
+    def test_429_retry_after_pauses_chat(self) -> None:
+        api = TelegramAPI(token='t', prefer_local=False)
+        err = RuntimeError('Telegram HTTPError 429: {"ok":false,"parameters":{"retry_after":7}}')
+        api._note_rate_limited(err, chat_id=5)
+        with patch('tg_bot.telegram_api.time.sleep') as sleep:
+            api._limiter.wait(5)
+        self.assertGreater(sleep.call_args[0][0], 6.9)
+
+    def test_string_and_int_chat_ids_share_a_bucket(self) -> None:
+        limiter = _TelegramRateLimiter(per_second=0.0, per_chat_per_second=1.0, per_chat_burst=1.0)
+        with patch('tg_bot.telegram_api.time.sleep') as sleep:
+            limiter.wait(5)
+            limiter.wait('5')
+        sleep.assert_called_once()
+
+    def test_only_sends_wait_and_edits_fail_fast_while_paused(self) -> None:
+        api = TelegramAPI(token='t', prefer_local=False, rate_limit_per_chat_per_second=1.0)
+        calls: list[str] = []
+        with (
+            patch.object(TelegramAPI, '_request_json_once', lambda self, **kw: calls.append(kw['method']) or {}),
+            patch('tg_bot.telegram_api.time.sleep') as sleep,
+        ):
+            for i in range(5):
+                api._request_json('editMessageText', {'chat_id': 5, 'message_id': i, 'text': 'x'})
+            api._request_json('answerCallbackQuery', {'callback_query_id': 'q'})
+            sleep.assert_not_called()
+
+            api._note_rate_limited(RuntimeError('Telegram HTTPError 429: {"retry_after":7}'), chat_id=5)
+            with self.assertRaisesRegex(RuntimeError, 'HTTPError 429'):
+                api._request_json('editMessageText', {'chat_id': 5, 'message_id': 9, 'text': 'x'})
+            sleep.assert_not_called()
+
+            api._request_json('sendMessage', {'chat_id': 5, 'text': 'x'})
+            self.assertGreater(sleep.call_args[0][0], 6.9)
+        self.assertEqual(calls, ['editMessageText'] * 5 + ['answerCallbackQuery', 'sendMessage'])
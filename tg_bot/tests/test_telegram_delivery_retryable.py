@@ -48,3 +48,24 @@ class TestTelegramDeliveryRetryable(unittest.TestCase):
             self.assertFalse(
                 api._is_retryable_error(RuntimeError("Telegram API error: {'ok': False, 'error_code': 400}"))
             )
+
+    def test_backoff_is_jittered_and_honors_retry_after(self) -> None:
+        with tempfile.TemporaryDirectory() as td:
+            root = Path(td)
+            state_path = root / 'state.json'
+            state_path.write_text('{}', encoding='utf-8')
+            st = BotState(path=state_path)
+            st.load()
+
+            api = TelegramDeliveryAPI(api=_NoopAPI(), state=st, log_path=root / 'net.log')  # type: ignore[arg-type]
+
+            for attempts, cap in ((1, 2.0), (3, 8.0), (20, 300.0)):
+                d = api._backoff(attempts)
+                self.assertGreaterEqual(d, cap / 2)
+                self.assertLessEqual(d, cap)
+
+            err = RuntimeError(
+                'Telegram HTTPError 429: {"ok":false,"error_code":429,'
+                '"description":"Too Many Requests: retry after 37","parameters":{"retry_after":37}}'
+            )
+            self.assertGreaterEqual(api._backoff(1, err), 37.0)
@@ -17,9 +17,11 @@ class _FakeAPI:
         self.edits: list[dict[str, Any]] = []
         self.reply_markup_edits: list[dict[str, Any]] = []
         self.chunks: list[dict[str, Any]] = []
+        self.answered: list[str] = []
         self._next_message_id = 100
 
     def answer_callback_query(self, *, callback_query_id: str, text: str | None = None) -> None:
+        self.answered.append(str(callback_query_id))
         return None
 
     def send_message(
@@ -212,6 +214,29 @@ class TestVoiceRoute(unittest.TestCase):
             st.pop_pending_voice_route(chat_id=1, voice_message_id=10)
             self.assertIsNone(st.pending_voice_route(chat_id=1, voice_message_id=10))
 
+    def test_state_wait_voice_route_choice_wakes_on_choice(self) -> None:
+        with tempfile.TemporaryDirectory() as td:
+            state_path = Path(td) / 'state.json'
+            state_path.write_text('{}', encoding='utf-8')
+            st = BotState(path=state_path)
+            st.load()
+
+            st.init_pending_voice_route(chat_id=1, voice_message_id=10, ttl_seconds=60)
+            self.assertIsNone(st.wait_voice_route_choice(chat_id=1, voice_message_id=10, timeout_seconds=0.05))
+
+            def _late_choice() -> None:
+                time.sleep(0.05)
+                st.set_voice_route_choice(chat_id=1, voice_message_id=10, choice='write', ttl_seconds=60)
+
+            t = threading.Thread(target=_late_choice, daemon=True)
+            t.start()
+            t0 = time.monotonic()
+            choice = st.wait_voice_route_choice(chat_id=1, voice_message_id=10, timeout_seconds=5.0)
+            t.join(timeout=2.0)
+
+            self.assertEqual(choice, 'write')
+            self.assertLess(time.monotonic() - t0, 2.0)
+
     def test_router_callback_sets_choice_and_updates_keyboard(self) -> None:
         with tempfile.TemporaryDirectory() as td:
             state_path = Path(td) / 'state.json'
@@ -230,12 +255,99 @@ class TestVoiceRoute(unittest.TestCase):
                 callback_query_id='cb',
                 message_id=999,
             )
+            router._markup_lanes.join(timeout=2.0)
 
             self.assertEqual(st.pending_voice_route_choice(chat_id=1, voice_message_id=555), 'read')
             self.assertTrue(api.reply_markup_edits)
             last = api.reply_markup_edits[-1]
             self.assertEqual(last['message_id'], 999)
             self.assertIsInstance(last['reply_markup'], dict)
+            self.assertEqual(api.answered, ['cb'])
+
+    def test_router_callback_skips_answer_when_already_answered(self) -> None:
+        with tempfile.TemporaryDirectory() as td:
+            state_path = Path(td) / 'state.json'
+            state_path.write_text('{}', encoding='utf-8')
+            st = BotState(path=state_path)
+            st.load()
+
+            api = _FakeAPI()
+            router = _mk_router(api=api, state=st, codex=_FakeCodexRunner(), repo_root=Path(td))
+
+            router.handle_callback(
+                chat_id=1,
+                user_id=1,
+                data=f'{keyboards.CB_VOICE_ROUTE_PREFIX}555:w',
+                callback_query_id='cb',
+                message_id=999,
+                callback_answered=True,
+            )
+
+            self.assertEqual(st.pending_voice_route_choice(chat_id=1, voice_message_id=555), 'write')
+            self.assertEqual(api.answered, [])
+
+    def test_router_callback_ignores_malformed_voice_route_payload(self) -> None:
+        with tempfile.TemporaryDirectory() as td:
+            state_path = Path(td) / 'state.json'
+            state_path.write_text('{}', encoding='utf-8')
+            st = BotState(path=state_path)
+            st.load()
+
+            api = _FakeAPI()
+            router = _mk_router(api=api, state=st, codex=_FakeCodexRunner(), repo_root=Path(td))
+
+            for data in ('555:r:x', 'abc:r', '555'):
+                router.handle_callback(
+                    chat_id=1,
+                    user_id=1,
+                    data=f'{keyboards.CB_VOICE_ROUTE_PREFIX}{data}',
+                    callback_query_id='cb',
+                    message_id=999,
+                )
+            router._markup_lanes.join(timeout=2.0)
+
+            self.assertIsNone(st.pending_voice_route_choice(chat_id=1, voice_message_id=555))
+            self.assertEqual(api.reply_markup_edits, [])
+
+    def test_router_callback_rapid_toggles_send_only_latest_keyboard(self) -> None:
+        with tempfile.TemporaryDirectory() as td:
+            state_path = Path(td) / 'state.json'
+            state_path.write_text('{}', encoding='utf-8')
+            st = BotState(path=state_path)
+            st.load()
+
+            entered = threading.Event()
+            release = threading.Event()
+
+            class _SlowEditAPI(_FakeAPI):
+                def edit_message_reply_markup(self, **kwargs: Any) -> None:
+                    entered.set()
+                    release.wait(timeout=2.0)
+                    super().edit_message_reply_markup(**kwargs)
+
+            api = _SlowEditAPI()
+            router = _mk_router(api=api, state=st, codex=_FakeCodexRunner(), repo_root=Path(td))
+
+            def _click(mode: str) -> None:
+                router.handle_callback(
+                    chat_id=1,
+                    user_id=1,
+                    data=f'{keyboards.CB_VOICE_ROUTE_PREFIX}555:{mode}',
+                    callback_query_id='cb',
+                    message_id=999,
+                )
+
+            _click('r')
+            self.assertTrue(entered.wait(timeout=2.0))
+            for mode in ('w', 'd', 'n'):
+                _click(mode)
+            release.set()
+            router._markup_lanes.join(timeout=2.0)
+
+            self.assertEqual(st.pending_voice_route_choice(chat_id=1, voice_message_id=555), 'none')
+            self.assertEqual(len(api.reply_markup_edits), 2)
+            labels = [b['text'] for row in api.reply_markup_edits[-1]['reply_markup']['inline_keyboard'] for b in row]
+            self.assertIn('✅ ∅ none', labels)
 
     def test_router_handle_text_applies_voice_route_read_prefix(self) -> None:
         with tempfile.TemporaryDirectory() as td:
@@ -260,6 +372,7 @@ class TestVoiceRoute(unittest.TestCase):
                 message_id=123,
                 ack_message_id=777,
             )
+            router._markup_lanes.join(timeout=2.0)
 
             self.assertIsNone(st.pending_voice_route(chat_id=1, voice_message_id=123))
             self.assertTrue(any(c[0] == 'run_with_progress' and c[1]['automation'] is False for c in codex.calls))